@@ -0,0 +1,86 @@
+#Generates synthetic input corpora for the benchmarks: prose documents (txt/md, plus PDF when
+#reportlab is installed), Python source files, and large CSVs written in bounded memory.
+
+import os
+import csv
+import random
+
+_WORDS = (
+    "data pipeline model training schema quality record batch token stream worker queue "
+    "latency throughput memory cache index shard result chunk parser recipe answer question "
+    "summary function class module request response failure retry limit budget cluster"
+).split()
+
+def _sentence(rng: random.Random) -> str:
+    words = [rng.choice(_WORDS) for _ in range(rng.randint(8, 20))]
+    return " ".join(words).capitalize() + "."
+
+def _paragraph(rng: random.Random) -> str:
+    return " ".join(_sentence(rng) for _ in range(rng.randint(3, 8)))
+
+def make_text_corpus(directory: str, documents: int = 20, paragraphs: int = 40, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(documents):
+        ext = ".md" if i % 2 else ".txt"
+        path = os.path.join(directory, f"document_{i}{ext}")
+        with open(path, "w") as f:
+            for p in range(paragraphs):
+                if ext == ".md" and p % 10 == 0:
+                    f.write(f"## Section {p // 10 + 1}\n\n")
+                f.write(_paragraph(rng) + "\n\n")
+        paths.append(path)
+    paths.extend(_maybe_make_pdfs(directory, max(1, documents // 10), paragraphs, rng))
+    return paths
+
+def _maybe_make_pdfs(directory: str, documents: int, paragraphs: int, rng: random.Random) -> list:
+    try:
+        from reportlab.lib.pagesizes import letter
+        from reportlab.platypus import SimpleDocTemplate, Paragraph
+        from reportlab.lib.styles import getSampleStyleSheet
+    except ImportError:
+        print("--- Benchmark corpus: reportlab not installed, skipping PDFs. ---")
+        return []
+    style = getSampleStyleSheet()["BodyText"]
+    paths = []
+    for i in range(documents):
+        path = os.path.join(directory, f"document_{i}.pdf")
+        SimpleDocTemplate(path, pagesize=letter).build([Paragraph(_paragraph(rng), style) for _ in range(paragraphs)])
+        paths.append(path)
+    return paths
+
+def make_code_corpus(directory: str, files: int = 50, functions: int = 20, seed: int = 0) -> list:
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    paths = []
+    for i in range(files):
+        path = os.path.join(directory, f"module_{i}.py")
+        with open(path, "w") as f:
+            f.write(f'"""Synthetic module {i}."""\n\nimport os\n\n')
+            for j in range(functions):
+                name = f"{rng.choice(_WORDS)}_{rng.choice(_WORDS)}_{j}"
+                f.write(f"def {name}(value, limit={rng.randint(1, 100)}):\n")
+                f.write(f'    """{_sentence(rng)}"""\n')
+                f.write("    # Clamp to the configured limit\n")
+                f.write("    total = 0\n    for item in range(limit):\n        total += item * value\n")
+                f.write("    return min(total, limit)\n\n")
+            f.write(f"class Handler{i}:\n    \"\"\"{_sentence(rng)}\"\"\"\n\n")
+            for j in range(3):
+                f.write(f"    def handle_{j}(self, request):\n        return request.get('{rng.choice(_WORDS)}')\n\n")
+        paths.append(path)
+    return paths
+
+def make_csv(directory: str, rows: int = 1_000_000, seed: int = 0, block_rows: int = 50_000) -> str:
+    rng = random.Random(seed)
+    os.makedirs(directory, exist_ok=True)
+    path = os.path.join(directory, f"table_{rows}.csv")
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["id", "category", "score", "comment"])
+        for start in range(0, rows, block_rows):
+            writer.writerows(
+                (i, rng.choice(_WORDS), round(rng.random() * 100, 3), _sentence(rng))
+                for i in range(start, min(rows, start + block_rows))
+            )
+    return path
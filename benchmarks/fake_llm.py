@@ -0,0 +1,104 @@
+#Local stand-in LLM used by the benchmarks. It answers with schema-shaped JSON for the recipe
+#named in the system prompt (single or batched), after a configurable latency, and can inject
+#rate-limit errors and malformed JSON at given rates. FakeProvider plugs it in in-process;
+#benchmarks/openai_stub.py serves the same answers over the OpenAI-compatible HTTP API.
+
+import re
+import json
+import random
+import asyncio
+
+from src.schemas import get_schema_for_recipe
+from src.tokens import estimate_tokens
+from src.providers import LLMProvider, LLMResponse, RateLimitError
+
+_RECIPE_LINE = re.compile(r"^RECIPE: (\S+)$", re.M)
+_BATCH_INDEX = re.compile(r"^\[(\d+)\]$", re.M)
+
+def parse_latency(spec: str):
+    """
+    Latency distributions: "const:0.2", "uniform:0.05,0.5", "lognormal:MU,SIGMA"
+    (seconds, SIGMA/MU of the underlying normal) or "0" for none.
+    """
+    kind, _, args = spec.partition(":")
+    values = [float(v) for v in args.split(",")] if args else []
+    if kind in ("0", "none"):
+        return lambda rng: 0.0
+    if kind == "const":
+        return lambda rng: values[0]
+    if kind == "uniform":
+        return lambda rng: rng.uniform(values[0], values[1])
+    if kind == "lognormal":
+        return lambda rng: rng.lognormvariate(values[0], values[1])
+    raise ValueError(f"Unknown latency distribution: {spec}")
+
+def _fake_value(name: str, spec: dict, snippet: str):
+    if spec.get("type") == "array":
+        return [f"Step {i + 1} for {name}: {snippet[:40]}" for i in range(3)]
+    if spec.get("type") == "integer":
+        return 0
+    if name in ("question", "problem", "instruction"):
+        return f"What does the following passage say about {snippet[:60]}?"
+    return f"Generated {name} describing the passage that begins with: {snippet[:120]}"
+
+def fake_output(recipe_name: str, chunk: str) -> dict:
+    schema = get_schema_for_recipe(recipe_name)
+    snippet = " ".join(chunk.split())[:200] or "empty chunk"
+    return {name: _fake_value(name, spec, snippet) for name, spec in schema["properties"].items()}
+
+class FakeModel:
+    """Answers prompts for one system prompt, the way a real model bound to it would."""
+
+    def __init__(self, model_name: str, system_prompt: str):
+        self.model_name = model_name
+        match = _RECIPE_LINE.search(system_prompt)
+        self.recipe_name = match.group(1) if match else "qna"
+        self.batched = "chunk_index" in system_prompt
+        self.system_prompt_tokens = estimate_tokens(system_prompt)
+
+    def answer(self, prompt: str) -> str:
+        if self.batched:
+            parts = _BATCH_INDEX.split(prompt)
+            # split() gives [preamble, idx0, text0, idx1, text1, ...]
+            results = [
+                {"chunk_index": int(index), "output": fake_output(self.recipe_name, text)}
+                for index, text in zip(parts[1::2], parts[2::2])
+            ]
+            return json.dumps({"results": results})
+        return json.dumps(fake_output(self.recipe_name, prompt))
+
+class FakeBehaviour:
+    """Latency and failure injection shared by FakeProvider and the HTTP stub."""
+
+    def __init__(self, latency: str = "lognormal:-1.6,0.5", rate_limit_rate: float = 0.0,
+                 malformed_rate: float = 0.0, seed: int = 0):
+        self.latency = parse_latency(latency)
+        self.rate_limit_rate = rate_limit_rate
+        self.malformed_rate = malformed_rate
+        self.rng = random.Random(seed)
+
+    async def respond(self, model: FakeModel, prompt: str) -> str | None:
+        """Returns the response text, or None to signal a rate limit."""
+        await asyncio.sleep(self.latency(self.rng))
+        if self.rng.random() < self.rate_limit_rate:
+            return None
+        if self.rng.random() < self.malformed_rate:
+            return '{"results": [{"chunk_index": 0, "output": '
+        return model.answer(prompt)
+
+class FakeProvider(LLMProvider):
+    name = "fake"
+    shared_quota = True # Exercise the limiter like Gemini does
+
+    def __init__(self, behaviour: FakeBehaviour, max_concurrency: int = 10_000):
+        super().__init__(max_concurrency)
+        self.behaviour = behaviour
+
+    def create_model(self, model_name: str, system_prompt: str):
+        return FakeModel(model_name, system_prompt)
+
+    async def generate(self, model: FakeModel, user_prompt: str) -> LLMResponse:
+        text = await self.behaviour.respond(model, user_prompt)
+        if text is None:
+            raise RateLimitError("fake quota exceeded")
+        return LLMResponse(text, model.system_prompt_tokens + estimate_tokens(user_prompt) + estimate_tokens(text))
@@ -0,0 +1,86 @@
+#Import-time benchmark: imports a module (the API, by default) in a fresh interpreter with
+#python -X importtime and reports wall time, RSS and the slowest imports. Fails if any of the
+#heavy pipeline modules get loaded, or if --max-seconds is exceeded, so API startup regressions
+#(a module-level import of the parsers, the graph or an LLM SDK) show up in CI.
+#
+#   python -m benchmarks.import_time
+#   python -m benchmarks.import_time --module worker --allow-heavy
+
+import os
+import sys
+import json
+import argparse
+import subprocess
+
+# Modules only the worker needs; the API must dispatch jobs without importing them
+HEAVY_MODULES = (
+    "worker", "src.graph", "src.utils", "src.generation", "unstructured", "pandas",
+    "langgraph", "google.generativeai", "openai", "tree_sitter",
+)
+
+_PROBE = """
+import sys, time, json, resource
+start = time.perf_counter()
+import {module}
+seconds = time.perf_counter() - start
+print(json.dumps({{"seconds": seconds, "max_rss_mb": resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024,
+                  "modules": sorted(sys.modules)}}))
+"""
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Measure the import time of the API (or another module).")
+    parser.add_argument("--module", default="main")
+    parser.add_argument("--max-seconds", type=float, default=None, help="Fail if the import takes longer")
+    parser.add_argument("--allow-heavy", action="store_true", help="Don't fail when heavy modules are imported")
+    parser.add_argument("--top", type=int, default=15, help="Slowest imports to report")
+    parser.add_argument("--output", default=None)
+    return parser.parse_args(argv)
+
+def _parse_importtime(stderr: str) -> list:
+    """Returns (cumulative_us, module) for top-level imports of -X importtime output."""
+    rows = []
+    for line in stderr.splitlines():
+        if not line.startswith("import time:") or "self [us]" in line:
+            continue
+        _, cumulative, name = line[len("import time:"):].split("|", 2)
+        rows.append((int(cumulative), name.rstrip()))
+    return rows
+
+def measure(module: str, top: int = 15) -> dict:
+    env = dict(os.environ, PYTHONPATH=os.pathsep.join(filter(None, [os.getcwd(), os.environ.get("PYTHONPATH")])))
+    proc = subprocess.run([sys.executable, "-X", "importtime", "-c", _PROBE.format(module=module)],
+                          capture_output=True, text=True, env=env)
+    if proc.returncode != 0:
+        raise RuntimeError(f"import {module} failed:\n{proc.stderr[-4000:]}")
+    probe = json.loads(proc.stdout.strip().splitlines()[-1])
+    rows = _parse_importtime(proc.stderr)
+    loaded = set(probe["modules"])
+    return {
+        "module": module,
+        "seconds": round(probe["seconds"], 3),
+        "max_rss_mb": round(probe["max_rss_mb"], 1),
+        "modules_loaded": len(loaded),
+        "heavy_modules": [name for name in HEAVY_MODULES if name in loaded],
+        "slowest": [{"module": name.strip(), "ms": round(us / 1000, 1)}
+                    for us, name in sorted(rows, reverse=True)[:top]],
+    }
+
+def main(argv=None) -> int:
+    args = parse_args(argv)
+    report = measure(args.module, args.top)
+    print(json.dumps(report, indent=2))
+    if args.output:
+        with open(args.output, "w") as f:
+            json.dump(report, f, indent=2)
+
+    failed = False
+    if report["heavy_modules"] and not args.allow_heavy:
+        print(f"!!! import {args.module} loaded heavy modules: {', '.join(report['heavy_modules'])} !!!")
+        failed = True
+    if args.max_seconds is not None and report["seconds"] > args.max_seconds:
+        print(f"!!! import {args.module} took {report['seconds']}s (budget {args.max_seconds}s) !!!")
+        failed = True
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,89 @@
+#Local OpenAI-compatible server (POST /v1/chat/completions) backed by the fake LLM, for exercising
+#the "openai" provider's HTTP path without a GPU box:
+#
+#   python -m benchmarks.openai_stub --port 8900 --latency const:0.05
+#   OPENAI_BASE_URL=http://127.0.0.1:8900/v1 python -m benchmarks.run_benchmark --model openai:stub
+#
+#run_stub_server() starts it on a background thread for in-process use.
+
+import time
+import socket
+import argparse
+import threading
+from contextlib import contextmanager
+
+import uvicorn
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse
+
+from benchmarks.fake_llm import FakeBehaviour, FakeModel
+from src.tokens import estimate_tokens
+
+def create_stub_app(behaviour: FakeBehaviour) -> FastAPI:
+    app = FastAPI()
+    models = {} # One FakeModel per distinct system prompt, like RecipeClient on the caller's side
+
+    @app.post("/v1/chat/completions")
+    async def chat_completions(request: Request):
+        body = await request.json()
+        system_prompt = next((m["content"] for m in body["messages"] if m["role"] == "system"), "")
+        user_prompt = next((m["content"] for m in reversed(body["messages"]) if m["role"] == "user"), "")
+        model = models.get(system_prompt)
+        if model is None:
+            model = models[system_prompt] = FakeModel(body.get("model", "stub"), system_prompt)
+
+        text = await behaviour.respond(model, user_prompt)
+        if text is None:
+            return JSONResponse({"error": {"message": "stub rate limit", "type": "rate_limit"}}, status_code=429)
+        prompt_tokens = model.system_prompt_tokens + estimate_tokens(user_prompt)
+        completion_tokens = estimate_tokens(text)
+        return {
+            "id": "chatcmpl-stub",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": model.model_name,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": prompt_tokens, "completion_tokens": completion_tokens,
+                      "total_tokens": prompt_tokens + completion_tokens},
+        }
+
+    return app
+
+def _free_port(host: str) -> int:
+    with socket.socket() as s:
+        s.bind((host, 0))
+        return s.getsockname()[1]
+
+@contextmanager
+def run_stub_server(behaviour: FakeBehaviour | None = None, host: str = "127.0.0.1", port: int = 0):
+    """Serves the stub on a background thread and yields its base URL (ending in /v1)."""
+    port = port or _free_port(host)
+    config = uvicorn.Config(create_stub_app(behaviour or FakeBehaviour(latency="0")), host=host, port=port,
+                            log_level="warning")
+    server = uvicorn.Server(config)
+    thread = threading.Thread(target=server.run, daemon=True)
+    thread.start()
+    while not server.started:
+        if not thread.is_alive():
+            raise RuntimeError(f"OpenAI stub server failed to start on {host}:{port}")
+        time.sleep(0.01)
+    try:
+        yield f"http://{host}:{port}/v1"
+    finally:
+        server.should_exit = True
+        thread.join()
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="OpenAI-compatible stub server backed by the fake LLM.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8900)
+    parser.add_argument("--latency", default="lognormal:-1.6,0.5")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0)
+    parser.add_argument("--malformed-rate", type=float, default=0.0)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+    behaviour = FakeBehaviour(args.latency, args.rate_limit_rate, args.malformed_rate, args.seed)
+    uvicorn.run(create_stub_app(behaviour), host=args.host, port=args.port, log_level="warning")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,232 @@
+#Offline end-to-end benchmark: runs run_graph (or the full process_dataset_task) on generated
+#corpora against the fake LLM and reports chunks/sec, peak RSS and per-stage time.
+#
+#   python -m benchmarks.run_benchmark --corpus text,code --recipe qna
+#   python -m benchmarks.run_benchmark --mode task --corpus csv --csv-rows 1000000 --latency const:0.1
+#   python -m benchmarks.run_benchmark --model openai:stub    # HTTP path, via benchmarks/openai_stub.py
+#
+#No API key, Redis or Celery broker needed. Results print as JSON (and go to --output if given)
+#so runs can be diffed to catch regressions or compare configurations.
+
+import os
+import sys
+import json
+import time
+import shutil
+import asyncio
+import argparse
+import resource
+import tempfile
+from contextlib import ExitStack
+
+NODES = ("pipeline_node", "parsing_node", "chunking_node", "generation_node", "aggregate_node", "quality_control_node", "dedup_node")
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Offline pipeline benchmark with a fake LLM.")
+    parser.add_argument("--mode", choices=("graph", "task"), default="graph",
+                        help="graph: run_graph only; task: process_dataset_task with a SQLite DB")
+    parser.add_argument("--corpus", default="text", help="Comma-separated: text, code, csv")
+    parser.add_argument("--recipe", default="qna")
+    parser.add_argument("--model", default="fake:benchmark",
+                        help="fake:NAME runs in-process; openai:NAME goes over HTTP to the stub server "
+                             "(or to OPENAI_BASE_URL if set)")
+    parser.add_argument("--documents", type=int, default=20)
+    parser.add_argument("--code-files", type=int, default=50)
+    parser.add_argument("--csv-rows", type=int, default=1_000_000)
+    parser.add_argument("--latency", default="lognormal:-1.6,0.5", help="const:S, uniform:A,B or lognormal:MU,SIGMA")
+    parser.add_argument("--rate-limit-rate", type=float, default=0.0, help="Fraction of calls raising ResourceExhausted")
+    parser.add_argument("--malformed-rate", type=float, default=0.0, help="Fraction of calls returning broken JSON")
+    parser.add_argument("--concurrency", type=int, default=64, help="LLM_MAX_CONCURRENCY for the run")
+    parser.add_argument("--batch-size", type=int, default=None, help="GENERATION_BATCH_SIZE (1 disables batching)")
+    parser.add_argument("--shard-size", type=int, default=None,
+                        help="Task mode: shard jobs above this many chunks into shards of this size (run eagerly)")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workdir", default=None, help="Keep corpora and outputs here instead of a temp dir")
+    parser.add_argument("--output", default=None, help="Also write the report JSON to this file")
+    return parser.parse_args(argv)
+
+def configure_environment(args, workdir: str):
+    # Must run before anything from src is imported: those modules read their settings at import
+    os.environ.setdefault("RATE_LIMIT_REDIS_URL", "")
+    os.environ.setdefault("RESULT_CACHE_BACKEND", "off")
+    os.environ.setdefault("LLM_RPM", str(10 ** 9))
+    os.environ.setdefault("LLM_TPM", str(10 ** 12))
+    os.environ["LLM_MAX_CONCURRENCY"] = str(args.concurrency)
+    os.environ.setdefault("LLM_INITIAL_CONCURRENCY", str(args.concurrency))
+    os.environ["LLM_MODEL"] = args.model
+    os.environ.setdefault("DATABASE_URL", f"sqlite+aiosqlite:///{os.path.join(workdir, 'benchmark.db')}")
+    if args.batch_size is not None:
+        os.environ["GENERATION_BATCH_SIZE"] = str(args.batch_size)
+    if args.shard_size is not None:
+        os.environ["SHARD_MIN_CHUNKS"] = os.environ["SHARD_SIZE_CHUNKS"] = str(args.shard_size)
+
+def build_corpus(args, workdir: str) -> list:
+    from benchmarks.corpora import make_text_corpus, make_code_corpus, make_csv
+    corpus_dir = os.path.join(workdir, "corpus")
+    paths = []
+    for kind in args.corpus.split(","):
+        kind = kind.strip()
+        if kind == "text":
+            paths += make_text_corpus(os.path.join(corpus_dir, "text"), args.documents, seed=args.seed)
+        elif kind == "code":
+            paths += make_code_corpus(os.path.join(corpus_dir, "code"), args.code_files, seed=args.seed)
+        elif kind == "csv":
+            paths.append(make_csv(os.path.join(corpus_dir, "csv"), args.csv_rows, seed=args.seed))
+        else:
+            raise SystemExit(f"Unknown corpus kind: {kind}")
+    return paths
+
+def peak_rss_mb() -> dict:
+    # ru_maxrss is in KiB on Linux; children covers the parser processes
+    return {
+        "self": round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+        "children": round(resource.getrusage(resource.RUSAGE_CHILDREN).ru_maxrss / 1024, 1),
+    }
+
+def stage_times() -> dict:
+    from prometheus_client import REGISTRY
+    stages = {}
+    for node in NODES:
+        total = REGISTRY.get_sample_value("foundry_graph_node_seconds_sum", {"node": node})
+        count = REGISTRY.get_sample_value("foundry_graph_node_seconds_count", {"node": node})
+        if count:
+            # generation_node runs once per batch, concurrently: its sum is task time, not wall time
+            stages[node] = {"seconds": round(total, 3), "runs": int(count)}
+    return stages
+
+def run_graph_mode(args, paths: list) -> dict:
+    from src.graph import run_graph
+    from src.providers import close_providers
+    files = []
+    for path in paths:
+        with open(path, "rb") as f:
+            files.append({"filename": os.path.basename(path), "content": f.read()})
+
+    async def _run_graph():
+        try:
+            return await run_graph(files, args.recipe)
+        finally:
+            await close_providers()
+
+    final_state = asyncio.run(_run_graph())
+    return {
+        "chunks": len(final_state.get("parsed_chunks", [])),
+        "items_accepted": len(final_state.get("generated_data", [])),
+        "items_rejected": len(final_state.get("rejected_data", [])),
+    }
+
+def run_task_mode(args, paths: list) -> dict:
+    import uuid
+    from src.database import engine, Base
+    from src.models import Job
+    from src.sink import rejected_path_for
+    from src.runtime import get_runtime, run_async
+    import worker
+
+    task_id = str(uuid.uuid4())
+    upload_dir = os.path.join(worker.UPLOAD_DIR, task_id)
+    os.makedirs(upload_dir, exist_ok=True)
+    manifest = []
+    for path in paths:
+        shutil.copy(path, upload_dir)
+        manifest.append({"filename": os.path.basename(path), "size": os.path.getsize(path), "sha256": None})
+
+    async def _create_job():
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        async with worker.AsyncSessionLocal() as session:
+            job = Job(task_id=task_id, status="PENDING", recipe=args.recipe, files=manifest)
+            session.add(job)
+            await session.commit()
+            job_id = job.id
+        return job_id
+
+    async def _job_progress():
+        from sqlalchemy import select
+        async with worker.AsyncSessionLocal() as session:
+            job = (await session.execute(select(Job).where(Job.id == job_id))).scalar_one()
+            progress = job.progress or {}
+            result_path = job.result_file_path
+        return progress, result_path
+
+    if args.shard_size is not None:
+        # Shard tasks and the merge chord run in this process instead of going to the broker
+        worker.celery_app.conf.task_always_eager = True
+    # Everything runs on the worker runtime's loop, like in a worker process, so the DB pool is shared
+    job_id = run_async(_create_job())
+    result = worker.process_dataset_task.apply(kwargs={"job_id": job_id}).get()
+    progress, result_path = run_async(_job_progress())
+    get_runtime().stop()
+    result["result_path"] = result_path
+
+    with open(result["result_path"], "rb") as f:
+        accepted = sum(1 for _ in f)
+    with open(rejected_path_for(result["result_path"]), "rb") as f:
+        rejected = sum(1 for _ in f)
+    shutil.rmtree(upload_dir, ignore_errors=True)
+    return {
+        "chunks": progress.get("chunks_total"),
+        "items_accepted": accepted,
+        "items_rejected": rejected,
+        "result_path": result["result_path"],
+    }
+
+def main(argv=None):
+    args = parse_args(argv)
+    workdir = args.workdir or tempfile.mkdtemp(prefix="foundry-bench-")
+    os.makedirs(workdir, exist_ok=True)
+    configure_environment(args, workdir)
+
+    from benchmarks.fake_llm import FakeBehaviour, FakeProvider
+    from src.generation import get_timing_stats
+    from src.providers import register_provider, OpenAICompatibleProvider
+    behaviour = FakeBehaviour(args.latency, args.rate_limit_rate, args.malformed_rate, args.seed)
+    register_provider("fake", FakeProvider(behaviour))
+
+    with ExitStack() as stack:
+        if args.model.startswith("openai:") and not os.environ.get("OPENAI_BASE_URL"):
+            from benchmarks.openai_stub import run_stub_server
+            base_url = stack.enter_context(run_stub_server(behaviour))
+            register_provider("openai", OpenAICompatibleProvider(base_url=base_url))
+        report = _run(args, workdir, get_timing_stats)
+
+    output = json.dumps(report, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, "w") as f:
+            f.write(output + "\n")
+    if not args.workdir:
+        shutil.rmtree(workdir, ignore_errors=True)
+    return report
+
+def _run(args, workdir: str, get_timing_stats) -> dict:
+    corpus_start = time.perf_counter()
+    paths = build_corpus(args, workdir)
+    corpus_seconds = time.perf_counter() - corpus_start
+
+    start = time.perf_counter()
+    outcome = run_graph_mode(args, paths) if args.mode == "graph" else run_task_mode(args, paths)
+    wall_seconds = time.perf_counter() - start
+
+    llm = get_timing_stats()
+    stages = stage_times()
+    chunks = outcome.get("chunks")
+    report = {
+        "config": {k: v for k, v in vars(args).items() if k not in ("output", "workdir")},
+        "input_files": len(paths),
+        "input_bytes": sum(os.path.getsize(p) for p in paths),
+        "corpus_build_seconds": round(corpus_seconds, 2),
+        "wall_seconds": round(wall_seconds, 3),
+        **outcome,
+        "chunks_per_second": round(chunks / wall_seconds, 2) if chunks else None,
+        "items_per_second": round((outcome["items_accepted"] + outcome["items_rejected"]) / wall_seconds, 2),
+        "llm_calls": llm["api_calls"],
+        "llm_rate_limit_retries": llm["rate_limit_retries"],
+        "llm_tokens": llm["tokens"],
+        "peak_rss_mb": peak_rss_mb(),
+        "stages": stages,
+    }
+    return report
+
+if __name__ == "__main__":
+    sys.exit(0 if main() else 1)
@@ -1,12 +1,22 @@
-from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Depends
-from fastapi.responses import FileResponse
+from fastapi import FastAPI, UploadFile, File, HTTPException, Form, Depends, Query, WebSocket, WebSocketDisconnect, Request
+from fastapi.responses import FileResponse, StreamingResponse, Response
+from starlette.concurrency import run_in_threadpool
 from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import select
 from src.database import AsyncSessionLocal
 from src.models import Job
-from worker import process_dataset_task
-from typing import List
+from src.metrics import render_metrics
+from src.providers import parse_model_spec
+from src.events import job_event_stream, status_event, publish_job_event
+from src.exports import EXPORT_FORMATS, EXPORT_MEDIA_TYPES, parse_exports, export_path_for
+from src.archives import parse_globs
+from src.sink import line_index_path_for, build_line_index, read_line_offset, count_lines_before
+from src.task_queue import dispatch_dataset_job, task_is_live
+from typing import List, Optional
+import hashlib
+import json
 import os
+import shutil
 import uuid 
 
 app = FastAPI(title="Dataset Foundry API")
@@ -20,49 +30,374 @@ async def get_db():
 UPLOAD_DIR = "/tmp/uploads"
 RESULT_DIR = "/tmp/results"
 
+# Upload limits. Files are streamed to disk in UPLOAD_CHUNK_SIZE pieces, so memory
+# use per upload stays bounded regardless of file size.
+UPLOAD_CHUNK_SIZE = int(os.environ.get("UPLOAD_CHUNK_SIZE", 1024 * 1024))
+MAX_FILE_BYTES = int(os.environ.get("MAX_UPLOAD_FILE_BYTES", 512 * 1024 * 1024))
+MAX_JOB_BYTES = int(os.environ.get("MAX_UPLOAD_JOB_BYTES", 2 * 1024 * 1024 * 1024))
+
+# Most task IDs accepted by one bulk status request
+BULK_STATUS_MAX_IDS = int(os.environ.get("BULK_STATUS_MAX_IDS", 1000))
+# A retrying job keeps (and resumes into) the results written so far, so they stay downloadable
+PARTIAL_DOWNLOAD_STATUSES = ("PROCESSING", "RETRYING")
+
+def _write_block(buffer, hasher, block: bytes):
+    hasher.update(block)
+    buffer.write(block)
+
+async def save_upload_file(file: UploadFile, file_path: str, max_bytes: int) -> dict:
+    """
+    Streams an upload to disk in fixed-size chunks, hashing it incrementally.
+    Blocking writes and hashing run in the threadpool so the event loop stays free.
+    Raises a 413 as soon as the file grows past max_bytes.
+    """
+    hasher = hashlib.sha256()
+    size = 0
+    buffer = await run_in_threadpool(open, file_path, "wb")
+    try:
+        while True:
+            block = await file.read(UPLOAD_CHUNK_SIZE)
+            if not block:
+                break
+            size += len(block)
+            if size > max_bytes:
+                raise HTTPException(
+                    status_code=413,
+                    detail=f"Upload limit exceeded while receiving {file.filename}."
+                )
+            await run_in_threadpool(_write_block, buffer, hasher, block)
+    finally:
+        await run_in_threadpool(buffer.close)
+        await file.close()
+
+    return {"filename": os.path.basename(file_path), "size": size, "sha256": hasher.hexdigest()}
+
 @app.post("/create-dataset")
 async def create_dataset_endpoint(
     recipe: str = Form(...),
     files: List[UploadFile] = File(...),
+    columns: Optional[str] = Form(None), # Tabular only: comma-separated columns to keep
+    sample_fraction: Optional[float] = Form(None), # Tabular only: random fraction of rows to keep
+    max_rows: Optional[int] = Form(None), # Tabular only: stop after this many rows
+    profile: bool = Form(False), # Write a cProfile artifact next to the result file
+    model: Optional[str] = Form(None), # "provider:model" override, e.g. "openai:llama-3-8b"
+    exports: Optional[str] = Form(None), # Extra result formats, e.g. "jsonl.zst,parquet"
+    include: Optional[str] = Form(None), # Archives only: comma-separated globs of members to keep, e.g. "src/*.py"
+    exclude: Optional[str] = Form(None), # Archives only: comma-separated globs of members to skip
+    dedup: Optional[bool] = Form(None), # Drop near-duplicate items; defaults to DEDUP_ENABLED
     db: AsyncSession = Depends(get_db)
 ):
     task_id = str(uuid.uuid4())
-    job = Job(task_id=task_id, status="PENDING", recipe=recipe)    
+    options = {}
+    if columns:
+        options["columns"] = [c.strip() for c in columns.split(",") if c.strip()]
+    if sample_fraction is not None:
+        if not 0 < sample_fraction <= 1:
+            raise HTTPException(status_code=400, detail="sample_fraction must be in (0, 1].")
+        options["sample_fraction"] = sample_fraction
+    if max_rows is not None:
+        if max_rows < 1:
+            raise HTTPException(status_code=400, detail="max_rows must be at least 1.")
+        options["max_rows"] = max_rows
+    if profile:
+        options["profile"] = True
+    if model:
+        try:
+            parse_model_spec(model)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+        options["model"] = model
+    if exports is not None:
+        try:
+            options["exports"] = parse_exports(exports)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=str(e))
+    if include:
+        options["include"] = parse_globs(include)
+    if exclude:
+        options["exclude"] = parse_globs(exclude)
+    if dedup is not None:
+        options["dedup"] = dedup
+    job = Job(task_id=task_id, status="PENDING", recipe=recipe, options=options or None,
+              celery_task_id=str(uuid.uuid4()))
     
+    # Files are stored flat under their basename, so names must be present and unique within the job
+    basenames = [os.path.basename(file.filename or "") for file in files]
+    if any(name in ("", ".", "..") for name in basenames):
+        raise HTTPException(status_code=400, detail="Every uploaded file needs a filename.")
+    duplicates = sorted({name for name in basenames if basenames.count(name) > 1})
+    if duplicates:
+        raise HTTPException(status_code=400, detail=f"Duplicate filenames in upload: {', '.join(duplicates)}.")
+
     # Save uploaded file(s) to a temporary directory named after the task_id
     job_upload_dir = os.path.join(UPLOAD_DIR, task_id)
     os.makedirs(job_upload_dir, exist_ok=True)
     
-    # (Simplified: assumes single file upload for now, zip logic can be re-added)
-    for file in files:
-        file_path = os.path.join(job_upload_dir, file.filename)
-        with open(file_path, "wb") as buffer:
-            buffer.write(await file.read())
+    # Zip / tar.gz uploads are stored as-is; the worker extracts them member by member
+    manifest = []
+    total_bytes = 0
+    try:
+        for file, basename in zip(files, basenames):
+            file_path = os.path.join(job_upload_dir, basename)
+            if file.size is not None and file.size > MAX_FILE_BYTES:
+                raise HTTPException(status_code=413, detail=f"File {file.filename} is too large.")
+            file_info = await save_upload_file(
+                file, file_path, min(MAX_FILE_BYTES, MAX_JOB_BYTES - total_bytes)
+            )
+            total_bytes += file_info["size"]
+            manifest.append(file_info)
+    except Exception:
+        # Don't leave partial uploads behind for a job that will never run
+        shutil.rmtree(job_upload_dir, ignore_errors=True)
+        raise
+
+    # Record sizes and hashes so the worker can plan without re-reading files
+    job.files = manifest
+    job.total_bytes = total_bytes
 
     # Save job to DB and send to worker
     db.add(job)
     await db.commit()
     await db.refresh(job)
 
-    process_dataset_task.delay(job_id=job.id) #This dispatches the request to the Celery worker 
+    dispatch_dataset_job(job.id, job.celery_task_id) #This dispatches the request to the Celery worker, by task name
     
     return {"message": "Dataset generation has started.", "task_id": task_id, "job_id": job.id}
 
+@app.get("/metrics")
+async def metrics():
+    # Prometheus scrape target; includes worker metrics when PROMETHEUS_MULTIPROC_DIR is shared
+    body, content_type = render_metrics()
+    return Response(content=body, media_type=content_type)
+
 @app.get("/jobs/status/{task_id}")
 async def get_job_status(task_id: str, db: AsyncSession = Depends(get_db)):
     query = await db.execute(select(Job).where(Job.task_id == task_id))
     job = query.scalar_one_or_none()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    return {"task_id": job.task_id, "status": job.status, "error": job.error_message}
+    # progress holds the worker's live counters: files parsed, chunks total/generated/failed,
+    # QC rejections, retries, chunks and tokens per second, eta_seconds, updated_at
+    return {"task_id": job.task_id, "status": job.status, "error": job.error_message, "progress": job.progress}
+
+@app.get("/jobs/status")
+async def get_jobs_status(task_ids: List[str] = Query(...), db: AsyncSession = Depends(get_db)):
+    # Bulk status in one query: ?task_ids=a&task_ids=b (comma-separated values work too)
+    ids = list(dict.fromkeys(t.strip() for value in task_ids for t in value.split(",") if t.strip()))
+    if len(ids) > BULK_STATUS_MAX_IDS:
+        raise HTTPException(status_code=400, detail=f"At most {BULK_STATUS_MAX_IDS} task IDs per request.")
+    query = await db.execute(
+        select(Job.task_id, Job.status, Job.error_message, Job.progress).where(Job.task_id.in_(ids))
+    )
+    jobs = {
+        row.task_id: {"task_id": row.task_id, "status": row.status, "error": row.error_message, "progress": row.progress}
+        for row in query
+    }
+    return {"jobs": [jobs[t] for t in ids if t in jobs], "not_found": [t for t in ids if t not in jobs]}
+
+async def _load_status_event(task_id: str):
+    # Own session: event streams outlive the request-scoped one from get_db
+    async with AsyncSessionLocal() as session:
+        query = await session.execute(
+            select(Job.status, Job.error_message, Job.progress).where(Job.task_id == task_id)
+        )
+        row = query.one_or_none()
+    if row is None:
+        return None
+    return status_event(task_id, row.status, error=row.error_message, progress=row.progress)
+
+async def _sse_events(task_id: str):
+    async for event in job_event_stream(task_id, lambda: _load_status_event(task_id)):
+        if event["type"] == "heartbeat":
+            yield ": keep-alive\n\n"
+        else:
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+
+@app.get("/jobs/events/{task_id}")
+async def stream_job_events(task_id: str):
+    # Server-Sent Events: the current status first, then status/progress events as the worker
+    # publishes them; the stream closes after COMPLETED or FAILED (RETRYING isn't final), or
+    # after an error event if the event bus fails
+    if await _load_status_event(task_id) is None:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return StreamingResponse(
+        _sse_events(task_id),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+@app.websocket("/jobs/ws/{task_id}")
+async def job_events_websocket(websocket: WebSocket, task_id: str):
+    # Same events as /jobs/events, one JSON message each
+    await websocket.accept()
+    found = False
+    code = 1000
+    try:
+        async for event in job_event_stream(task_id, lambda: _load_status_event(task_id)):
+            found = True
+            await websocket.send_json(event)
+            if event["type"] == "error":
+                code = 1011
+        await websocket.close(code=code if found else 4404)
+    except WebSocketDisconnect:
+        pass
+
+@app.post("/jobs/{task_id}/resume")
+async def resume_job(task_id: str, db: AsyncSession = Depends(get_db)):
+    query = await db.execute(select(Job).where(Job.task_id == task_id))
+    job = query.scalar_one_or_none()
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    if job.status != "FAILED":
+        raise HTTPException(status_code=400, detail=f"Only FAILED jobs can be resumed (job is {job.status}).")
+    # A second task would truncate and append to the same result files as the first
+    if job.celery_task_id:
+        try:
+            live = await run_in_threadpool(task_is_live, job.celery_task_id)
+        except Exception as e:
+            raise HTTPException(status_code=503, detail=f"Can't check the job's current task: {e}")
+        if live:
+            raise HTTPException(status_code=409, detail="The job's task is still running or waiting to retry.")
+
+    job.status = "PENDING"
+    job.error_message = None
+    job.celery_task_id = str(uuid.uuid4())
+    await db.commit()
+    await publish_job_event(status_event(task_id, "PENDING"))
+
+    # The worker picks up the job's chunk checkpoints and only redoes failed or missing chunks
+    dispatch_dataset_job(job.id, job.celery_task_id)
+    return {"message": "Dataset generation has resumed.", "task_id": task_id, "job_id": job.id}
+
+def _complete_lines_size(path: str) -> int:
+    # The worker may be mid-write; only serve up to the last complete line
+    size = os.path.getsize(path)
+    with open(path, "rb") as f:
+        while size > 0:
+            start = max(0, size - 64 * 1024)
+            f.seek(start)
+            block = f.read(size - start)
+            newline = block.rfind(b"\n")
+            if newline != -1:
+                return start + newline + 1
+            size = start
+    return 0
+
+def _iter_file(path: str, length: int, start: int = 0, block_size: int = 256 * 1024):
+    with open(path, "rb") as f:
+        f.seek(start)
+        remaining = length
+        while remaining > 0:
+            block = f.read(min(block_size, remaining))
+            if not block:
+                break
+            remaining -= len(block)
+            yield block
+
+def _parse_range(header: str | None, length: int):
+    """
+    Single "bytes=start-end" range -> (start, end_exclusive), None for no/multi/invalid range (the
+    full body is served). Raises 416 if the range starts at or past the end of the resource.
+    """
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start = int(first)
+            if last and int(last) < start:
+                return None # Syntactically invalid (RFC 9110 14.1.1): ignored, not unsatisfiable
+            end = min(int(last) + 1, length) if last else length
+        else:
+            start = max(0, length - int(last)) # Suffix range: the last N bytes
+            end = length
+    except ValueError:
+        return None
+    if start >= end:
+        raise HTTPException(status_code=416, detail="Range not satisfiable.", headers={"Content-Range": f"bytes */{length}"})
+    return start, end
+
+def _line_slice(result_path: str, length: int, offset: int, limit: int | None):
+    """Byte span of lines [offset, offset + limit) within the first `length` bytes, and the line count there."""
+    index_path = line_index_path_for(result_path)
+    if not os.path.exists(index_path):
+        build_line_index(result_path, length) # Results written before line indexes existed
+    with open(index_path, "rb") as index:
+        total = count_lines_before(index, length)
+        start = read_line_offset(index, offset) if offset < total else length
+        stop = offset + limit if limit is not None else total
+        end = read_line_offset(index, stop) if stop < total else length
+        if stop >= total and limit is not None and offset < total:
+            # A running job's index can lag the result file: end after the last indexed line, so
+            # unindexed lines never take the slice past the limit
+            end = min(length, _line_end(result_path, read_line_offset(index, total - 1)))
+    return start, end, total
+
+def _line_end(path: str, line_start: int) -> int:
+    with open(path, "rb") as f:
+        f.seek(line_start)
+        return line_start + len(f.readline())
 
 @app.get("/download/{task_id}")
-async def download_dataset(task_id: str, db: AsyncSession = Depends(get_db)):
+async def download_dataset(task_id: str, request: Request, format: str = "jsonl", offset: Optional[int] = Query(None, ge=0),
+                           limit: Optional[int] = Query(None, ge=0), db: AsyncSession = Depends(get_db)):
     query = await db.execute(select(Job).where(Job.task_id == task_id))
     job = query.scalar_one_or_none()
     if not job:
         raise HTTPException(status_code=404, detail="Job not found")
-    if job.status != "COMPLETED" or not job.result_file_path:
+    if not job.result_file_path or not os.path.exists(job.result_file_path):
         raise HTTPException(status_code=400, detail="Dataset not ready or generation failed.")
-    
-    return FileResponse(path=job.result_file_path, filename=os.path.basename(job.result_file_path))
+    if job.status not in PARTIAL_DOWNLOAD_STATUSES + ("COMPLETED",):
+        raise HTTPException(status_code=400, detail="Dataset not ready or generation failed.")
+    if format != "jsonl" and format not in EXPORT_FORMATS:
+        raise HTTPException(status_code=400, detail=f"Unknown format: {format}")
+
+    if format != "jsonl":
+        # Exports are written once the job completes; FileResponse handles Range requests
+        if offset is not None or limit is not None:
+            raise HTTPException(status_code=400, detail="offset/limit are only supported for format=jsonl.")
+        export_path = export_path_for(job.result_file_path, format)
+        if job.status != "COMPLETED" or not os.path.exists(export_path):
+            raise HTTPException(status_code=404, detail=f"No {format} export for this job (request it with exports=).")
+        return FileResponse(path=export_path, filename=os.path.basename(export_path), media_type=EXPORT_MEDIA_TYPES[format])
+
+    filename = os.path.basename(job.result_file_path)
+    if job.status in PARTIAL_DOWNLOAD_STATUSES:
+        # The worker may be mid-write; only serve a snapshot up to the last complete line
+        length = await run_in_threadpool(_complete_lines_size, job.result_file_path)
+    else:
+        length = os.path.getsize(job.result_file_path)
+
+    if offset is not None or limit is not None:
+        # Pagination: jump straight to the lines through the line-offset index
+        start, end, total = await run_in_threadpool(_line_slice, job.result_file_path, length, offset or 0, limit)
+        return StreamingResponse(
+            _iter_file(job.result_file_path, end - start, start=start),
+            media_type=EXPORT_MEDIA_TYPES["jsonl"],
+            headers={
+                "Content-Length": str(end - start),
+                "X-Job-Status": job.status,
+                "X-Total-Lines": str(total),
+                "X-Offset": str(offset or 0),
+            },
+        )
+
+    if job.status == "COMPLETED":
+        return FileResponse(path=job.result_file_path, filename=filename, media_type=EXPORT_MEDIA_TYPES["jsonl"])
+
+    # Partial download: a snapshot of everything written so far, resumable with Range
+    headers = {
+        "Content-Disposition": f'attachment; filename="{filename}"',
+        "Accept-Ranges": "bytes",
+        "X-Job-Status": job.status,
+    }
+    byte_range = _parse_range(request.headers.get("range"), length)
+    if byte_range is None:
+        headers["Content-Length"] = str(length)
+        return StreamingResponse(_iter_file(job.result_file_path, length), media_type=EXPORT_MEDIA_TYPES["jsonl"],
+                                 headers=headers)
+    start, end = byte_range
+    headers["Content-Length"] = str(end - start)
+    headers["Content-Range"] = f"bytes {start}-{end - 1}/{length}"
+    return StreamingResponse(_iter_file(job.result_file_path, end - start, start=start), status_code=206,
+                             media_type=EXPORT_MEDIA_TYPES["jsonl"], headers=headers)
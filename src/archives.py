@@ -0,0 +1,172 @@
+#Archive ingestion: zip and tar(.gz) uploads are read member by member inside the worker, never
+#extracted to disk. Members go through an include/exclude glob filter, and binary, minified and
+#vendored files (node_modules, vendor, build output...) are skipped before they reach a parser.
+#Per-archive caps on file count and uncompressed bytes guard against archive bombs.
+
+import os
+import tarfile
+import posixpath
+import zipfile
+import fnmatch
+from typing import Dict, Iterable, Iterator, List
+from .parsing import is_supported_file, TABULAR_EXTENSIONS
+from .code_chunking import CODE_EXTENSIONS
+
+ARCHIVE_EXTENSIONS = (".zip", ".tar.gz", ".tgz", ".tar")
+
+ARCHIVE_MAX_FILES = int(os.environ.get("ARCHIVE_MAX_FILES", 20_000))
+ARCHIVE_MAX_BYTES = int(os.environ.get("ARCHIVE_MAX_BYTES", 1024 * 1024 * 1024)) # Uncompressed, per archive
+ARCHIVE_MAX_MEMBER_BYTES = int(os.environ.get("ARCHIVE_MAX_MEMBER_BYTES", 16 * 1024 * 1024))
+# Directories skipped anywhere in an archive, on top of the job's own exclude globs
+ARCHIVE_VENDORED_DIRS = set(os.environ.get(
+    "ARCHIVE_VENDORED_DIRS",
+    "node_modules,bower_components,vendor,third_party,site-packages,.git,.hg,.svn,__pycache__,"
+    ".venv,venv,.tox,dist,build,target,.next,.idea,.vscode"
+).split(","))
+# Lines this long on average mean generated or minified code
+ARCHIVE_MINIFIED_LINE_LENGTH = int(os.environ.get("ARCHIVE_MINIFIED_LINE_LENGTH", 500))
+
+_TEXT_EXTENSIONS = CODE_EXTENSIONS + (".txt", ".md")
+_BINARY_SNIFF_BYTES = 8192
+
+def is_archive(filename: str) -> bool:
+    return filename.lower().endswith(ARCHIVE_EXTENSIONS)
+
+def parse_globs(value: str | None) -> List[str]:
+    """"src/**/*.py, *.md" -> ["src/**/*.py", "*.md"]"""
+    return [g.strip() for g in (value or "").split(",") if g.strip()]
+
+def _matches(path: str, patterns: List[str]) -> bool:
+    # fnmatch's "*" already crosses "/", so "src/*.py" covers subdirectories too. Patterns are
+    # also tried below a single wrapping directory (GitHub/GitLab downloads have "repo-main/"),
+    # and a bare pattern like "*.py" against the file name alone.
+    candidates = {path, path.split("/", 1)[-1], path.rsplit("/", 1)[-1]}
+    return any(fnmatch.fnmatchcase(candidate, p) for candidate in candidates for p in patterns)
+
+class ArchiveFilter:
+    """Decides which archive members are worth parsing. Records why the others were skipped."""
+
+    def __init__(self, include: List[str] | None = None, exclude: List[str] | None = None):
+        self.include = include or []
+        self.exclude = exclude or []
+        self.skipped = {}
+
+    def skip(self, reason: str) -> bool:
+        self.skipped[reason] = self.skipped.get(reason, 0) + 1
+        return False
+
+    def accepts_path(self, path: str, size: int) -> bool:
+        """Checks that only need the member's name and size, so skipped members are never read."""
+        parts = path.split("/")
+        if any(part in ARCHIVE_VENDORED_DIRS for part in parts[:-1]):
+            return self.skip("vendored")
+        if not is_supported_file(path):
+            return self.skip("unsupported")
+        if self.include and not _matches(path, self.include):
+            return self.skip("not_included")
+        if self.exclude and _matches(path, self.exclude):
+            return self.skip("excluded")
+        if ".min." in parts[-1].lower():
+            return self.skip("minified")
+        if size > ARCHIVE_MAX_MEMBER_BYTES:
+            return self.skip("too_large")
+        return True
+
+    def accepts_content(self, path: str, content: bytes) -> bool:
+        if not path.lower().endswith(_TEXT_EXTENSIONS):
+            return True # PDFs, spreadsheets etc. are binary by design
+        if b"\0" in content[:_BINARY_SNIFF_BYTES]:
+            return self.skip("binary")
+        if path.lower().endswith(CODE_EXTENSIONS) and len(content) / (content.count(b"\n") + 1) > ARCHIVE_MINIFIED_LINE_LENGTH:
+            return self.skip("minified")
+        return True
+
+def _normalize_member_name(name: str) -> str | None:
+    """"./repo-main//src/a.py" -> "repo-main/src/a.py"; None for names with a ".." component."""
+    name = name.replace("\\", "/").lstrip("/")
+    if ".." in name.split("/"):
+        return None
+    name = posixpath.normpath(name)
+    return None if name in (".", "") else name
+
+def _read_capped(fileobj, limit: int) -> bytes | None:
+    # Declared sizes can lie; never read more than the cap allows
+    content = fileobj.read(limit + 1)
+    return None if len(content) > limit else content
+
+def _iter_zip(path: str) -> Iterator[tuple]:
+    with zipfile.ZipFile(path) as archive:
+        for info in archive.infolist():
+            if info.is_dir():
+                continue
+            yield info.filename, info.file_size, lambda info=info: archive.open(info)
+
+def _iter_tar(path: str) -> Iterator[tuple]:
+    # Stream mode: one sequential pass over the (compressed) file, no member index in memory
+    with tarfile.open(path, "r|*") as archive:
+        for member in archive:
+            if not member.isfile(): # Directories, symlinks, devices
+                continue
+            yield member.name, member.size, lambda member=member: archive.extractfile(member)
+
+def iter_archive_files(path: str, archive_name: str, options: Dict | None = None) -> Iterator[Dict]:
+    """
+    Yields {"filename", "content", "archive"} for each member of a zip or tar(.gz) archive that
+    passes the job's filter, reading one member at a time. Filenames are "<archive>/<member path>",
+    so members with the same name in different directories stay distinct.
+    """
+    options = options or {}
+    member_filter = ArchiveFilter(options.get("include"), options.get("exclude"))
+    members = _iter_zip(path) if archive_name.lower().endswith(".zip") else _iter_tar(path)
+    files = 0
+    total_bytes = 0
+    try:
+        for name, size, open_member in members:
+            name = _normalize_member_name(name)
+            if name is None:
+                member_filter.skip("unsafe_path")
+                continue
+            if not member_filter.accepts_path(name, size):
+                continue
+            if files >= ARCHIVE_MAX_FILES or total_bytes + size > ARCHIVE_MAX_BYTES:
+                print(f"!!! Archive {archive_name}: limit of {ARCHIVE_MAX_FILES} files / {ARCHIVE_MAX_BYTES} bytes "
+                      f"reached, ignoring the remaining members !!!")
+                break
+            with open_member() as member_file:
+                content = _read_capped(member_file, min(ARCHIVE_MAX_MEMBER_BYTES, ARCHIVE_MAX_BYTES - total_bytes))
+            if content is None:
+                member_filter.skip("too_large")
+                continue
+            if not member_filter.accepts_content(name, content):
+                continue
+            files += 1
+            total_bytes += len(content)
+            yield {"filename": f"{archive_name}/{name}", "content": content, "archive": archive_name}
+    except (zipfile.BadZipFile, tarfile.TarError, EOFError, OSError) as e:
+        # Like an unparseable file: keep whatever was read so far instead of failing the job
+        print(f"!!! Error reading archive {archive_name}: {e} !!!")
+    print(f"--- Archive {archive_name}: {files} files ({total_bytes} bytes) extracted, "
+          f"skipped: {member_filter.skipped} ---")
+
+def iter_job_files(files: Iterable[Dict], options: Dict | None = None) -> Iterator[Dict]:
+    """
+    Expands a job's uploads into parser inputs, lazily. Entries are either {"filename", "content"}
+    or {"filename", "path"}; archives are expanded member by member, and plain files are read
+    from disk only when the parsing stage asks for them. Tabular files stay on disk, since their
+    parsers stream from a path.
+    """
+    for file_info in files:
+        filename = file_info["filename"]
+        path = file_info.get("path")
+        if is_archive(filename):
+            if path is None:
+                print(f"!!! Archive {filename} has no path on disk, skipping !!!")
+                continue
+            yield from iter_archive_files(path, filename, options)
+        elif path is None:
+            yield file_info
+        elif filename.lower().endswith(TABULAR_EXTENSIONS):
+            yield {"filename": filename, "content": path}
+        else:
+            with open(path, "rb") as f:
+                yield {"filename": filename, "content": f.read()}
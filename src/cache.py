@@ -0,0 +1,209 @@
+#Content-addressed cache of LLM results, shared across jobs and worker processes.
+#Keys hash everything that determines the output (model, recipe, schema, prompts, chunk text),
+#so re-uploaded documents only pay for chunks that actually changed.
+
+import os
+import json
+import time
+import sqlite3
+import hashlib
+import asyncio
+import threading
+
+RESULT_CACHE_BACKEND = os.environ.get("RESULT_CACHE_BACKEND", "sqlite") # sqlite, redis or off
+RESULT_CACHE_PATH = os.environ.get("RESULT_CACHE_PATH", "/tmp/cache/llm_results.db")
+RESULT_CACHE_REDIS_URL = os.environ.get("RESULT_CACHE_REDIS_URL", os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+RESULT_CACHE_TTL_SECONDS = int(os.environ.get("RESULT_CACHE_TTL_SECONDS", 30 * 24 * 3600))
+RESULT_CACHE_MAX_BYTES = int(os.environ.get("RESULT_CACHE_MAX_BYTES", 1024 * 1024 * 1024))
+RESULT_CACHE_KEY_PREFIX = "foundry:llmcache"
+
+# Eviction scans are cheap but not free; only check the size cap every N writes
+EVICTION_CHECK_INTERVAL = 100
+
+def make_cache_key(namespace: str, chunk: str) -> str:
+    """namespace identifies the model/recipe/schema/prompt combination, see RecipeClient."""
+    hasher = hashlib.sha256(namespace.encode("utf-8"))
+    hasher.update(b"\0")
+    hasher.update(chunk.encode("utf-8", errors="surrogatepass"))
+    return hasher.hexdigest()
+
+class SQLiteResultCache:
+    """
+    Local on-disk cache. LRU by last access time, entries expire after ttl_seconds, and the
+    total stored payload is kept under max_bytes. WAL mode lets several worker processes on
+    the same host share one file.
+    """
+
+    def __init__(self, path: str = RESULT_CACHE_PATH, ttl_seconds: int = RESULT_CACHE_TTL_SECONDS,
+                 max_bytes: int = RESULT_CACHE_MAX_BYTES):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._writes_since_check = 0
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS results ("
+            "key TEXT PRIMARY KEY, value TEXT NOT NULL, size INTEGER NOT NULL, "
+            "created_at REAL NOT NULL, last_access REAL NOT NULL)"
+        )
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_results_last_access ON results(last_access)")
+        self._conn.commit()
+
+    def _get(self, key: str):
+        now = time.time()
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, created_at FROM results WHERE key = ?", (key,)
+            ).fetchone()
+            if row is None:
+                return None
+            if now - row[1] > self.ttl_seconds:
+                self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+                self._conn.commit()
+                return None
+            self._conn.execute("UPDATE results SET last_access = ? WHERE key = ?", (now, key))
+            self._conn.commit()
+        return row[0]
+
+    def _set(self, key: str, value: str) -> int:
+        now = time.time()
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO results (key, value, size, created_at, last_access) VALUES (?, ?, ?, ?, ?)",
+                (key, value, len(value), now, now)
+            )
+            self._conn.commit()
+            self._writes_since_check += 1
+            if self._writes_since_check < EVICTION_CHECK_INTERVAL:
+                return 0
+            self._writes_since_check = 0
+            return self._evict(now)
+
+    def _delete(self, key: str):
+        with self._lock:
+            self._conn.execute("DELETE FROM results WHERE key = ?", (key,))
+            self._conn.commit()
+
+    def _evict(self, now: float) -> int:
+        evicted = self._conn.execute(
+            "DELETE FROM results WHERE created_at < ?", (now - self.ttl_seconds,)
+        ).rowcount
+        total = self._conn.execute("SELECT COALESCE(SUM(size), 0) FROM results").fetchone()[0]
+        if total > self.max_bytes:
+            # Drop least recently used entries until we're ~10% under the cap
+            to_free = total - int(self.max_bytes * 0.9)
+            freed = 0
+            doomed = []
+            for key, size in self._conn.execute("SELECT key, size FROM results ORDER BY last_access"):
+                doomed.append((key,))
+                freed += size
+                if freed >= to_free:
+                    break
+            self._conn.executemany("DELETE FROM results WHERE key = ?", doomed)
+            evicted += len(doomed)
+        self._conn.commit()
+        return evicted
+
+    async def get(self, key: str):
+        return await asyncio.to_thread(self._get, key)
+
+    async def set(self, key: str, value: str) -> int:
+        return await asyncio.to_thread(self._set, key, value)
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self._delete, key)
+
+class RedisResultCache:
+    """
+    Cache shared by every worker node. Entries carry a TTL that is refreshed on each hit;
+    the size cap and LRU eviction are Redis' own (maxmemory + allkeys-lru).
+    """
+
+    def __init__(self, url: str = RESULT_CACHE_REDIS_URL, ttl_seconds: int = RESULT_CACHE_TTL_SECONDS):
+        import redis
+        # Sync client in a thread: works from any event loop, unlike redis.asyncio clients
+        self.client = redis.Redis.from_url(url)
+        self.ttl_seconds = ttl_seconds
+
+    async def get(self, key: str):
+        value = await asyncio.to_thread(self.client.getex, f"{RESULT_CACHE_KEY_PREFIX}:{key}", ex=self.ttl_seconds)
+        return value.decode("utf-8") if value is not None else None
+
+    async def set(self, key: str, value: str) -> int:
+        await asyncio.to_thread(self.client.set, f"{RESULT_CACHE_KEY_PREFIX}:{key}", value, ex=self.ttl_seconds)
+        return 0
+
+    async def delete(self, key: str):
+        await asyncio.to_thread(self.client.delete, f"{RESULT_CACHE_KEY_PREFIX}:{key}")
+
+class ResultCache:
+    """
+    Backend-agnostic front with hit/miss counters. Cache errors are logged and treated as
+    misses; they must never fail a chunk.
+    """
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.stats = {"hits": 0, "misses": 0, "writes": 0, "evictions": 0, "errors": 0}
+
+    async def get(self, key: str) -> dict | None:
+        try:
+            value = await self.backend.get(key)
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"!!! Result cache read failed: {e} !!!")
+            return None
+        if value is None:
+            self.stats["misses"] += 1
+            return None
+        try:
+            result = json.loads(value)
+        except json.JSONDecodeError as e:
+            # Corrupt or truncated entry: a miss, and dropped so the next write replaces it
+            self.stats["errors"] += 1
+            self.stats["misses"] += 1
+            print(f"!!! Result cache entry unreadable ({e}), discarding it !!!")
+            try:
+                await self.backend.delete(key)
+            except Exception as delete_e:
+                print(f"!!! Result cache delete failed: {delete_e} !!!")
+            return None
+        self.stats["hits"] += 1
+        return result
+
+    async def set(self, key: str, result: dict):
+        try:
+            self.stats["evictions"] += await self.backend.set(key, json.dumps(result, separators=(",", ":")))
+            self.stats["writes"] += 1
+        except Exception as e:
+            self.stats["errors"] += 1
+            print(f"!!! Result cache write failed: {e} !!!")
+
+    def get_stats(self) -> dict:
+        stats = dict(self.stats)
+        lookups = stats["hits"] + stats["misses"]
+        stats["hit_rate"] = stats["hits"] / lookups if lookups else 0.0
+        return stats
+
+_result_cache = None
+_result_cache_failed = False
+
+def get_result_cache() -> ResultCache | None:
+    """Returns the process-wide cache, or None when caching is turned off or unavailable."""
+    global _result_cache, _result_cache_failed
+    if _result_cache is None and RESULT_CACHE_BACKEND != "off" and not _result_cache_failed:
+        try:
+            if RESULT_CACHE_BACKEND == "redis":
+                backend = RedisResultCache()
+            else:
+                backend = SQLiteResultCache()
+        except Exception as e:
+            print(f"!!! Result cache unavailable ({e}), continuing without it. !!!")
+            _result_cache_failed = True
+            return None
+        _result_cache = ResultCache(backend)
+    return _result_cache
@@ -0,0 +1,111 @@
+#Per-chunk progress for a job, persisted in batches so Celery retries and explicit resumes
+#skip chunks that already produced results.
+
+import os
+import time
+import asyncio
+import hashlib
+from typing import Dict, Iterable, Iterator, List, Tuple
+from sqlalchemy import select, delete, update
+from .models import Job, JobShard, ChunkCheckpoint
+
+CHECKPOINT_FLUSH_INTERVAL_SECONDS = float(os.environ.get("CHECKPOINT_FLUSH_INTERVAL_SECONDS", 5.0))
+CHECKPOINT_FLUSH_MAX_PENDING = int(os.environ.get("CHECKPOINT_FLUSH_MAX_PENDING", 500))
+
+def assign_chunk_ids(texts: List[str]) -> List[Dict]:
+    """
+    Turns chunk texts into {"id", "text"} dicts. The id is the text's sha256 plus its
+    occurrence number, so repeated boilerplate chunks stay distinct but ids are stable
+    across runs as long as parsing is deterministic.
+    """
+    return [{"id": chunk_id, "text": text} for chunk_id, text in iter_chunk_ids(texts)]
+
+def iter_chunk_ids(texts: Iterable[str]) -> Iterator[Tuple[str, str]]:
+    """Yields (id, text) with the ids assign_chunk_ids would give, without holding the texts."""
+    ids = ChunkIds()
+    for text in texts:
+        yield ids.next_id(text), text
+
+class ChunkIds:
+    """Assigns chunk ids one text at a time, in job order (ids count earlier occurrences)."""
+
+    def __init__(self):
+        self.seen = {}
+
+    def next_id(self, text: str) -> str:
+        digest = hashlib.sha256(text.encode("utf-8", errors="surrogatepass")).hexdigest()
+        occurrence = self.seen.get(digest, 0)
+        self.seen[digest] = occurrence + 1
+        return f"{digest}:{occurrence}"
+
+class CheckpointRecorder:
+    """
+    Collects per-chunk outcomes in memory and commits them periodically. Each commit first
+    fsyncs the result sink and stores its offsets on the Job in the same transaction, so a
+    DONE checkpoint always refers to results that are on disk. For a shard of a sharded job,
+    pass shard_id: the offsets then belong to the shard's own result files.
+    """
+
+    def __init__(self, session_factory, job_id: int, sink, shard_id: int | None = None):
+        self.session_factory = session_factory
+        self.job_id = job_id
+        self.shard_id = shard_id
+        self.sink = sink
+        self.completed = set()
+        self._pending = {}
+        self._last_flush = time.monotonic()
+        # Commits must land in snapshot order, or an older offset could overwrite a newer one
+        self._flush_lock = asyncio.Lock()
+
+    async def load(self):
+        """Loads the chunks that already finished in an earlier attempt."""
+        async with self.session_factory() as session:
+            rows = await session.execute(
+                select(ChunkCheckpoint.chunk_id).where(
+                    ChunkCheckpoint.job_id == self.job_id, ChunkCheckpoint.status == "DONE"
+                )
+            )
+            self.completed = set(rows.scalars().all())
+        return self.completed
+
+    async def record(self, chunk_id: str, succeeded: bool, accepted: int = 0, rejected: int = 0,
+                     result_offset: int | None = None):
+        self._pending[chunk_id] = {
+            "job_id": self.job_id,
+            "chunk_id": chunk_id,
+            "status": "DONE" if succeeded else "FAILED",
+            "accepted": accepted,
+            "rejected": rejected,
+            "result_offset": result_offset,
+        }
+        if succeeded:
+            self.completed.add(chunk_id)
+        if (len(self._pending) >= CHECKPOINT_FLUSH_MAX_PENDING
+                or time.monotonic() - self._last_flush >= CHECKPOINT_FLUSH_INTERVAL_SECONDS):
+            await self.flush()
+
+    async def flush(self):
+        self._last_flush = time.monotonic()
+        async with self._flush_lock:
+            if not self._pending:
+                return
+            # Swap first: records arriving while we await the DB go into the next batch
+            pending, self._pending = self._pending, {}
+            self.sink.flush(fsync=True)
+            offsets = dict(self.sink.offsets)
+            await self._commit(pending, offsets)
+
+    async def _commit(self, pending: Dict, offsets: Dict):
+        async with self.session_factory() as session:
+            await session.execute(
+                delete(ChunkCheckpoint).where(
+                    ChunkCheckpoint.job_id == self.job_id,
+                    ChunkCheckpoint.chunk_id.in_(list(pending)),
+                )
+            )
+            session.add_all(ChunkCheckpoint(**row) for row in pending.values())
+            if self.shard_id is None:
+                await session.execute(update(Job).where(Job.id == self.job_id).values(result_offsets=offsets))
+            else:
+                await session.execute(update(JobShard).where(JobShard.id == self.shard_id).values(result_offsets=offsets))
+            await session.commit()
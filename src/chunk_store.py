@@ -0,0 +1,83 @@
+#Job-scoped, disk-backed store for chunk text. Parsed and re-chunked text is appended to one
+#file under the job's directory and read back through a memory map, so the graph state (and
+#the per-batch Send payloads LangGraph copies around) only carries integer refs; a job's
+#working set is the chunks currently being generated, not the whole corpus. The store is
+#scratch space: it's rebuilt by every run of the job and removed when the job finishes.
+
+import os
+import mmap
+import shutil
+import tempfile
+from array import array
+from typing import Iterable, Iterator, List
+
+# Where stores without a job directory (e.g. run_graph called directly) go; default is the system temp dir
+CHUNK_STORE_DIR = os.environ.get("CHUNK_STORE_DIR") or None
+CHUNK_STORE_WRITE_BUFFER_BYTES = int(os.environ.get("CHUNK_STORE_WRITE_BUFFER_BYTES", 1024 * 1024))
+
+def chunk_store_dir_for(result_dir: str, task_id: str) -> str:
+    return os.path.join(result_dir, f"{task_id}.chunks")
+
+class ChunkStore:
+
+    def __init__(self, directory: str | None = None):
+        if directory is None:
+            directory = tempfile.mkdtemp(prefix="chunks-", dir=CHUNK_STORE_DIR)
+        else:
+            os.makedirs(directory, exist_ok=True)
+        self.directory = directory
+        self.path = os.path.join(directory, "chunks.bin")
+        # Truncates whatever an earlier (crashed) run left; chunks are re-parsed on every run
+        self._file = open(self.path, "w+b", buffering=CHUNK_STORE_WRITE_BUFFER_BYTES)
+        self._ends = array("Q", [0]) # Chunk ref i is bytes _ends[i] to _ends[i + 1]
+        self._map = None
+        self._mapped = 0
+
+    def __len__(self) -> int:
+        return len(self._ends) - 1
+
+    def append(self, text: str) -> int:
+        data = text.encode("utf-8", errors="surrogatepass")
+        self._file.write(data)
+        self._ends.append(self._ends[-1] + len(data))
+        return len(self._ends) - 2
+
+    def extend(self, texts: Iterable[str]) -> List[int]:
+        return [self.append(text) for text in texts]
+
+    def get(self, ref: int) -> str:
+        start, end = self._ends[ref], self._ends[ref + 1]
+        if end > self._mapped:
+            self._remap()
+        if start == end:
+            return ""
+        # Decoded straight out of the page cache, without an intermediate bytes copy
+        with memoryview(self._map) as whole, whole[start:end] as view:
+            return str(view, "utf-8", "surrogatepass")
+
+    def iter_texts(self, refs: Iterable[int]) -> Iterator[str]:
+        for ref in refs:
+            yield self.get(ref)
+
+    def _remap(self):
+        self._file.flush()
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._mapped = self._ends[-1]
+        if self._mapped:
+            self._map = mmap.mmap(self._file.fileno(), self._mapped, access=mmap.ACCESS_READ)
+
+    def close(self, remove: bool = True):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+        if remove:
+            shutil.rmtree(self.directory, ignore_errors=True)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
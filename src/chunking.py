@@ -0,0 +1,119 @@
+#Normalizes parser output into evenly sized chunks: merges tiny adjacent chunks up to a token
+#budget and splits oversized ones on paragraph, line or sentence boundaries.
+
+import re
+from typing import Iterable, Iterator, List
+from .tokens import estimate_tokens, CHARS_PER_TOKEN
+from .schemas import RECIPE_SCHEMAS
+
+DEFAULT_CHUNKING = {
+    "target_tokens": 600,  # Merge adjacent chunks until they reach this size (0 disables merging)
+    "max_tokens": 1500,    # Split anything larger than this
+    "overlap_tokens": 0,   # Context carried over between the pieces of a split chunk
+}
+
+_SENTENCE_BOUNDARY = re.compile(r"(?<=[.!?])\s+")
+
+def get_chunking_config(recipe_name: str) -> dict:
+    config = dict(DEFAULT_CHUNKING)
+    config.update(RECIPE_SCHEMAS.get(recipe_name, {}).get("chunking", {}))
+    return config
+
+def _split_parts(parts: List[str], separator: str, max_chars: int) -> List[str]:
+    units = []
+    for part in parts:
+        part_units = _split_units(part, max_chars)
+        part_units[-1] += separator # Keep the boundary so merged pieces read naturally
+        units.extend(part_units)
+    return units
+
+def _split_units(text: str, max_chars: int) -> List[str]:
+    """Breaks text into pieces no longer than max_chars, preferring the coarsest boundary available."""
+    if len(text) <= max_chars:
+        return [text]
+    for separator in ("\n\n", "\n"):
+        parts = text.split(separator)
+        if len(parts) > 1:
+            return _split_parts(parts, separator, max_chars)
+    sentences = _SENTENCE_BOUNDARY.split(text)
+    if len(sentences) > 1:
+        return _split_parts(sentences, " ", max_chars)
+    # No natural boundary left: hard cut
+    return [text[i:i + max_chars] for i in range(0, len(text), max_chars)]
+
+def split_chunk(chunk: str, max_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    if estimate_tokens(chunk) <= max_tokens:
+        return [chunk]
+    max_chars = max_tokens * CHARS_PER_TOKEN
+    overlap_chars = min(overlap_tokens * CHARS_PER_TOKEN, max_chars // 2)
+    budget = max_chars - overlap_chars
+
+    pieces = []
+    current = ""
+    for unit in _split_units(chunk, budget):
+        if current and len(current) + len(unit) > budget:
+            pieces.append(current)
+            current = ""
+        current += unit
+    if current:
+        pieces.append(current)
+
+    if overlap_chars:
+        pieces = [pieces[0]] + [prev[-overlap_chars:] + piece for prev, piece in zip(pieces, pieces[1:])]
+    return [piece.strip() for piece in pieces if piece.strip()]
+
+def pack_chunks(chunks: List[str], target_tokens: int, max_tokens: int, overlap_tokens: int = 0) -> List[str]:
+    """
+    Splits chunks above max_tokens, then merges adjacent chunks (in order) while the merged
+    chunk stays under target_tokens.
+    """
+    return list(iter_packed_chunks(chunks, target_tokens, max_tokens, overlap_tokens))
+
+def iter_packed_chunks(chunks: Iterable[str], target_tokens: int, max_tokens: int,
+                       overlap_tokens: int = 0) -> Iterator[str]:
+    """pack_chunks as a generator: holds only the chunk being built, so inputs can be streamed."""
+    packer = ChunkPacker(target_tokens, max_tokens, overlap_tokens)
+    for chunk in chunks:
+        yield from packer.add(chunk)
+    yield from packer.finish()
+
+class ChunkPacker:
+    """pack_chunks fed one chunk at a time, for inputs that arrive asynchronously."""
+
+    def __init__(self, target_tokens: int, max_tokens: int, overlap_tokens: int = 0):
+        self.target_tokens = target_tokens
+        self.max_tokens = max_tokens
+        self.overlap_tokens = overlap_tokens
+        self.current = []
+        self.current_tokens = 0
+
+    @classmethod
+    def for_recipe(cls, recipe_name: str) -> "ChunkPacker":
+        config = get_chunking_config(recipe_name)
+        return cls(config["target_tokens"], config["max_tokens"], config["overlap_tokens"])
+
+    def add(self, chunk: str) -> List[str]:
+        """Returns the packed chunks this one completed."""
+        packed = []
+        for piece in split_chunk(chunk, self.max_tokens, self.overlap_tokens):
+            tokens = estimate_tokens(piece)
+            if self.current and self.current_tokens + tokens > self.target_tokens:
+                packed.append("\n\n".join(self.current))
+                self.current = []
+                self.current_tokens = 0
+            self.current.append(piece)
+            self.current_tokens += tokens
+        return packed
+
+    def finish(self) -> List[str]:
+        packed = ["\n\n".join(self.current)] if self.current else []
+        self.current = []
+        self.current_tokens = 0
+        return packed
+
+def chunk_for_recipe(chunks: List[str], recipe_name: str) -> List[str]:
+    return list(iter_chunks_for_recipe(chunks, recipe_name))
+
+def iter_chunks_for_recipe(chunks: Iterable[str], recipe_name: str) -> Iterator[str]:
+    config = get_chunking_config(recipe_name)
+    return iter_packed_chunks(chunks, config["target_tokens"], config["max_tokens"], config["overlap_tokens"])
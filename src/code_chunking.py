@@ -0,0 +1,351 @@
+#Code chunker. Chunks are slices of the original source (by line), never re-serialized, so
+#comments, docstrings and formatting survive. Python uses the ast module; JavaScript, TypeScript
+#and Java use tree-sitter when its grammars are installed and a brace-aware scanner otherwise.
+#Classes too large for one chunk are split into one chunk per method, each prefixed with the
+#class signature for context. Results are cached by file hash (see CodeChunkCache).
+
+import os
+import ast
+import hashlib
+import threading
+from collections import OrderedDict
+from typing import List
+from .tokens import estimate_tokens
+
+CODE_LANGUAGES = {
+    ".py": "python",
+    ".js": "javascript",
+    ".jsx": "javascript",
+    ".mjs": "javascript",
+    ".cjs": "javascript",
+    ".ts": "typescript",
+    ".tsx": "tsx",
+    ".java": "java",
+}
+CODE_EXTENSIONS = tuple(CODE_LANGUAGES)
+
+# Classes above this are split per method; smaller ones stay whole
+CODE_CLASS_MAX_TOKENS = int(os.environ.get("CODE_CLASS_MAX_TOKENS", 1500))
+# Shorter top-level statements (constants, one-liners) are grouped into shared chunks
+CODE_MIN_DECLARATION_LINES = int(os.environ.get("CODE_MIN_DECLARATION_LINES", 3))
+CODE_CHUNK_CACHE_MAX_BYTES = int(os.environ.get("CODE_CHUNK_CACHE_MAX_BYTES", 64 * 1024 * 1024))
+
+def language_for(filename: str) -> str | None:
+    return CODE_LANGUAGES.get(os.path.splitext(filename.lower())[1])
+
+def _text(lines: List[str], start: int, end: int) -> str:
+    """Lines [start, end) (0-based) of the original source."""
+    return "".join(lines[start:end])
+
+def _leading_comments_start(lines: List[str], start: int, prefixes: tuple) -> int:
+    # Pull in the comment block directly above a declaration (no blank line in between)
+    while start > 0 and lines[start - 1].lstrip().startswith(prefixes):
+        start -= 1
+    return start
+
+class _Region:
+    """Consecutive small top-level statements, emitted as one chunk if there's anything worth explaining."""
+
+    def __init__(self):
+        self.start = None
+        self.end = None
+        self.substantial = False
+
+    def add(self, start: int, end: int, substantial: bool):
+        self.start = start if self.start is None else self.start
+        self.end = end
+        self.substantial = self.substantial or substantial
+
+    def flush(self, lines: List[str], chunks: List[str]):
+        if self.start is not None and self.substantial:
+            chunks.append(_text(lines, self.start, self.end))
+        self.start = self.end = None
+        self.substantial = False
+
+# --- Python ---
+
+def _python_start(node, lines: List[str]) -> int:
+    first = min([d.lineno for d in getattr(node, "decorator_list", [])] + [node.lineno]) - 1
+    return _leading_comments_start(lines, first, ("#",))
+
+def _is_docstring(node) -> bool:
+    return isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant) and isinstance(node.value.value, str)
+
+def _split_python_class(node: ast.ClassDef, lines: List[str], start: int) -> List[str]:
+    body = node.body
+    first_body = body[0]
+    if first_body.lineno == node.lineno:
+        return [_text(lines, start, node.end_lineno)] # One-line class body, nothing to split
+    header_end = _python_start(first_body, lines)
+    if _is_docstring(first_body):
+        header_end = first_body.end_lineno
+        body = body[1:]
+    header = _text(lines, start, header_end)
+    indent = lines[first_body.lineno - 1][:len(lines[first_body.lineno - 1]) - len(lines[first_body.lineno - 1].lstrip())]
+
+    chunks = []
+    attributes = []
+    for member in body:
+        member_start = _python_start(member, lines)
+        text = _text(lines, member_start, member.end_lineno)
+        if isinstance(member, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            chunks.append(f"{header}{indent}...\n{text}")
+        else:
+            attributes.append(text)
+    if attributes:
+        chunks.insert(0, header + "".join(attributes))
+    return chunks or [_text(lines, start, node.end_lineno)]
+
+def chunk_python(source: str) -> List[str]:
+    tree = ast.parse(source)
+    lines = source.splitlines(keepends=True)
+    chunks = []
+    region = _Region()
+    for node in tree.body:
+        if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            region.flush(lines, chunks)
+            start = _python_start(node, lines)
+            text = _text(lines, start, node.end_lineno)
+            if isinstance(node, ast.ClassDef) and estimate_tokens(text) > CODE_CLASS_MAX_TOKENS:
+                chunks.extend(_split_python_class(node, lines, start))
+            else:
+                chunks.append(text)
+        else:
+            # Imports and the module docstring alone aren't worth a chunk; other top-level code is
+            substantial = not isinstance(node, (ast.Import, ast.ImportFrom)) and not _is_docstring(node)
+            region.add(_python_start(node, lines), node.end_lineno, substantial)
+    region.flush(lines, chunks)
+    return chunks
+
+# --- JavaScript / TypeScript / Java (tree-sitter) ---
+
+_TS_MODULES = {
+    "javascript": ("tree_sitter_javascript", "language"),
+    "typescript": ("tree_sitter_typescript", "language_typescript"),
+    "tsx": ("tree_sitter_typescript", "language_tsx"),
+    "java": ("tree_sitter_java", "language"),
+}
+_TS_CLASS_TYPES = {
+    "class_declaration", "abstract_class_declaration", "interface_declaration",
+    "enum_declaration", "record_declaration",
+}
+_TS_MEMBER_TYPES = {
+    "method_definition", "method_declaration", "constructor_declaration", "method_signature",
+    "abstract_method_signature", "class_declaration", "interface_declaration",
+}
+_TS_SKIPPED_TYPES = {"import_statement", "import_declaration", "package_declaration", "empty_statement"}
+_TS_COMMENT_TYPES = {"comment", "line_comment", "block_comment"} # Java splits them, JS/TS don't
+_COMMENT_PREFIXES = ("//", "/*", "*")
+
+_ts_languages: dict = {}
+
+def _ts_language(language: str):
+    """The tree-sitter Language, or None if tree-sitter or the grammar isn't installed."""
+    if language not in _ts_languages:
+        try:
+            import importlib
+            from tree_sitter import Language
+            module_name, function = _TS_MODULES[language]
+            _ts_languages[language] = Language(getattr(importlib.import_module(module_name), function)())
+        except Exception:
+            _ts_languages[language] = None
+    return _ts_languages[language]
+
+def load_grammars() -> list:
+    """Loads every installed tree-sitter grammar now rather than on first use; returns the loaded languages."""
+    return [language for language in _TS_MODULES if _ts_language(language) is not None]
+
+def _split_ts_class(node, lines: List[str], start: int) -> List[str] | None:
+    body = node.child_by_field_name("body")
+    if body is None or not body.named_children:
+        return None
+    # Signature up to and including the opening brace, then each member under it
+    brace_line = lines[body.start_point[0]].encode("utf-8")[:body.start_point[1] + 1].decode("utf-8", "replace")
+    header = _text(lines, start, body.start_point[0]) + brace_line.rstrip() + "\n"
+    first = body.named_children[0]
+    indent_line = lines[first.start_point[0]]
+    indent = indent_line[:len(indent_line) - len(indent_line.lstrip())]
+    closing = lines[body.end_point[0]][:body.end_point[1]].strip() or "}"
+
+    chunks = []
+    attributes = []
+    pending_comment = None
+    for member in body.named_children:
+        if member.type in _TS_COMMENT_TYPES:
+            pending_comment = member.start_point[0] if pending_comment is None else pending_comment
+            continue
+        member_start = pending_comment if pending_comment is not None else member.start_point[0]
+        pending_comment = None
+        text = _text(lines, member_start, member.end_point[0] + 1)
+        if member.type in _TS_MEMBER_TYPES:
+            chunks.append(f"{header}{indent}// ...\n{text}{closing}\n")
+        else:
+            attributes.append(text)
+    if attributes:
+        chunks.insert(0, header + "".join(attributes) + closing + "\n")
+    return chunks or None
+
+def _chunk_tree_sitter(source: str, ts_language) -> List[str]:
+    from tree_sitter import Parser
+    raw = source.encode("utf-8")
+    tree = Parser(ts_language).parse(raw) # Parsers aren't thread-safe; they're cheap to create
+    lines = source.splitlines(keepends=True)
+    chunks = []
+    region = _Region()
+    pending_comment = None
+    for node in tree.root_node.named_children:
+        if node.type in _TS_COMMENT_TYPES:
+            pending_comment = node.start_point[0] if pending_comment is None else pending_comment
+            continue
+        start = pending_comment if pending_comment is not None else node.start_point[0]
+        pending_comment = None
+        end = node.end_point[0] + 1
+        if node.type in _TS_SKIPPED_TYPES:
+            region.add(start, end, False)
+            continue
+
+        declaration = node.child_by_field_name("declaration") if node.type == "export_statement" else node
+        declaration = declaration or node
+        if end - start < CODE_MIN_DECLARATION_LINES and declaration.type not in _TS_CLASS_TYPES:
+            region.add(start, end, True)
+            continue
+        region.flush(lines, chunks)
+        text = _text(lines, start, end)
+        if declaration.type in _TS_CLASS_TYPES and estimate_tokens(text) > CODE_CLASS_MAX_TOKENS:
+            chunks.extend(_split_ts_class(declaration, lines, start) or [text])
+        else:
+            chunks.append(text)
+    region.flush(lines, chunks)
+    return chunks
+
+# --- Fallback for brace languages without tree-sitter ---
+
+def _top_level_statements(source: str) -> List[tuple]:
+    """
+    (start_line, end_line) of each top-level statement, found by tracking brace depth while
+    skipping strings and comments. A statement ends at a ';' or a closing '}' at depth 0.
+    """
+    statements = []
+    depth = 0
+    line = 0
+    start_line = None
+    i = 0
+    n = len(source)
+    while i < n:
+        c = source[i]
+        if c == "\n":
+            line += 1
+        elif c in " \t\r":
+            pass
+        elif source.startswith("//", i):
+            end = source.find("\n", i)
+            i = n if end == -1 else end
+            continue
+        elif source.startswith("/*", i):
+            end = source.find("*/", i + 2)
+            end = n if end == -1 else end + 2
+            line += source.count("\n", i, end)
+            i = end
+            continue
+        elif c in "\"'`":
+            if start_line is None:
+                start_line = line
+            j = i + 1
+            while j < n and source[j] != c:
+                j += 2 if source[j] == "\\" else 1
+            line += source.count("\n", i, j)
+            i = j + 1
+            continue
+        else:
+            if start_line is None:
+                start_line = line
+            if c == "{":
+                depth += 1
+            elif c == "}":
+                depth = max(0, depth - 1)
+                if depth == 0:
+                    # "};" and "}," belong to the statement this brace closes
+                    rest = source[i + 1:source.find("\n", i + 1) if source.find("\n", i + 1) != -1 else n]
+                    if rest.strip() in ("", ";", ","):
+                        statements.append((start_line, line + 1))
+                        start_line = None
+            elif c == ";" and depth == 0:
+                statements.append((start_line, line + 1))
+                start_line = None
+        i += 1
+    if start_line is not None:
+        statements.append((start_line, line + 1))
+    return statements
+
+def _chunk_braces(source: str) -> List[str]:
+    lines = source.splitlines(keepends=True)
+    chunks = []
+    region = _Region()
+    last_end = 0
+    for start, end in _top_level_statements(source):
+        start = max(last_end, _leading_comments_start(lines, start, _COMMENT_PREFIXES))
+        first_word = lines[start].lstrip().split(" ", 1)[0] if start < len(lines) else ""
+        if first_word in ("import", "package"):
+            region.add(start, end, False)
+        elif end - start < CODE_MIN_DECLARATION_LINES:
+            region.add(start, end, True)
+        else:
+            region.flush(lines, chunks)
+            chunks.append(_text(lines, start, end))
+        last_end = end
+    region.flush(lines, chunks)
+    return chunks
+
+def chunk_code(source: str, language: str) -> List[str]:
+    """Chunks source code of the given language (see CODE_LANGUAGES). Falls back to the whole file."""
+    if language == "python":
+        chunks = chunk_python(source)
+    else:
+        ts_language = _ts_language(language)
+        chunks = _chunk_tree_sitter(source, ts_language) if ts_language is not None else _chunk_braces(source)
+    return [chunk for chunk in chunks if chunk.strip()] or ([source] if source.strip() else [])
+
+class CodeChunkCache:
+    """
+    In-process LRU of chunking results keyed by (content hash, language), bounded by the total
+    size of the cached chunks. Re-uploaded or vendored-in-every-repo files are chunked once.
+    """
+
+    def __init__(self, max_bytes: int = CODE_CHUNK_CACHE_MAX_BYTES):
+        self.max_bytes = max_bytes
+        self._entries = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0}
+
+    @staticmethod
+    def key(content: bytes, language: str) -> tuple:
+        return hashlib.sha256(content).hexdigest(), language
+
+    def get(self, key: tuple) -> List[str] | None:
+        with self._lock:
+            chunks = self._entries.get(key)
+            if chunks is None:
+                self.stats["misses"] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.stats["hits"] += 1
+            return list(chunks)
+
+    def set(self, key: tuple, chunks: List[str]):
+        size = sum(len(chunk) for chunk in chunks)
+        if size > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                return
+            self._entries[key] = list(chunks)
+            self._bytes += size
+            while self._bytes > self.max_bytes:
+                _, evicted = self._entries.popitem(last=False)
+                self._bytes -= sum(len(chunk) for chunk in evicted)
+
+_code_chunk_cache = CodeChunkCache()
+
+def get_code_chunk_cache() -> CodeChunkCache:
+    return _code_chunk_cache
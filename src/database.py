@@ -1,14 +1,33 @@
 #Establishes the SQLAlchemy async engine and session management for the application database (SQLite for development).
 
 
+import os
 from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
 from sqlalchemy.orm import declarative_base
 
 # Use SQLite for local development
-DATABASE_URL = "sqlite+aiosqlite:///./foundry.db"
+DATABASE_URL = os.environ.get("DATABASE_URL", "sqlite+aiosqlite:///./foundry.db")
+# Log every SQL statement (noisy; for debugging only)
+DATABASE_ECHO = os.environ.get("DATABASE_ECHO", "0") == "1"
+# Connections kept open per process, plus how many more may be opened under load. Each worker
+# process keeps its pool for its whole life (see src/runtime.py), so size it to the task concurrency.
+DATABASE_POOL_SIZE = int(os.environ.get("DATABASE_POOL_SIZE", 5))
+DATABASE_MAX_OVERFLOW = int(os.environ.get("DATABASE_MAX_OVERFLOW", 10))
+DATABASE_POOL_RECYCLE_SECONDS = int(os.environ.get("DATABASE_POOL_RECYCLE_SECONDS", 1800))
+
+def _engine_options(url: str) -> dict:
+    if url.startswith("sqlite") and (":memory:" in url or url.rstrip("/").endswith(":")):
+        return {"echo": DATABASE_ECHO} # In-memory SQLite: one static connection, no pool to size
+    return {
+        "echo": DATABASE_ECHO,
+        "pool_size": DATABASE_POOL_SIZE,
+        "max_overflow": DATABASE_MAX_OVERFLOW,
+        "pool_recycle": DATABASE_POOL_RECYCLE_SECONDS,
+        "pool_pre_ping": True, # Long-lived pools outlast server-side idle timeouts
+    }
 
 # Create the async engine
-engine = create_async_engine(DATABASE_URL, echo=True)
+engine = create_async_engine(DATABASE_URL, **_engine_options(DATABASE_URL))
 
 # Create a session maker
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
@@ -0,0 +1,217 @@
+#Near-duplicate detection for generated items. The recipe's key fields (see "dedup" in RECIPE_SCHEMAS)
+#are shingled into character n-grams and MinHashed; an LSH index over signature bands finds
+#candidates, which are confirmed by estimated Jaccard similarity. The index lives in SQLite, so
+#memory stays bounded at millions of items, and it can be shared across jobs via DEDUP_INDEX_PATH.
+#Shards of a sharded job each use their own index; the merge dedups across shards (sharding.py).
+
+import os
+import re
+import zlib
+import sqlite3
+import hashlib
+import asyncio
+import threading
+import numpy as np
+from typing import Iterable, List
+from .schemas import RECIPE_SCHEMAS
+
+DEDUP_ENABLED = os.environ.get("DEDUP_ENABLED", "1") == "1"
+# Unset: one index per job (kept across retries, removed on completion). Set: shared by every job.
+DEDUP_INDEX_PATH = os.environ.get("DEDUP_INDEX_PATH")
+DEDUP_THRESHOLD = float(os.environ.get("DEDUP_THRESHOLD", 0.8)) # Estimated Jaccard to call a duplicate
+DEDUP_NUM_PERM = int(os.environ.get("DEDUP_NUM_PERM", 128))
+DEDUP_BANDS = int(os.environ.get("DEDUP_BANDS", 32)) # Rows per band = NUM_PERM / BANDS
+DEDUP_SHINGLE_SIZE = int(os.environ.get("DEDUP_SHINGLE_SIZE", 5))
+
+# Fixed seed: signatures must be comparable across processes and jobs sharing an index
+_HASH_SEED = 20240601
+_MERSENNE_PRIME = (1 << 31) - 1
+_NON_WORD = re.compile(r"\W+")
+
+def get_dedup_fields(recipe_name: str) -> List[str]:
+    return RECIPE_SCHEMAS.get(recipe_name, {}).get("dedup", {}).get("fields", [])
+
+def _normalize(text: str) -> str:
+    return _NON_WORD.sub(" ", text.lower()).strip()
+
+class MinHasher:
+
+    def __init__(self, num_perm: int = DEDUP_NUM_PERM, shingle_size: int = DEDUP_SHINGLE_SIZE):
+        self.num_perm = num_perm
+        self.shingle_size = shingle_size
+        rng = np.random.RandomState(_HASH_SEED)
+        # Universal hashing a*x + b mod p: with x, a, b < p = 2**31 - 1 nothing overflows uint64,
+        # and p has to be well below a*x for the permutations to actually mix
+        self._a = rng.randint(1, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+        self._b = rng.randint(0, _MERSENNE_PRIME, size=num_perm, dtype=np.uint64)
+
+    def signature(self, text: str) -> np.ndarray | None:
+        text = _normalize(text)
+        if not text:
+            return None
+        k = self.shingle_size
+        shingles = {text[i:i + k] for i in range(max(1, len(text) - k + 1))}
+        hashes = np.fromiter((zlib.crc32(s.encode("utf-8")) % _MERSENNE_PRIME for s in shingles),
+                             dtype=np.uint64, count=len(shingles))
+        permuted = (np.outer(self._a, hashes) + self._b[:, None]) % np.uint64(_MERSENNE_PRIME)
+        return permuted.min(axis=1).astype(np.uint32)
+
+class NearDuplicateIndex:
+    """
+    MinHash LSH index for one recipe. check_batch() looks each item up and, if it's not a
+    duplicate, adds it, all under one lock and transaction, so concurrent generation tasks
+    can't both accept the same item. Sources (chunk ids, stored as "scope:chunk_id") identify
+    where an item came from: an item never matches an earlier entry from its own source, and
+    prune() drops the entries of chunks whose results a resumed job has cut back.
+    """
+
+    def __init__(self, recipe_name: str, path: str = ":memory:", scope: str = "", threshold: float = DEDUP_THRESHOLD,
+                 num_perm: int = DEDUP_NUM_PERM, bands: int = DEDUP_BANDS):
+        if num_perm % bands:
+            raise ValueError(f"DEDUP_NUM_PERM ({num_perm}) must be a multiple of DEDUP_BANDS ({bands})")
+        self.recipe_name = recipe_name
+        self.fields = get_dedup_fields(recipe_name)
+        self.path = path
+        self.scope = scope # Prefixed to sources, e.g. the job's task_id in a shared index
+        self.threshold = threshold
+        self.bands = bands
+        self.rows = num_perm // bands
+        self.hasher = MinHasher(num_perm)
+        # Buckets are namespaced by recipe and LSH shape, so a shared index never mixes them
+        self._namespace = f"{recipe_name}:{num_perm}:{bands}:{self.hasher.shingle_size}".encode("utf-8")
+        self._lock = threading.Lock()
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=30)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS signatures ("
+            "id INTEGER PRIMARY KEY, source TEXT NOT NULL, signature BLOB NOT NULL)"
+        )
+        self._conn.execute("CREATE TABLE IF NOT EXISTS buckets (bucket INTEGER NOT NULL, item_id INTEGER NOT NULL)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_buckets_bucket ON buckets(bucket)")
+        self._conn.execute("CREATE INDEX IF NOT EXISTS idx_signatures_source ON signatures(source)")
+        self._conn.commit()
+
+    def key_text(self, item: dict) -> str:
+        return "\n".join(str(item.get(field) or "") for field in self.fields)
+
+    def _band_keys(self, signature: np.ndarray) -> List[int]:
+        keys = []
+        for band in range(self.bands):
+            digest = hashlib.blake2b(signature[band * self.rows:(band + 1) * self.rows].tobytes(), digest_size=8,
+                                     key=self._namespace[:64], person=band.to_bytes(2, "little")).digest()
+            keys.append(int.from_bytes(digest, "little", signed=True))
+        return keys
+
+    def _check_and_add(self, item: dict, source: str):
+        signature = self.hasher.signature(self.key_text(item))
+        if signature is None:
+            return None # Nothing to compare on
+        band_keys = self._band_keys(signature)
+        placeholders = ",".join("?" * len(band_keys))
+        candidates = self._conn.execute(
+            f"SELECT DISTINCT s.id, s.source, s.signature FROM buckets b JOIN signatures s ON s.id = b.item_id "
+            f"WHERE b.bucket IN ({placeholders})", band_keys
+        ).fetchall()
+        best = None
+        for _, candidate_source, blob in candidates:
+            if candidate_source == source:
+                continue
+            similarity = float(np.mean(np.frombuffer(blob, dtype=np.uint32) == signature))
+            if similarity >= self.threshold and (best is None or similarity > best[1]):
+                best = (candidate_source, similarity)
+        if best is not None:
+            return best
+
+        item_id = self._conn.execute(
+            "INSERT INTO signatures (source, signature) VALUES (?, ?)", (source, signature.tobytes())
+        ).lastrowid
+        self._conn.executemany("INSERT INTO buckets (bucket, item_id) VALUES (?, ?)", [(key, item_id) for key in band_keys])
+        return None
+
+    def _check_batch(self, items: List[dict], sources: List[str]):
+        with self._lock:
+            try:
+                results = [self._check_and_add(item, source) for item, source in zip(items, sources)]
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return results
+
+    def check_batch_sync(self, items: List[dict], sources: List[str]) -> List[tuple | None]:
+        """check_batch() for callers that are already off the event loop, e.g. in a worker thread."""
+        if not self.fields or not items:
+            return [None] * len(items)
+        return self._check_batch(items, [self._source(source) for source in sources])
+
+    async def check_batch(self, items: List[dict], sources: List[str]) -> List[tuple | None]:
+        """
+        Per item: None if it's new (it's now indexed), or (source_of_original, similarity) if
+        it near-duplicates an indexed item. Items are checked in order, so duplicates within
+        the batch are caught too.
+        """
+        return await asyncio.to_thread(self.check_batch_sync, items, sources)
+
+    def _source(self, chunk_id: str) -> str:
+        return f"{self.scope}:{chunk_id}" if self.scope else chunk_id
+
+    def _prune(self, keep: set) -> int:
+        with self._lock:
+            if self.scope:
+                # Sources "scope:..." sort between "scope:" and "scope;" (";" follows ":")
+                rows = self._conn.execute(
+                    "SELECT id, source, signature FROM signatures WHERE source >= ? AND source < ?",
+                    (f"{self.scope}:", f"{self.scope};")
+                )
+            else:
+                rows = self._conn.execute("SELECT id, source, signature FROM signatures")
+            stale = [(item_id, blob) for item_id, source, blob in rows.fetchall() if source not in keep]
+            try:
+                for item_id, blob in stale:
+                    # Through the bucket index: buckets has none on item_id
+                    self._conn.executemany(
+                        "DELETE FROM buckets WHERE bucket = ? AND item_id = ?",
+                        [(key, item_id) for key in self._band_keys(np.frombuffer(blob, dtype=np.uint32))]
+                    )
+                self._conn.executemany("DELETE FROM signatures WHERE id = ?", [(item_id,) for item_id, _ in stale])
+                self._conn.commit()
+            except Exception:
+                self._conn.rollback()
+                raise
+        return len(stale)
+
+    async def prune(self, completed_chunk_ids: Iterable[str]) -> int:
+        """
+        Removes this scope's entries from chunks not in completed_chunk_ids, e.g. when a job
+        resumes: their results were cut back with the result file, so later items mustn't be
+        dropped as duplicates of them. Returns the number of entries removed.
+        """
+        keep = {self._source(chunk_id) for chunk_id in completed_chunk_ids}
+        return await asyncio.to_thread(self._prune, keep)
+
+    def close(self, remove: bool = False):
+        """remove deletes a per-job index file once the job has completed; the shared index is always kept."""
+        self._conn.close()
+        if remove and self.path not in (":memory:", DEDUP_INDEX_PATH):
+            for suffix in ("", "-wal", "-shm"):
+                try:
+                    os.remove(self.path + suffix)
+                except FileNotFoundError:
+                    pass
+
+def dedup_enabled(options: dict | None = None) -> bool:
+    return bool((options or {}).get("dedup", DEDUP_ENABLED))
+
+def open_job_index(recipe_name: str, task_id: str, index_dir: str, options: dict | None = None,
+                   path: str | None = None):
+    """
+    The job's NearDuplicateIndex, or None if dedup is off for the job or the recipe has no key
+    fields. path overrides the index file, e.g. for a shard's own index.
+    """
+    if not dedup_enabled(options) or not get_dedup_fields(recipe_name):
+        return None
+    path = path or DEDUP_INDEX_PATH or os.path.join(index_dir, f"{task_id}.dedup.sqlite")
+    return NearDuplicateIndex(recipe_name, path, scope=task_id)
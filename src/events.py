@@ -0,0 +1,160 @@
+#Job event bus over Redis pub/sub. Workers publish status changes and progress snapshots on a
+#per-job channel; the API's SSE/WebSocket endpoints relay them, so clients don't poll the
+#status endpoint. If Redis is unreachable, subscribers fall back to reading the Job row.
+
+import os
+import json
+import time
+import asyncio
+import weakref
+
+JOB_EVENTS_REDIS_URL = os.environ.get("JOB_EVENTS_REDIS_URL", os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+JOB_EVENTS_CHANNEL_PREFIX = "foundry:jobs"
+JOB_EVENTS_HEARTBEAT_SECONDS = float(os.environ.get("JOB_EVENTS_HEARTBEAT_SECONDS", 15))
+# Only used when Redis is down: how often subscribers re-read the job instead
+JOB_EVENTS_POLL_SECONDS = float(os.environ.get("JOB_EVENTS_POLL_SECONDS", 5))
+# After a failed publish, how long a process skips publishing before trying Redis again
+JOB_EVENTS_REDIS_RETRY_SECONDS = float(os.environ.get("JOB_EVENTS_REDIS_RETRY_SECONDS", 30))
+
+# RETRYING isn't terminal: the worker publishes FAILED only once the job's retries are used up
+TERMINAL_STATUSES = ("COMPLETED", "FAILED")
+
+def job_channel(task_id: str) -> str:
+    return f"{JOB_EVENTS_CHANNEL_PREFIX}:{task_id}"
+
+def status_event(task_id: str, status: str, error: str | None = None, progress: dict | None = None) -> dict:
+    event = {"type": "status", "task_id": task_id, "status": status, "error": error, "at": time.time()}
+    if progress is not None:
+        event["progress"] = progress
+    return event
+
+def progress_event(task_id: str, progress: dict) -> dict:
+    return {"type": "progress", "task_id": task_id, "progress": progress, "at": time.time()}
+
+def error_event(task_id: str, error: str) -> dict:
+    return {"type": "error", "task_id": task_id, "error": error, "at": time.time()}
+
+def is_terminal(event: dict) -> bool:
+    return event.get("type") == "status" and event.get("status") in TERMINAL_STATUSES
+
+class JobEventPublisher:
+    """Best-effort publisher: events are a latency optimisation, the Job row stays the source of truth."""
+
+    def __init__(self, url: str | None = JOB_EVENTS_REDIS_URL):
+        self.url = url
+        self._client = None
+        self._retry_at = 0.0 # monotonic time before which publishing isn't tried again
+
+    def _publish(self, channel: str, payload: str):
+        if self._client is None:
+            import redis
+            # Sync client in a thread: works from any event loop, unlike redis.asyncio clients
+            self._client = redis.Redis.from_url(self.url, socket_timeout=5, socket_connect_timeout=5)
+        self._client.publish(channel, payload)
+
+    async def publish(self, event: dict):
+        if not self.url or time.monotonic() < self._retry_at:
+            return
+        try:
+            await asyncio.to_thread(self._publish, job_channel(event["task_id"]), json.dumps(event))
+        except Exception as e:
+            # Don't retry (and time out) on every event; subscribers still see the final status
+            # by re-reading the job when the channel is quiet
+            print(f"--- Job events: Redis publish failed ({e}), skipping events for "
+                  f"{JOB_EVENTS_REDIS_RETRY_SECONDS:g}s. ---")
+            self._retry_at = time.monotonic() + JOB_EVENTS_REDIS_RETRY_SECONDS
+
+_publisher = None
+
+def get_event_publisher() -> JobEventPublisher:
+    global _publisher
+    if _publisher is None:
+        _publisher = JobEventPublisher()
+    return _publisher
+
+async def publish_job_event(event: dict):
+    await get_event_publisher().publish(event)
+
+# redis.asyncio clients are bound to the loop they first run on, so keep one per loop
+_subscriber_clients = weakref.WeakKeyDictionary()
+
+def _subscriber_client():
+    import redis.asyncio as aioredis
+    loop = asyncio.get_running_loop()
+    client = _subscriber_clients.get(loop)
+    if client is None:
+        client = aioredis.from_url(JOB_EVENTS_REDIS_URL)
+        _subscriber_clients[loop] = client
+    return client
+
+async def job_event_stream(task_id: str, load_status):
+    """
+    Async generator of events for one job, ending after a terminal status. load_status() is an
+    async callable returning the job's current status event (or None if the job doesn't exist);
+    it's called after subscribing, so nothing published in between is missed. Yields
+    {"type": "heartbeat"} when the channel is quiet, so proxies keep the connection open, and
+    re-reads the job then, so a terminal status whose event was lost still ends the stream. If
+    Redis fails mid-stream, yields an {"type": "error"} event and ends; clients reconnect.
+    """
+    pubsub = None
+    if JOB_EVENTS_REDIS_URL:
+        try:
+            pubsub = _subscriber_client().pubsub()
+            await pubsub.subscribe(job_channel(task_id))
+        except Exception as e:
+            print(f"--- Job events: Redis subscribe failed ({e}), falling back to polling. ---")
+            pubsub = None
+
+    try:
+        current = await load_status()
+        if current is None:
+            return
+        yield current
+        if is_terminal(current):
+            return
+
+        if pubsub is None:
+            # Degraded mode: re-read the row periodically, still only pushing changes
+            last = current
+            while True:
+                await asyncio.sleep(JOB_EVENTS_POLL_SECONDS)
+                current = await load_status()
+                if current is None:
+                    return
+                if (current["status"], current.get("progress")) != (last["status"], last.get("progress")):
+                    yield current
+                    last = current
+                else:
+                    yield {"type": "heartbeat"}
+                if is_terminal(current):
+                    return
+
+        while True:
+            try:
+                message = await pubsub.get_message(ignore_subscribe_messages=True, timeout=JOB_EVENTS_HEARTBEAT_SECONDS)
+                if message is not None:
+                    event = json.loads(message["data"])
+            except Exception as e:
+                print(f"--- Job events: Redis read failed ({e}), closing the stream. ---")
+                yield error_event(task_id, f"Event stream interrupted: {e}")
+                return
+            if message is None:
+                # Quiet channel: the worker may have finished without its event getting through
+                current = await load_status()
+                if current is None:
+                    return
+                if is_terminal(current):
+                    yield current
+                    return
+                yield {"type": "heartbeat"}
+                continue
+            yield event
+            if is_terminal(event):
+                return
+    finally:
+        if pubsub is not None:
+            try:
+                await pubsub.unsubscribe()
+                await pubsub.aclose()
+            except Exception:
+                pass
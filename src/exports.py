@@ -0,0 +1,105 @@
+#Post-processing exports of a finished result file: gzip- or zstd-compressed JSONL and Parquet
+#(typed from the recipe's JSON schema). Each export is streamed from the JSONL in bounded memory
+#and written to a temp file that is renamed into place, so a download never sees a partial one.
+#zstd needs the zstandard package and Parquet needs pyarrow; both are optional.
+
+import os
+import json
+import gzip
+import shutil
+import importlib.util
+from .schemas import get_schema_for_recipe
+
+EXPORT_FORMATS = ("jsonl.gz", "jsonl.zst", "parquet")
+EXPORT_MEDIA_TYPES = {
+    "jsonl": "application/x-ndjson",
+    "jsonl.gz": "application/gzip",
+    "jsonl.zst": "application/zstd",
+    "parquet": "application/vnd.apache.parquet",
+}
+_EXPORT_MODULES = {"jsonl.zst": "zstandard", "parquet": "pyarrow"}
+
+# Exports produced for every job unless the job asks for its own, e.g. "jsonl.zst,parquet"
+RESULT_EXPORTS = os.environ.get("RESULT_EXPORTS", "")
+EXPORT_GZIP_LEVEL = int(os.environ.get("EXPORT_GZIP_LEVEL", 6))
+EXPORT_ZSTD_LEVEL = int(os.environ.get("EXPORT_ZSTD_LEVEL", 3))
+PARQUET_ROW_GROUP_SIZE = int(os.environ.get("PARQUET_ROW_GROUP_SIZE", 50_000))
+EXPORT_BLOCK_SIZE = 1024 * 1024
+
+def export_available(fmt: str) -> bool:
+    module = _EXPORT_MODULES.get(fmt)
+    return module is None or importlib.util.find_spec(module) is not None
+
+def parse_exports(value: str | None) -> list:
+    """"jsonl.gz, parquet" -> ["jsonl.gz", "parquet"]; raises ValueError on unknown or unavailable formats."""
+    formats = list(dict.fromkeys(f.strip() for f in (value or "").split(",") if f.strip()))
+    for fmt in formats:
+        if fmt not in EXPORT_FORMATS:
+            raise ValueError(f"Unknown export format: {fmt} (expected one of {', '.join(EXPORT_FORMATS)})")
+        if not export_available(fmt):
+            raise ValueError(f"Export format {fmt} needs the {_EXPORT_MODULES[fmt]} package on the server")
+    return formats
+
+def export_path_for(result_path: str, fmt: str) -> str:
+    base, _ = os.path.splitext(result_path)
+    return f"{base}.{fmt}"
+
+def _write_gzip(result_path: str, out_path: str):
+    with open(result_path, "rb") as src, gzip.open(out_path, "wb", compresslevel=EXPORT_GZIP_LEVEL) as dst:
+        shutil.copyfileobj(src, dst, EXPORT_BLOCK_SIZE)
+
+def _write_zstd(result_path: str, out_path: str):
+    import zstandard
+    compressor = zstandard.ZstdCompressor(level=EXPORT_ZSTD_LEVEL, threads=-1)
+    with open(result_path, "rb") as src, open(out_path, "wb") as dst:
+        compressor.copy_stream(src, dst, read_size=EXPORT_BLOCK_SIZE, write_size=EXPORT_BLOCK_SIZE)
+
+def arrow_schema_for_recipe(recipe_name: str):
+    import pyarrow as pa
+    scalar_types = {"string": pa.string(), "integer": pa.int64(), "number": pa.float64(), "boolean": pa.bool_()}
+    fields = []
+    for name, spec in get_schema_for_recipe(recipe_name)["properties"].items():
+        if spec.get("type") == "array":
+            arrow_type = pa.list_(scalar_types.get(spec.get("items", {}).get("type"), pa.string()))
+        else:
+            arrow_type = scalar_types.get(spec.get("type"), pa.string())
+        fields.append(pa.field(name, arrow_type))
+    return pa.schema(fields)
+
+def _write_parquet(result_path: str, out_path: str, recipe_name: str):
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    schema = arrow_schema_for_recipe(recipe_name)
+    with open(result_path, "rb") as src, pq.ParquetWriter(out_path, schema, compression="zstd") as writer:
+        rows = []
+        for line in src:
+            rows.append(json.loads(line))
+            if len(rows) >= PARQUET_ROW_GROUP_SIZE:
+                writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+                rows = []
+        if rows:
+            writer.write_table(pa.Table.from_pylist(rows, schema=schema))
+
+def write_exports(result_path: str, recipe_name: str, formats: list) -> dict:
+    """Writes each requested export next to result_path. Returns {format: path} for the ones that succeeded."""
+    written = {}
+    for fmt in formats:
+        out_path = export_path_for(result_path, fmt)
+        tmp_path = out_path + ".tmp"
+        try:
+            if fmt == "jsonl.gz":
+                _write_gzip(result_path, tmp_path)
+            elif fmt == "jsonl.zst":
+                _write_zstd(result_path, tmp_path)
+            elif fmt == "parquet":
+                _write_parquet(result_path, tmp_path, recipe_name)
+            else:
+                raise ValueError(f"Unknown export format: {fmt}")
+            os.replace(tmp_path, out_path)
+            written[fmt] = out_path
+        except Exception as e:
+            # Exports are extras on top of the JSONL; a failed one doesn't fail the job
+            print(f"!!! Export {fmt} of {result_path} failed: {e} !!!")
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+    return written
@@ -2,12 +2,35 @@
 
 import os 
 import json
-from .schemas import get_schema_for_recipe
-import google.generativeai as genai 
+import time
+import random
+import hashlib
+from .schemas import RECIPE_SCHEMAS, get_schema_for_recipe, get_batch_schema_for_recipe
+from .rate_limiter import get_rate_limiter
+from .tokens import estimate_tokens
+from .chunking import get_chunking_config
+from .cache import get_result_cache, make_cache_key
+from .metrics import LLM_REQUEST_SECONDS, LLM_RETRIES, LLM_FAILURES
+from .providers import RateLimitError, get_provider, parse_model_spec
 import asyncio 
-from google.api_core.exceptions import ResourceExhausted
+from contextlib import asynccontextmanager
+from typing import List
 
-genai.configure(api_key = os.environ["GEMINI_API_KEY"]) 
+# "provider:model" (see providers.py); a bare model name uses LLM_PROVIDER. Recipes can be pointed
+# elsewhere with LLM_MODEL_<RECIPE> or a "model" entry in RECIPE_SCHEMAS, jobs with options["model"].
+DEFAULT_MODEL_NAME = os.environ.get("LLM_MODEL", "gemini-1.5-flash")
+LLM_MAX_RETRIES = int(os.environ.get("LLM_MAX_RETRIES", 8))
+LLM_MAX_BACKOFF_SECONDS = 60
+# Expected response size, reserved against the tokens-per-minute budget before each call
+LLM_OUTPUT_TOKEN_ESTIMATE = int(os.environ.get("LLM_OUTPUT_TOKEN_ESTIMATE", 512))
+
+# Batched mode: chunks up to the batching threshold are packed up to GENERATION_BATCH_SIZE per
+# request (and BATCH_MAX_TOKENS of input). GENERATION_BATCH_SIZE=1 turns batching off.
+GENERATION_BATCH_SIZE = int(os.environ.get("GENERATION_BATCH_SIZE", 20))
+BATCH_MAX_TOKENS = int(os.environ.get("BATCH_MAX_TOKENS", 4000))
+# Largest chunk that still goes into a batch. 0 (default) derives it per recipe from its chunking
+# target, so the chunks re-chunking produces are batchable; see batch_chunk_limit().
+BATCH_MAX_CHUNK_TOKENS = int(os.environ.get("BATCH_MAX_CHUNK_TOKENS", 0))
 
 SYSTEM_PROMPT_TEMPLATE = """
 You are an expert data curation assistant. Your task is to generate high-quality, structured data from the user-provided text chunk based on the specified recipe.
@@ -21,56 +44,337 @@ JSON SCHEMA:
 {json_schema}
 """
 
-async def generate_data_from_chunk(chunk: str, recipe_name: str, max_retries=3) -> dict | None:
+USER_PROMPT_TEMPLATE = "Here is the text chunk:\n\n---\n{chunk}\n---"
+
+BATCH_SYSTEM_PROMPT_TEMPLATE = """
+You are an expert data curation assistant. Your task is to generate high-quality, structured data from each of the user-provided text chunks based on the specified recipe.
+
+You must adhere to the following rules:
+1.  Treat every chunk independently. Base each result *only* on the information present in its own chunk. Do not add any external knowledge.
+2.  Produce exactly one result per chunk, with "chunk_index" set to the chunk's number.
+3.  Your response MUST be a single, valid JSON object that strictly adheres to the provided JSON schema. Do not add any extra text or explanations.
+
+RECIPE: {recipe_name}
+JSON SCHEMA:
+{json_schema}
+"""
+
+BATCH_CHUNK_TEMPLATE = "[{index}]\n---\n{chunk}\n---"
+
+class RecipeClient:
     """
-    Generates structured data from a text chunk, now with retry logic
-    for rate limit errors.
+    Everything about an LLM call that depends only on (recipe, model): the rendered system
+    prompt, the provider and its model handle. Built once per worker process.
     """
-    
-    # --- Create the model and prompt setup ---
-    try:
+
+    def __init__(self, recipe_name: str, model_name: str):
         schema = get_schema_for_recipe(recipe_name)
-        system_prompt = SYSTEM_PROMPT_TEMPLATE.format(
-            recipe_name=recipe_name, 
-            json_schema=json.dumps(schema, indent=2)
+        self.recipe_name = recipe_name
+        self.model_name = model_name
+        provider_name, provider_model = parse_model_spec(model_name)
+        self.provider = get_provider(provider_name)
+        # Compact JSON: the schema is sent with every request, indentation is pure token cost
+        self.system_prompt = SYSTEM_PROMPT_TEMPLATE.format(
+            recipe_name=recipe_name,
+            json_schema=json.dumps(schema, separators=(",", ":"))
         )
-        model = genai.GenerativeModel(
-            model_name="gemini-1.5-flash",
-            system_instruction=system_prompt
-        )
-        generation_config = genai.types.GenerationConfig(
-            response_mime_type="application/json"
+        self.system_prompt_tokens = estimate_tokens(self.system_prompt)
+        # Result cache namespace: any change to model, schema or prompts invalidates old entries
+        self.cache_namespace = hashlib.sha256("\0".join(
+            [model_name, recipe_name, self.system_prompt, USER_PROMPT_TEMPLATE]
+        ).encode("utf-8")).hexdigest()
+        self.model = self.provider.create_model(provider_model, self.system_prompt)
+        self.required_fields = schema.get("required", [])
+
+        self.batch_system_prompt = BATCH_SYSTEM_PROMPT_TEMPLATE.format(
+            recipe_name=recipe_name,
+            json_schema=json.dumps(get_batch_schema_for_recipe(recipe_name), separators=(",", ":"))
         )
-        user_prompt = f"Here is the text chunk:\n\n---\n{chunk}\n---"
+        self.batch_system_prompt_tokens = estimate_tokens(self.batch_system_prompt)
+        self.batch_cache_namespace = hashlib.sha256("\0".join(
+            [model_name, recipe_name, self.batch_system_prompt, BATCH_CHUNK_TEMPLATE]
+        ).encode("utf-8")).hexdigest()
+        self.batch_model = self.provider.create_model(provider_model, self.batch_system_prompt)
+
+_recipe_clients: dict = {}
+
+# Cumulative per-process timings, so client/prompt setup shows up separately from API latency
+TIMING_STATS = {
+    "client_builds": 0,
+    "client_build_seconds": 0.0,
+    "prompt_builds": 0,
+    "prompt_build_seconds": 0.0,
+    "api_calls": 0,
+    "api_seconds": 0.0,
+    "rate_limit_retries": 0,
+    "tokens": 0,
+}
+
+def get_recipe_client(recipe_name: str, model_name: str = DEFAULT_MODEL_NAME) -> RecipeClient:
+    key = (recipe_name, model_name)
+    client = _recipe_clients.get(key)
+    if client is None:
+        start = time.perf_counter()
+        client = RecipeClient(recipe_name, model_name)
+        _recipe_clients[key] = client
+        TIMING_STATS["client_builds"] += 1
+        TIMING_STATS["client_build_seconds"] += time.perf_counter() - start
+    return client
+
+def select_model(recipe_name: str, options: dict | None = None) -> str:
+    """Model for a job: the job's "model" option, then LLM_MODEL_<RECIPE>, the recipe's "model" entry, LLM_MODEL."""
+    model = (options or {}).get("model")
+    if model:
+        return model
+    model = os.environ.get(f"LLM_MODEL_{recipe_name.upper()}")
+    if model:
+        return model
+    return RECIPE_SCHEMAS.get(recipe_name, {}).get("model") or DEFAULT_MODEL_NAME
+
+def get_timing_stats() -> dict:
+    stats = dict(TIMING_STATS)
+    if stats["api_calls"]:
+        stats["avg_api_seconds"] = stats["api_seconds"] / stats["api_calls"]
+    if stats["prompt_builds"]:
+        stats["avg_prompt_build_seconds"] = stats["prompt_build_seconds"] / stats["prompt_builds"]
+    return stats
+
+async def generate_data_from_chunk(chunk: str, recipe_name: str, max_retries=LLM_MAX_RETRIES,
+                                   model_name: str = DEFAULT_MODEL_NAME, raise_on_rate_limit: bool = False) -> dict | None:
+    """
+    Generates structured data from a text chunk. Calls go through the shared rate limiter,
+    which caps requests/tokens per minute and in-flight calls across all workers, and
+    shrinks concurrency when we hit rate limits. With raise_on_rate_limit, a chunk still rate
+    limited after max_retries raises RateLimitError instead of returning None.
+    """
+    
+    # --- Look up the cached model/prompt setup; only the user prompt is per-chunk ---
+    try:
+        start = time.perf_counter()
+        client = get_recipe_client(recipe_name, model_name)
+        user_prompt = USER_PROMPT_TEMPLATE.format(chunk=chunk)
+        TIMING_STATS["prompt_builds"] += 1
+        TIMING_STATS["prompt_build_seconds"] += time.perf_counter() - start
 
     except Exception as setup_e:
         print(f"!!! LLM setup error: {setup_e} !!!")
         return None # Failed before even making a call
 
+    # Identical chunks under the same recipe/model/prompt skip the API call entirely
+    cache = get_result_cache()
+    cache_key = make_cache_key(client.cache_namespace, chunk) if cache else None
+    if cache:
+        cached = await cache.get(cache_key)
+        if cached is not None:
+            return cached
+
+    estimated_tokens = client.system_prompt_tokens + estimate_tokens(user_prompt) + LLM_OUTPUT_TOKEN_ESTIMATE
+    result = await _generate_json(client, client.model, user_prompt, estimated_tokens, max_retries,
+                                  raise_on_rate_limit=raise_on_rate_limit)
+    if result is not None and cache:
+        await cache.set(cache_key, result)
+    return result
+
+@asynccontextmanager
+async def _call_slot(provider, limiter, estimated_tokens: int):
+    # Per-provider in-flight cap first, then the shared RPM/TPM quota if the provider has one
+    async with provider.slot():
+        if limiter is None:
+            yield
+        else:
+            async with limiter.limit(estimated_tokens):
+                yield
+
+async def _generate_json(client: RecipeClient, model, user_prompt: str, estimated_tokens: int, max_retries: int,
+                         raise_on_rate_limit: bool = False):
+    """
+    Makes one rate-limited LLM call with retries on rate limits and returns the parsed JSON
+    response, or None if the call failed or the response wasn't valid JSON. With
+    raise_on_rate_limit, running out of retries on rate limits raises RateLimitError instead.
+    """
+    provider = client.provider
+    limiter = get_rate_limiter() if provider.shared_quota else None
+
     # Retry loop
     for attempt in range(max_retries):
         try:
             # Make the async API call
-            response = await model.generate_content_async(
-                user_prompt,
-                generation_config=generation_config
-            )
+            async with _call_slot(provider, limiter, estimated_tokens):
+                call_start = time.perf_counter()
+                try:
+                    response = await provider.generate(model, user_prompt)
+                finally:
+                    elapsed = time.perf_counter() - call_start
+                    TIMING_STATS["api_calls"] += 1
+                    TIMING_STATS["api_seconds"] += elapsed
+                    LLM_REQUEST_SECONDS.labels(model=client.model_name).observe(elapsed)
+            if limiter is not None:
+                await limiter.on_success()
+
+            if response.total_tokens:
+                if limiter is not None:
+                    await limiter.adjust_tokens(response.total_tokens - estimated_tokens)
+                TIMING_STATS["tokens"] += response.total_tokens
+            else:
+                TIMING_STATS["tokens"] += estimated_tokens
 
             json_output = response.text
-            return json.loads(json_output) 
+            return json.loads(json_output)
 
-        except ResourceExhausted as e:
-            wait_time = (2 ** attempt) # Exponential backoff: 1s, 2s, 4s
-            print(f"--- Rate limit hit (attempt {attempt + 1}/{max_retries}). Retrying in {wait_time}s... ---")
+        except RateLimitError as e:
+            # The limiter shrinks concurrency and pauses new calls; the jittered backoff
+            # keeps retries of this chunk from landing in lockstep with everyone else's
+            if limiter is not None:
+                await limiter.on_rate_limited()
+            TIMING_STATS["rate_limit_retries"] += 1
+            LLM_RETRIES.labels(reason="rate_limit").inc()
+            wait_time = min(2 ** attempt, LLM_MAX_BACKOFF_SECONDS) * (0.5 + random.random())
+            print(f"--- Rate limit hit (attempt {attempt + 1}/{max_retries}). Retrying in {wait_time:.1f}s... ---")
             await asyncio.sleep(wait_time)
         
         except json.JSONDecodeError as e:
             print(f"!!! LLM generation error: Invalid JSON. {e} !!!")
+            LLM_FAILURES.labels(reason="invalid_json").inc()
             return None # Don't retry on bad JSON, just fail this chunk
 
         except Exception as e:
             print(f"!!! LLM generation error (non-retryable): {e} !!!")
+            LLM_FAILURES.labels(reason="error").inc()
             return None # Fail this chunk
 
     print(f"!!! LLM generation failed for chunk after {max_retries} retries. !!!")
-    return None
\ No newline at end of file
+    LLM_FAILURES.labels(reason="retries_exhausted").inc()
+    if raise_on_rate_limit:
+        raise RateLimitError(f"Still rate limited after {max_retries} retries")
+    return None
+
+def batch_chunk_limit(recipe_name: str | None) -> int:
+    """
+    Largest chunk (in tokens) batched for recipe_name. Re-chunking packs chunks up to the recipe's
+    target_tokens, so that's the limit; recipes that don't merge chunks (target 0) batch anything
+    small enough for a few to share a request.
+    """
+    if BATCH_MAX_CHUNK_TOKENS:
+        return BATCH_MAX_CHUNK_TOKENS
+    target = get_chunking_config(recipe_name)["target_tokens"]
+    return min(target, BATCH_MAX_TOKENS // 2) if target else BATCH_MAX_TOKENS // 4
+
+def plan_batches(chunks: List[dict], batch_size: int = GENERATION_BATCH_SIZE,
+                 recipe_name: str | None = None) -> List[List[dict]]:
+    """
+    Groups small chunks ({"id", "text"} dicts, or {"id", "ref", "tokens"} for chunks held in a
+    ChunkStore) into batches for generate_data_from_batch. Chunks too large to batch (see
+    batch_chunk_limit) are returned as single-element lists, keeping the original order otherwise.
+    """
+    planner = BatchPlanner(batch_size, recipe_name)
+    batches = []
+    for chunk in chunks:
+        batches += planner.add(chunk)
+    return batches + planner.finish()
+
+class BatchPlanner:
+    """plan_batches fed one chunk at a time: add() returns the batches that chunk completed."""
+
+    def __init__(self, batch_size: int = GENERATION_BATCH_SIZE, recipe_name: str | None = None):
+        self.batch_size = batch_size
+        self.max_chunk_tokens = batch_chunk_limit(recipe_name)
+        self.current = []
+        self.current_tokens = 0
+
+    def add(self, chunk: dict) -> List[List[dict]]:
+        tokens = chunk["tokens"] if "tokens" in chunk else estimate_tokens(chunk["text"])
+        if self.batch_size <= 1 or tokens > self.max_chunk_tokens:
+            return [[chunk]]
+        batches = []
+        if self.current and (len(self.current) >= self.batch_size or self.current_tokens + tokens > BATCH_MAX_TOKENS):
+            batches.append(self.current)
+            self.current = []
+            self.current_tokens = 0
+        self.current.append(chunk)
+        self.current_tokens += tokens
+        return batches
+
+    def finish(self) -> List[List[dict]]:
+        batches = [self.current] if self.current else []
+        self.current = []
+        self.current_tokens = 0
+        return batches
+
+async def generate_data_from_batch(chunks: List[str], recipe_name: str, max_retries=LLM_MAX_RETRIES,
+                                   model_name: str = DEFAULT_MODEL_NAME,
+                                   raise_on_rate_limit: bool = False) -> List[dict | None]:
+    """
+    Generates results for several small chunks in one request. Returns one entry per chunk, in
+    order (None for chunks that failed). Chunks whose result is missing or malformed in the batch
+    response fall back to individual generate_data_from_chunk calls; one bad item never sinks
+    the rest of the batch. A batch that ran out of retries on rate limits isn't split up: that
+    would only multiply the requests hitting the limit. Its chunks fail, or with
+    raise_on_rate_limit, RateLimitError is raised for the whole batch.
+    """
+    if len(chunks) == 1:
+        return [await generate_data_from_chunk(chunks[0], recipe_name, max_retries, model_name, raise_on_rate_limit)]
+
+    try:
+        client = get_recipe_client(recipe_name, model_name)
+    except Exception as setup_e:
+        print(f"!!! LLM setup error: {setup_e} !!!")
+        return [None] * len(chunks)
+
+    results = [None] * len(chunks)
+    cache = get_result_cache()
+    cache_keys = [make_cache_key(client.batch_cache_namespace, chunk) for chunk in chunks] if cache else None
+    pending = list(range(len(chunks)))
+    if cache:
+        pending = []
+        for i, key in enumerate(cache_keys):
+            results[i] = await cache.get(key)
+            if results[i] is None:
+                pending.append(i)
+
+    if len(pending) > 1:
+        start = time.perf_counter()
+        user_prompt = "\n\n".join(
+            BATCH_CHUNK_TEMPLATE.format(index=n, chunk=chunks[i]) for n, i in enumerate(pending)
+        )
+        TIMING_STATS["prompt_builds"] += 1
+        TIMING_STATS["prompt_build_seconds"] += time.perf_counter() - start
+        estimated_tokens = (client.batch_system_prompt_tokens + estimate_tokens(user_prompt)
+                            + LLM_OUTPUT_TOKEN_ESTIMATE * len(pending))
+        try:
+            response = await _generate_json(client, client.batch_model, user_prompt, estimated_tokens, max_retries,
+                                             raise_on_rate_limit=True)
+        except RateLimitError:
+            if raise_on_rate_limit:
+                raise
+            return results
+
+        items = response.get("results") if isinstance(response, dict) else None
+        if isinstance(items, list):
+            for item in items:
+                if not isinstance(item, dict):
+                    continue
+                n = item.get("chunk_index")
+                output = item.get("output")
+                if not isinstance(n, int) or not 0 <= n < len(pending) or not isinstance(output, dict):
+                    continue
+                if any(field not in output for field in client.required_fields):
+                    continue
+                i = pending[n]
+                results[i] = output
+                if cache:
+                    await cache.set(cache_keys[i], output)
+        else:
+            print(f"!!! Malformed batch response for {len(pending)} chunks, falling back to single-chunk calls. !!!")
+
+    # Anything the batch didn't cover (or a single leftover miss) goes through the normal path
+    missing = [i for i in pending if results[i] is None]
+    if missing:
+        retried = await asyncio.gather(*(
+            generate_data_from_chunk(chunks[i], recipe_name, max_retries, model_name, raise_on_rate_limit)
+            for i in missing
+        ), return_exceptions=True)
+        for i, result in zip(missing, retried):
+            if isinstance(result, BaseException):
+                raise result
+            results[i] = result
+    return results
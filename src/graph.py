@@ -1,64 +1,325 @@
 from langgraph.graph import StateGraph, END
-from typing import TypedDict, Annotated, List, Dict 
+from langgraph.types import Send
+from langchain_core.runnables import RunnableConfig
+from typing import TypedDict, Annotated, Iterable, List, Dict
 import operator
 import asyncio 
+import os
 
-from .utils import (
-    parse_unstructured_file, 
-    parse_code_file, 
-    parse_tabular_file
-)
-from .generation import generate_data_from_chunk
+from .parsing import iter_parsed_files
+from .archives import iter_job_files
+from .generation import generate_data_from_batch, plan_batches, select_model, BatchPlanner
+from .providers import RateLimitError
+from .chunking import iter_chunks_for_recipe, ChunkPacker
+from .checkpoint import iter_chunk_ids, ChunkIds
+from .chunk_store import ChunkStore
+from .tokens import estimate_tokens
+from .qc import get_validator
+from .dedup import NearDuplicateIndex, dedup_enabled, get_dedup_fields
+from .metrics import timed_node
+
+# Upper bound on generation tasks LangGraph runs at once; the rate limiter decides how many
+# of them actually have a call in flight
+GRAPH_MAX_CONCURRENCY = int(os.environ.get("GRAPH_MAX_CONCURRENCY", 256))
+
+class Replace(list):
+    """A generated_data update that replaces the list instead of extending it."""
+
+def merge_generated(current: list, update: list) -> list:
+    if isinstance(update, Replace):
+        return list(update)
+    return (current or []) + update
+
+def merge_counts(current: dict, update: dict) -> dict:
+    merged = dict(current or {})
+    for key, value in update.items():
+        merged[key] = merged.get(key, 0) + value
+    return merged
 
 class GraphState(TypedDict):
     files_to_process: List[Dict]
     selected_recipe: str 
-    parsed_chunks: List[str]
-    generated_data: list # Will hold list-of-lists, then a flat list
+    options: Dict # Per-job options from the API (tabular columns/sampling, model, ...)
+    pipelined: bool # Streaming mode from files: parsing, chunking and generation overlap in pipeline_node
+    model: str # "provider:model" for this job, set per generation task by the fan-out
+    # Chunk text lives in the job's ChunkStore (passed in the config); the state only holds refs into it
+    parsed_files: List[List[int]] # Per file, in upload order: refs of its parsed chunks
+    parsed_chunks: List[int] # Refs of the re-chunked chunks
+    prepared_chunks: List[Dict] | None # Already chunked {"id", "ref", "tokens"} chunks (a shard's); skips re-chunking
+    chunk_batches: List[List[Dict]] # {"id", "ref", "tokens"} chunks, small ones packed together for batched generation
+    current_batch: List[Dict] # Set per generation task by the fan-out
+    generated_data: Annotated[list, merge_generated] # Will hold list-of-lists, then a flat list
     rejected_data: Annotated[list, operator.add] # For failed QC items
+    stats: Annotated[Dict, merge_counts] # generated/failed/accepted/rejected/duplicates/rate_limited counts (streaming mode)
+    qc_rejections: Annotated[Dict, merge_counts] # Rejected items per QC rule, e.g. {"answer:min_length": 3}
     messages: Annotated[list, operator.add]
 
-async def parsing_node(state: GraphState):
-
-    all_chunks = []
+async def _iter_parsed_in_order(state: GraphState, config: RunnableConfig):
+    """
+    Parses the job's files concurrently and yields (filename, chunk refs) in upload (and archive
+    member) order, each file as soon as it and every file before it have parsed. The order keeps
+    chunking, and so checkpoint ids, the same on every run.
+    """
     files = state.get("files_to_process", [])
+    options = state.get("options") or {}
     print(f"--- Graph: Received {len(files)} files to process. ---")
 
-    for file_info in files:
-        filename = file_info["filename"].lower()
-        content = file_info["content"]
-        chunks = []
-
-        if filename.endswith(('.pdf', '.docx', '.txt', '.md')):
-            chunks = parse_unstructured_file(content, filename)
-        elif filename.endswith(('.py', '.js', '.ts', '.java')):
-            chunks = parse_code_file(content, filename)
-        elif filename.endswith(('.csv', '.xlsx', '.xls')):
-            chunks = parse_tabular_file(content, filename)
-        else:
-            print(f"--- Skipping unsupported file type: {filename} ---")
+    # Files parse concurrently in child processes; results arrive in completion order
+    progress = config.get("configurable", {}).get("progress")
+    store = config["configurable"]["chunk_store"]
+    order = []
+
+    def _pull_files():
+        # Archives are expanded lazily, as the parsers ask for more files
+        for file_info in iter_job_files(files, options):
+            order.append(file_info["filename"])
+            if progress is not None and "archive" in file_info:
+                progress.add("files_total")
+            yield file_info
+
+    parsed = {}
+    released = 0
+    # Chunks go into the store as the parsers stream them; only the refs stay in memory
+    async for filename, refs in iter_parsed_files(_pull_files(), options, store=store):
+        print(f"--- Graph: Parsed {filename} into {len(refs)} chunks. ---")
+        parsed[filename] = refs
+        if progress is not None:
+            progress.add("files_parsed")
+        while released < len(order) and order[released] in parsed:
+            yield order[released], parsed.pop(order[released])
+            released += 1
+    for filename in order[released:]:
+        yield filename, parsed.pop(filename, [])
 
-        all_chunks.extend(chunks)
+@timed_node("parsing_node")
+async def parsing_node(state: GraphState, config: RunnableConfig):
 
-    total_chunks = len(all_chunks)
+    parsed_files = []
+    async for _, refs in _iter_parsed_in_order(state, config):
+        parsed_files.append(refs)
+
+    total_chunks = sum(len(refs) for refs in parsed_files)
     print(f"--- Graph: Total chunks from all files: {total_chunks} ---")
     
     return {
-        "parsed_chunks": all_chunks, 
-        "messages": [f"Processed {len(files)} files into {total_chunks} chunks."]
+        "parsed_files": parsed_files, 
+        "messages": [f"Processed {len(parsed_files)} files into {total_chunks} chunks."]
+    }
+
+@timed_node("pipeline_node")
+async def pipeline_node(state: GraphState, config: RunnableConfig):
+    """
+    Streaming mode from files: parsing, chunking and generation in one node, overlapping. Each
+    file's chunks are re-chunked and batched as soon as it (and every file before it) has parsed,
+    and their batches start generating while later files still parse. Chunks and ids are the
+    same as parsing_node followed by chunking_node would give.
+    """
+    configurable = config["configurable"]
+    store = configurable["chunk_store"]
+    checkpoints = configurable.get("checkpoints")
+    progress = configurable.get("progress")
+    recipe = state["selected_recipe"]
+    model = select_model(recipe, state.get("options"))
+    completed = checkpoints.completed if checkpoints is not None else set()
+
+    packer = ChunkPacker.for_recipe(recipe)
+    ids = ChunkIds()
+    planner = BatchPlanner(recipe_name=recipe)
+    counts = {"parsed": 0, "chunks": 0, "skipped": 0, "requests": 0}
+    reported = {"chunks": 0, "skipped": 0} # Already added to progress
+    totals = {"stats": {}, "qc_rejections": {}}
+    semaphore = asyncio.Semaphore(GRAPH_MAX_CONCURRENCY)
+    tasks = set()
+
+    def _batch(texts) -> List[List[Dict]]:
+        batches = []
+        for text in texts:
+            chunk_id = ids.next_id(text)
+            counts["chunks"] += 1
+            if chunk_id in completed: # Already finished in an earlier attempt of this job
+                counts["skipped"] += 1
+                continue
+            batches += planner.add({"id": chunk_id, "ref": store.append(text), "tokens": estimate_tokens(text)})
+        return batches
+
+    async def _generate(batch):
+        try:
+            update = await generation_node({"selected_recipe": recipe, "model": model, "current_batch": batch}, config)
+            for key in totals:
+                totals[key] = merge_counts(totals[key], update.get(key, {}))
+        finally:
+            semaphore.release()
+
+    async def _submit(batches):
+        if progress is not None:
+            progress.add("chunks_total", counts["chunks"] - reported["chunks"])
+            progress.add("chunks_skipped", counts["skipped"] - reported["skipped"])
+            reported.update(chunks=counts["chunks"], skipped=counts["skipped"])
+        for batch in batches:
+            await semaphore.acquire()
+            for task in [task for task in tasks if task.done()]:
+                tasks.discard(task)
+                task.result() # Surfaces a failed batch now rather than after parsing finishes
+            tasks.add(asyncio.create_task(_generate(batch)))
+            counts["requests"] += 1
+            if progress is not None:
+                progress.generation_started()
+
+    try:
+        async for _, refs in _iter_parsed_in_order(state, config):
+            counts["parsed"] += len(refs)
+            # Files are packed separately: a chunk never mixes text from two files
+            texts = [text for parsed in store.iter_texts(refs) for text in packer.add(parsed)] + packer.finish()
+            await _submit(_batch(texts))
+        await _submit(planner.finish())
+        await asyncio.gather(*tasks)
+    except BaseException:
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+        raise
+
+    if counts["skipped"]:
+        print(f"--- Graph: Resuming, {counts['skipped']} chunks already done. ---")
+    print(f"--- Graph: Re-chunked {counts['parsed']} parsed chunks into {counts['chunks']} chunks "
+          f"in {counts['requests']} requests ---")
+    return {
+        "stats": totals["stats"],
+        "qc_rejections": totals["qc_rejections"],
+        "messages": [f"Generated {counts['chunks'] - counts['skipped']} chunks while parsing."],
     }
 
-async def generation_node(state: GraphState):
+@timed_node("chunking_node")
+async def chunking_node(state: GraphState, config: RunnableConfig):
+
+    # Even out chunk sizes (per-recipe token budgets), then group what's still small into batches
+    parsed_files = state.get("parsed_files", [])
+    chunks = state.get("prepared_chunks")
+    if chunks is None:
+        chunks = _rechunk(config["configurable"]["chunk_store"], parsed_files, state.get("selected_recipe"))
+
+    # Skip chunks that already finished in an earlier attempt of this job
+    pending = chunks
+    checkpoints = config.get("configurable", {}).get("checkpoints")
+    if checkpoints is not None and checkpoints.completed:
+        pending = [chunk for chunk in chunks if chunk["id"] not in checkpoints.completed]
+        if len(pending) < len(chunks): # Other shards' checkpoints don't count
+            print(f"--- Graph: Resuming, {len(chunks) - len(pending)} chunks already done. ---")
+
+    chunk_batches = plan_batches(pending, recipe_name=state.get("selected_recipe"))
+    progress = config.get("configurable", {}).get("progress")
+    if progress is not None:
+        progress.add("chunks_total", len(chunks))
+        progress.add("chunks_skipped", len(chunks) - len(pending))
+        progress.generation_started()
+    print(f"--- Graph: Re-chunked {sum(len(refs) for refs in parsed_files)} parsed chunks into {len(chunks)} chunks "
+          f"in {len(chunk_batches)} requests ---")
+
+    return {
+        "parsed_chunks": [chunk["ref"] for chunk in chunks],
+        "chunk_batches": chunk_batches,
+        "messages": [f"Re-chunked into {len(chunks)} chunks."]
+    }
+
+def _rechunk(store: ChunkStore, parsed_files: List[List[int]], recipe_name: str) -> List[Dict]:
+    """
+    Re-chunks each file's parsed chunks (refs, per file) into the store, file by file like
+    pipeline_node does; returns {"id", "ref", "tokens"} chunks.
+    """
+    texts = (text for refs in parsed_files for text in iter_chunks_for_recipe(store.iter_texts(refs), recipe_name))
+    return [
+        {"id": chunk_id, "ref": store.append(text), "tokens": estimate_tokens(text)}
+        for chunk_id, text in iter_chunk_ids(texts)
+    ]
+
+def _store_chunks(store: ChunkStore, chunks) -> List[Dict]:
+    """Moves the text of {"id", "text"} chunks (e.g. a shard's) into the store."""
+    return [
+        chunk if "ref" in chunk else {"id": chunk["id"], "ref": store.append(chunk["text"]),
+                                      "tokens": estimate_tokens(chunk["text"])}
+        for chunk in chunks
+    ]
+
+@timed_node("generation_node")
+async def generation_node(state: GraphState, config: RunnableConfig):
     recipe = state.get("selected_recipe")
-    chunk = state.get("current_chunk") 
-    
-    generated_object = await generate_data_from_chunk(chunk, recipe)
+    batch = state.get("current_batch") 
+    store = config["configurable"]["chunk_store"]
+    # With a result sink, QC runs per item right here and results go straight to disk,
+    # so nothing accumulates in graph state
+    configurable = config.get("configurable", {})
+    sink = configurable.get("sink")
+
+    rate_limited = 0
+    try:
+        generated_objects = await generate_data_from_batch([store.get(chunk["ref"]) for chunk in batch], recipe,
+                                                           model_name=state.get("model") or select_model(recipe),
+                                                           raise_on_rate_limit=sink is not None)
+    except RateLimitError:
+        # Recorded as failed and counted in stats["rate_limited"]: the worker then fails the
+        # attempt once the rest of the job has run, so a retry or resume redoes these chunks
+        generated_objects = [None] * len(batch)
+        rate_limited = len(batch)
+
+    checkpoints = configurable.get("checkpoints")
+    progress = configurable.get("progress")
+    dedup = configurable.get("dedup")
+    if progress is not None:
+        failed = sum(1 for obj in generated_objects if obj is None)
+        progress.add("chunks_failed", failed)
+        progress.add("chunks_generated", len(generated_objects) - failed)
+    if sink is not None:
+        stats = {"generated": 0, "failed": 0, "accepted": 0, "rejected": 0, "duplicates": 0,
+                 "rate_limited": rate_limited}
+        qc_rejections = {}
+        verdicts = get_validator(recipe).evaluate(generated_objects)
+        # Dedup runs on what passed QC, against everything indexed so far (this job, or all jobs
+        # sharing the index)
+        duplicates = [None] * len(batch)
+        if dedup is not None:
+            passed = [i for i, obj in enumerate(generated_objects) if obj and verdicts[i] is None]
+            found = await dedup.check_batch([generated_objects[i] for i in passed], [batch[i]["id"] for i in passed])
+            for i, duplicate in zip(passed, found):
+                duplicates[i] = duplicate
+        for chunk, obj, failed_rule, duplicate in zip(batch, generated_objects, verdicts, duplicates):
+            accepted = rejected = 0
+            result_offset = None
+            if obj and failed_rule is None and duplicate is not None:
+                sink.write_rejected(obj, reason="duplicate", duplicate_of=duplicate[0], similarity=round(duplicate[1], 3))
+                rejected = 1
+                stats["duplicates"] += 1
+                if progress is not None:
+                    progress.add("items_duplicates")
+            elif obj and failed_rule is None:
+                result_offset = sink.write(obj)
+                accepted = 1
+            elif obj:
+                sink.write_rejected(obj, rule=failed_rule)
+                rejected = 1
+                stats["rejected"] += 1
+                qc_rejections[failed_rule] = qc_rejections.get(failed_rule, 0) + 1
+                if progress is not None:
+                    progress.add_qc_rejection(failed_rule)
+            if checkpoints is not None:
+                await checkpoints.record(chunk["id"], obj is not None, accepted, rejected, result_offset)
+            stats["generated" if obj is not None else "failed"] += 1
+            stats["accepted"] += accepted
+        return {"stats": stats, "qc_rejections": qc_rejections}
     
-    # We return a list *containing* the object or an empty list
+    # We return a list *containing* the objects (possibly empty)
     # This is necessary for the aggregation step
-    return {"generated_data": [generated_object] if generated_object else []}
+    return {"generated_data": [[obj for obj in generated_objects if obj]]}
 
-async def aggregate_node(state: GraphState):
+@timed_node("aggregate_node")
+async def aggregate_node(state: GraphState, config: RunnableConfig):
+
+    # Streaming mode: everything is already on disk, only the counters are left to report
+    if config.get("configurable", {}).get("sink") is not None:
+        stats = state.get("stats") or {}
+        print(f"--- Graph: {stats.get('generated', 0)} chunks generated ({stats.get('failed', 0)} failed), "
+              f"{stats.get('accepted', 0)} items kept, {stats.get('rejected', 0)} rejected by QC "
+              f"{state.get('qc_rejections') or {}}, {stats.get('duplicates', 0)} near-duplicates dropped. ---")
+        return {"messages": [f"QC complete. {stats.get('accepted', 0)} items passed."]}
 
     # state["generated_data"] will be a list of lists, e.g., [[{}], [], [{}]]
     all_results = [
@@ -68,85 +329,189 @@ async def aggregate_node(state: GraphState):
         if item is not None # Filter out None values from failed generations
     ]
     print(f"--- Graph: Aggregated {len(all_results)} valid generated objects. ---")
-    return {"generated_data": all_results}
+    return {"generated_data": Replace(all_results)}
 
-def is_high_quality(item: dict, recipe: str) -> bool:
-    try:
-        if recipe == "qna":
-            question = item.get("question", "")
-            answer = item.get("answer", "")
-            if len(question) < 10 or len(answer) < 10:
-                return False # Too short
-            if "placeholder" in answer.lower() or "?" not in question:
-                return False # Low-quality content
-        
-        elif recipe == "code_explainer":
-            explanation = item.get("explanation", "")
-            if len(explanation) < 30: # Explanation must be substantial
-                return False
-
-        # Add more rules for other recipes...
-        
-        return True 
-    
-    except Exception as e:
-        print(f"--- QC check failed with exception: {e} ---")
-        return False 
+@timed_node("quality_control_node")
+async def quality_control_node(state: GraphState, config: RunnableConfig):
 
-async def quality_control_node(state: GraphState):
+    if config.get("configurable", {}).get("sink") is not None:
+        return {} # QC already ran per item in generation_node
 
     data_to_check = state.get("generated_data", [])
     recipe = state.get("selected_recipe")
     
     good_data = []
     bad_data = []
+    qc_rejections = {}
 
-    for item in data_to_check:
-        if is_high_quality(item, recipe):
+    for item, failed_rule in zip(data_to_check, get_validator(recipe).evaluate(data_to_check)):
+        if failed_rule is None:
             good_data.append(item)
         else:
-            bad_data.append(item)
+            # Same shape as the sink's rejected records
+            bad_data.append({"reason": "qc", "rule": failed_rule, "item": item})
+            qc_rejections[failed_rule] = qc_rejections.get(failed_rule, 0) + 1
             
-    print(f"--- Graph: QC complete. {len(good_data)} passed, {len(bad_data)} failed. ---")
+    print(f"--- Graph: QC complete. {len(good_data)} passed, {len(bad_data)} failed {qc_rejections}. ---")
     
     return {
-        "generated_data": good_data,
+        "generated_data": Replace(good_data),
         "rejected_data": bad_data,
+        "qc_rejections": qc_rejections,
         "messages": [f"QC complete. {len(good_data)} items passed."]
     }
 
-async def run_graph(files_to_process: List[Dict], recipe_name: str):
+@timed_node("dedup_node")
+async def dedup_node(state: GraphState, config: RunnableConfig):
+
+    configurable = config.get("configurable", {})
+    recipe = state.get("selected_recipe")
+    if configurable.get("sink") is not None:
+        return {} # Dedup already ran per batch in generation_node
+    if not dedup_enabled(state.get("options")) or not get_dedup_fields(recipe):
+        return {}
+
+    # Without a job index, dedup within this run only
+    index = configurable.get("dedup") or NearDuplicateIndex(recipe)
+    try:
+        items = state.get("generated_data", [])
+        found = await index.check_batch(items, [str(i) for i in range(len(items))])
+    finally:
+        if index is not configurable.get("dedup"):
+            index.close()
+
+    kept = []
+    duplicates = []
+    for item, duplicate in zip(items, found):
+        if duplicate is None:
+            kept.append(item)
+        else:
+            duplicates.append({"reason": "duplicate", "duplicate_of": duplicate[0],
+                               "similarity": round(duplicate[1], 3), "item": item})
+    print(f"--- Graph: Dedup complete. {len(kept)} kept, {len(duplicates)} near-duplicates dropped. ---")
+    return {
+        "generated_data": Replace(kept),
+        "rejected_data": duplicates,
+        "stats": {"duplicates": len(duplicates)},
+        "messages": [f"Dedup complete. {len(kept)} items kept."]
+    }
+
+def route_entry(state: GraphState):
+    return "pipeline_node" if state.get("pipelined") else "parsing_node"
+
+def fan_out_batches(state: GraphState):
+    # One generation task per chunk batch, all in the same superstep
+    batches = state.get("chunk_batches", [])
+    if not batches:
+        return ["aggregate_node"]
+    model = select_model(state["selected_recipe"], state.get("options"))
+    return [
+        Send("generation_node", {"selected_recipe": state["selected_recipe"], "model": model, "current_batch": batch})
+        for batch in batches
+    ]
 
+def build_graph():
     workflow = StateGraph(GraphState)
 
+    workflow.add_node("pipeline_node", pipeline_node)
     workflow.add_node("parsing_node", parsing_node)
+    workflow.add_node("chunking_node", chunking_node)
     workflow.add_node("generation_node", generation_node)
     workflow.add_node("aggregate_node", aggregate_node)
     workflow.add_node("quality_control_node", quality_control_node)
+    workflow.add_node("dedup_node", dedup_node)
 
-    workflow.set_entry_point("parsing_node")
-    
-    workflow.add_edge("parsing_node", "generation_node", map="parsed_chunks")
-    # 2. Run generation on all chunks in parallel
-    # 3. Aggregate all parallel results into one list
+    # 1. Parse (and, streaming from files, chunk and generate in the same pass)
+    workflow.set_conditional_entry_point(route_entry, ["pipeline_node", "parsing_node"])
+    workflow.add_edge("pipeline_node", "aggregate_node")
+    workflow.add_edge("parsing_node", "chunking_node")
+    workflow.add_conditional_edges("chunking_node", fan_out_batches, ["generation_node", "aggregate_node"])
+    # 2. Run generation on all chunk batches in parallel
+    # 3. Aggregate all parallel results into one list (or just counters when streaming)
     workflow.add_edge("generation_node", "aggregate_node")
     # 4. Run QC on the aggregated list
     workflow.add_edge("aggregate_node", "quality_control_node")
-    # 5. End
-    workflow.add_edge("quality_control_node", END)
-    
-    app = workflow.compile()
+    # 5. Drop near-duplicates of items already kept
+    workflow.add_edge("quality_control_node", "dedup_node")
+    # 6. End
+    workflow.add_edge("dedup_node", END)
     
+    return workflow.compile()
+
+# Compiled once per process; per-job objects (sink, checkpoints, progress, chunk store) travel in the config
+graph_app = build_graph()
+
+async def prepare_chunks(files_to_process: List[Dict], recipe_name: str, store: ChunkStore,
+                         options: Dict | None = None, progress=None) -> List[Dict]:
+    """
+    Runs just the parsing and chunking stages: the job's {"id", "ref", "tokens"} chunks, with
+    their text in store, in the same order and with the same ids the full pipeline would use.
+    Sharded jobs parse once with this and hand slices of the result to run_graph(chunks=...).
+    """
+    state = {"files_to_process": files_to_process, "options": options or {}}
+    parsed = await parsing_node(state, {"configurable": {"progress": progress, "chunk_store": store}})
+    return _rechunk(store, parsed["parsed_files"], recipe_name)
+
+async def run_graph(files_to_process: List[Dict], recipe_name: str, options: Dict | None = None, sink=None,
+                    checkpoints=None, progress=None, dedup=None, chunks: Iterable[Dict] | None = None,
+                    store: ChunkStore | None = None):
+    """
+    Runs the pipeline. If a sink (see src/sink.py) is given, the graph runs in streaming mode:
+    each item goes through QC and out to the sink as soon as its batch is generated, and the
+    returned state holds counters ("stats", "qc_rejections") instead of generated data. With a CheckpointRecorder
+    (src/checkpoint.py), chunks it lists as completed are skipped and new outcomes recorded.
+    A JobProgress (src/progress.py) receives live counters. A NearDuplicateIndex (src/dedup.py)
+    drops near-duplicates of items it already holds. chunks (from prepare_chunks, or {"id", "text"}
+    dicts) replaces parsing and chunking, e.g. for one shard of a sharded job. Chunk text is kept
+    in store (src/chunk_store.py), which chunks from prepare_chunks must share; without one, a
+    temporary store is used for this call.
+    """
+    own_store = store is None
+    if own_store:
+        store = ChunkStore()
+    try:
+        return await _run_graph(files_to_process, recipe_name, options, sink, checkpoints, progress, dedup,
+                                None if chunks is None else _store_chunks(store, chunks), store)
+    finally:
+        if own_store:
+            store.close()
+
+async def _run_graph(files_to_process, recipe_name, options, sink, checkpoints, progress, dedup, chunks, store):
     initial_state = {
         "files_to_process": files_to_process,
         "selected_recipe": recipe_name,
+        "options": options or {},
+        # With a sink and files to parse, generation starts while later files are still parsing
+        "pipelined": sink is not None and chunks is None,
+        "parsed_files": [],
         "parsed_chunks": [],
+        "prepared_chunks": chunks,
+        "chunk_batches": [],
         "generated_data": [],
         "rejected_data": [],
+        "stats": {},
+        "qc_rejections": {},
         "messages": []
     }
-    
-    # Asynchronously run the graph
-    final_state = await app.ainvoke(initial_state) 
-    
-    return final_state
\ No newline at end of file
+    config = {
+        "configurable": {"sink": sink, "checkpoints": checkpoints, "progress": progress, "dedup": dedup,
+                         "chunk_store": store},
+        "max_concurrency": GRAPH_MAX_CONCURRENCY,
+    }
+
+    if sink is None:
+        # Asynchronously run the graph
+        return await graph_app.ainvoke(initial_state, config=config)
+
+    # Streaming mode: consume per-node updates as they land instead of materialising full
+    # snapshots of the state; only the small bookkeeping keys are kept for the caller
+    final_state = {"selected_recipe": recipe_name, "stats": {}, "qc_rejections": {}, "messages": []}
+    async for update in graph_app.astream(initial_state, config=config, stream_mode="updates"):
+        for node_update in update.values():
+            if not node_update:
+                continue
+            for key in ("stats", "qc_rejections"):
+                if key in node_update:
+                    final_state[key] = merge_counts(final_state[key], node_update[key])
+            final_state["messages"] += node_update.get("messages", [])
+    return final_state
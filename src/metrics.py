@@ -0,0 +1,97 @@
+#Prometheus metrics for the pipeline: graph node, parser and LLM latencies plus LLM retry/failure
+#counts. Worker processes and parser children write to PROMETHEUS_MULTIPROC_DIR when it is set,
+#so the API's /metrics endpoint (and the worker's metrics port) can report across processes.
+
+import os
+import io
+import time
+import pstats
+import cProfile
+import functools
+from contextlib import contextmanager
+from prometheus_client import (
+    Counter,
+    Histogram,
+    CollectorRegistry,
+    CONTENT_TYPE_LATEST,
+    REGISTRY,
+    generate_latest,
+    multiprocess,
+)
+
+LATENCY_BUCKETS = (0.01, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 900, 3600)
+
+GRAPH_NODE_SECONDS = Histogram(
+    "foundry_graph_node_seconds", "Time spent in each LangGraph node.", ["node"], buckets=LATENCY_BUCKETS
+)
+PARSER_SECONDS = Histogram(
+    "foundry_parser_seconds", "Time spent parsing one file, by parser.", ["parser"], buckets=LATENCY_BUCKETS
+)
+LLM_REQUEST_SECONDS = Histogram(
+    "foundry_llm_request_seconds", "Latency of individual LLM API calls.", ["model"], buckets=LATENCY_BUCKETS
+)
+LLM_RETRIES = Counter("foundry_llm_retries_total", "LLM calls retried, by reason.", ["reason"])
+LLM_FAILURES = Counter("foundry_llm_failures_total", "LLM calls that gave up, by reason.", ["reason"])
+
+def timed_node(name: str):
+    """Records the latency of an async graph node. Keeps the signature visible to LangGraph."""
+    def decorator(func):
+        @functools.wraps(func)
+        async def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return await func(*args, **kwargs)
+            finally:
+                GRAPH_NODE_SECONDS.labels(node=name).observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def timed_parser(name: str):
+    def decorator(func):
+        @functools.wraps(func)
+        def wrapper(*args, **kwargs):
+            start = time.perf_counter()
+            try:
+                return func(*args, **kwargs)
+            finally:
+                PARSER_SECONDS.labels(parser=name).observe(time.perf_counter() - start)
+        return wrapper
+    return decorator
+
+def get_registry():
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        registry = CollectorRegistry()
+        multiprocess.MultiProcessCollector(registry)
+        return registry
+    return REGISTRY
+
+def render_metrics():
+    """Returns (body, content_type) in the Prometheus text exposition format."""
+    return generate_latest(get_registry()), CONTENT_TYPE_LATEST
+
+def mark_process_dead(pid: int):
+    if os.environ.get("PROMETHEUS_MULTIPROC_DIR"):
+        multiprocess.mark_process_dead(pid)
+
+@contextmanager
+def job_profiler(enabled: bool, profile_path: str):
+    """
+    Opt-in per-job cProfile run. Writes the raw stats to profile_path (load with pstats or
+    snakeviz) and a cumulative-time summary next to it as profile_path + ".txt".
+    The event loop runs every coroutine on this thread, so async work is covered too.
+    """
+    if not enabled:
+        yield
+        return
+    profiler = cProfile.Profile()
+    profiler.enable()
+    try:
+        yield
+    finally:
+        profiler.disable()
+        profiler.dump_stats(profile_path)
+        summary = io.StringIO()
+        pstats.Stats(profiler, stream=summary).sort_stats("cumulative").print_stats(50)
+        with open(profile_path + ".txt", "w") as f:
+            f.write(summary.getvalue())
+        print(f"--- Profile written to {profile_path} ---")
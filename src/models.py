@@ -1,7 +1,9 @@
-#Defines the Job model to track the state, status, and results of data processing tasks.
+#Defines the Job model to track the state, status, and results of data processing tasks,
+#the per-chunk checkpoints that let a failed job resume where it stopped, and the shards
+#large jobs are split into.
 
 
-from sqlalchemy import Column, Integer, String, DateTime, Text
+from sqlalchemy import Column, Integer, BigInteger, String, DateTime, Text, JSON, ForeignKey, UniqueConstraint
 from .database import Base
 import datetime
 
@@ -10,9 +12,48 @@ class Job(Base):
 
     id = Column(Integer, primary_key=True, index=True)
     task_id = Column(String, index=True, unique=True, nullable=False)
-    status = Column(String, default="PENDING") # PENDING, PROCESSING, COMPLETED, FAILED
+    status = Column(String, default="PENDING") # PENDING, PROCESSING, RETRYING, COMPLETED, FAILED
+    # Celery id of the task processing the job (kept across its retries); /resume checks it isn't still live
+    celery_task_id = Column(String, nullable=True)
     created_at = Column(DateTime, default=datetime.datetime.utcnow)
     result_file_path = Column(String, nullable=True)
     error_message = Column(Text, nullable=True)
     recipe = Column(String, nullable=False)
+    files = Column(JSON, nullable=True) # [{"filename", "size", "sha256"}, ...] recorded at upload
+    total_bytes = Column(BigInteger, nullable=True)
+    options = Column(JSON, nullable=True) # Per-job pipeline options, e.g. tabular column selection
+    # Byte lengths of the result/rejected files as of the last checkpoint commit; on resume the
+    # files are truncated back to these so they match the committed checkpoints exactly
+    result_offsets = Column(JSON, nullable=True)
+    progress = Column(JSON, nullable=True) # Live counters published by the worker, see src/progress.py
+
+class ChunkCheckpoint(Base):
+    __tablename__ = "chunk_checkpoints"
+    __table_args__ = (UniqueConstraint("job_id", "chunk_id"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), index=True, nullable=False)
+    chunk_id = Column(String, nullable=False) # sha256 of the chunk text + occurrence number
+    status = Column(String, nullable=False) # DONE, FAILED
+    accepted = Column(Integer, default=0) # Items written to the result file
+    rejected = Column(Integer, default=0) # Items written to the rejected sidecar
+    result_offset = Column(BigInteger, nullable=True) # Byte offset of the chunk's first result line (a shard's file until the merge)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
 
+class JobShard(Base):
+    """One slice of a sharded job's chunks, processed by its own Celery task (see src/sharding.py)."""
+    __tablename__ = "job_shards"
+    __table_args__ = (UniqueConstraint("job_id", "shard_index"),)
+
+    id = Column(Integer, primary_key=True, index=True)
+    job_id = Column(Integer, ForeignKey("jobs.id"), index=True, nullable=False)
+    shard_index = Column(Integer, nullable=False) # Results are merged in this order
+    status = Column(String, default="PENDING") # PENDING, PROCESSING, COMPLETED, FAILED
+    chunk_count = Column(Integer, nullable=False)
+    chunks_path = Column(String, nullable=False) # JSONL of {"id", "text"} chunks
+    result_file_path = Column(String, nullable=False)
+    result_offsets = Column(JSON, nullable=True) # Like Job.result_offsets, for the shard's own files
+    stats = Column(JSON, nullable=True) # Final counters: generated/failed/accepted/rejected/duplicates, qc_rejections
+    progress = Column(JSON, nullable=True) # The shard's live counters; summed into Job.progress
+    error_message = Column(Text, nullable=True)
+    updated_at = Column(DateTime, default=datetime.datetime.utcnow, onupdate=datetime.datetime.utcnow)
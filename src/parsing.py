@@ -0,0 +1,234 @@
+#Runs the file parsers from utils.py off the event loop: each file is parsed in its own child
+#process (bounded by PARSE_WORKERS), so parsing uses every core and a pathological file can be
+#killed on timeout without taking the job down with it. Chunks come back over a pipe in
+#batches (tabular files a block of rows at a time), so a large file is never held whole.
+
+import os
+import time
+import asyncio
+import multiprocessing
+from typing import List, Dict, AsyncIterator, Iterable, Iterator, Tuple
+
+from .code_chunking import CODE_EXTENSIONS, language_for, get_code_chunk_cache, load_grammars
+
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", os.cpu_count() or 2))
+PARSE_TIMEOUT_SECONDS = float(os.environ.get("PARSE_TIMEOUT_SECONDS", 300))
+# Small code/text files parse in milliseconds; a process per file would cost more than the parse
+PARSE_INLINE_MAX_BYTES = int(os.environ.get("PARSE_INLINE_MAX_BYTES", 32 * 1024))
+
+UNSTRUCTURED_EXTENSIONS = ('.pdf', '.docx', '.txt', '.md')
+TABULAR_EXTENSIONS = ('.csv', '.xlsx', '.xls')
+# Always parsed in a child process, whatever their size
+ISOLATED_EXTENSIONS = ('.pdf', '.docx') + TABULAR_EXTENSIONS
+
+def parse_file(filename: str, content, options: Dict | None = None) -> List[str]:
+    """Picks the parser for a file by extension. content is raw bytes or a path on disk."""
+    # The parser stack (unstructured, pandas) is imported on first use, not by importing this
+    # module, so processes that only need the extension lists (e.g. the API) stay light
+    from .utils import parse_unstructured_file, parse_code_file, parse_tabular_file
+    options = options or {}
+    lowered = filename.lower()
+    if lowered.endswith(UNSTRUCTURED_EXTENSIONS):
+        return parse_unstructured_file(content, filename)
+    elif lowered.endswith(CODE_EXTENSIONS):
+        return parse_code_file(content, filename)
+    elif lowered.endswith(TABULAR_EXTENSIONS):
+        return parse_tabular_file(
+            content, filename,
+            columns=options.get("columns"),
+            sample_fraction=options.get("sample_fraction"),
+            max_rows=options.get("max_rows"),
+        )
+    print(f"--- Skipping unsupported file type: {filename} ---")
+    return []
+
+def iter_parse_file(filename: str, content, options: Dict | None = None) -> Iterator[List[str]]:
+    """parse_file in batches: tabular files a block of rows at a time, other files all at once."""
+    if not filename.lower().endswith(TABULAR_EXTENSIONS):
+        yield parse_file(filename, content, options)
+        return
+    from .utils import iter_tabular_batches
+    options = options or {}
+    yield from iter_tabular_batches(
+        content, filename,
+        columns=options.get("columns"),
+        sample_fraction=options.get("sample_fraction"),
+        max_rows=options.get("max_rows"),
+    )
+
+def is_supported_file(filename: str) -> bool:
+    return filename.lower().endswith(UNSTRUCTURED_EXTENSIONS + CODE_EXTENSIONS + TABULAR_EXTENSIONS)
+
+def _parse_in_child(conn, filename: str, content, options: Dict | None):
+    # send() blocks while the pipe is full, so the child never runs more than a batch ahead
+    try:
+        for batch in iter_parse_file(filename, content, options):
+            conn.send(("chunks", batch))
+        conn.send(("done", None))
+    except BaseException as e:
+        conn.send(("error", f"{type(e).__name__}: {e}"))
+    finally:
+        conn.close()
+
+_mp_context = None
+
+def _get_mp_context():
+    # forkserver: children start from a clean, single-threaded server that already imported
+    # the parser stack, instead of forking a process full of threads and event loop state
+    global _mp_context
+    if _mp_context is None:
+        if "forkserver" in multiprocessing.get_all_start_methods():
+            _mp_context = multiprocessing.get_context("forkserver")
+            _mp_context.set_forkserver_preload(["src.utils"])
+        else:
+            _mp_context = multiprocessing.get_context("spawn")
+    return _mp_context
+
+def warm_parsers():
+    """
+    Starts the parser process server (which imports the parser stack once) and loads the code
+    grammars now, so a long-lived worker's first job doesn't pay for them.
+    """
+    ctx = _get_mp_context()
+    if ctx.get_start_method() == "forkserver":
+        from multiprocessing import forkserver
+        forkserver.ensure_running()
+    load_grammars()
+
+def _receive(conn, process, deadline: float, timeout: float):
+    if not conn.poll(max(0.0, deadline - time.monotonic())):
+        raise TimeoutError(f"parsing took longer than {timeout:.0f}s")
+    try:
+        return conn.recv()
+    except EOFError:
+        process.join()
+        raise RuntimeError(f"parser process died (exit code {process.exitcode})")
+
+def _stop(conn, process):
+    conn.close()
+    if process.is_alive():
+        process.kill()
+    process.join()
+
+async def _iter_isolated(filename: str, content, options: Dict | None, timeout: float) -> AsyncIterator[List[str]]:
+    ctx = _get_mp_context()
+    parent_conn, child_conn = ctx.Pipe(duplex=False)
+    process = ctx.Process(target=_parse_in_child, args=(child_conn, filename, content, options), daemon=True)
+    try:
+        await asyncio.to_thread(process.start)
+    except BaseException:
+        parent_conn.close()
+        raise
+    finally:
+        child_conn.close()
+    deadline = time.monotonic() + timeout # For the whole file, not per batch
+    try:
+        while True:
+            status, payload = await asyncio.to_thread(_receive, parent_conn, process, deadline, timeout)
+            if status == "done":
+                return
+            if status != "chunks":
+                raise RuntimeError(payload)
+            yield payload
+    finally:
+        await asyncio.to_thread(_stop, parent_conn, process)
+
+def _content_size(content) -> int:
+    return len(content) if isinstance(content, (bytes, bytearray, memoryview)) else os.path.getsize(content)
+
+async def parse_file_async(filename: str, content, options: Dict | None = None,
+                           timeout: float = PARSE_TIMEOUT_SECONDS) -> List[str]:
+    """
+    Parses one file without blocking the event loop. Returns [] if the parser fails, crashes
+    or times out, like the parsers themselves do on bad input (a tabular file keeps the rows
+    streamed before the failure).
+    """
+    return [chunk async for batch in iter_parse_file_async(filename, content, options, timeout) for chunk in batch]
+
+async def iter_parse_file_async(filename: str, content, options: Dict | None = None,
+                                timeout: float = PARSE_TIMEOUT_SECONDS) -> AsyncIterator[List[str]]:
+    """parse_file_async in batches, as the parser produces them."""
+    if not is_supported_file(filename):
+        yield parse_file(filename, content, options)
+        return
+    # Code chunks depend only on the file's bytes, so identical files (re-uploads, vendored
+    # copies) are looked up here, in the parent, whichever process would have parsed them
+    cache_key = None
+    if filename.lower().endswith(CODE_EXTENSIONS) and isinstance(content, (bytes, bytearray, memoryview)):
+        cache_key = get_code_chunk_cache().key(content, language_for(filename))
+        cached = get_code_chunk_cache().get(cache_key)
+        if cached is not None:
+            yield cached
+            return
+    async for batch in _iter_parse_file_async(filename, content, options, timeout):
+        if cache_key is not None and batch: # Code files come in a single batch
+            get_code_chunk_cache().set(cache_key, batch)
+        yield batch
+
+async def _iter_parse_file_async(filename: str, content, options: Dict | None, timeout: float) -> AsyncIterator[List[str]]:
+    inline = (
+        not filename.lower().endswith(ISOLATED_EXTENSIONS)
+        and _content_size(content) <= PARSE_INLINE_MAX_BYTES
+    )
+    try:
+        if inline:
+            yield await asyncio.to_thread(parse_file, filename, content, options)
+            return
+        try:
+            async for batch in _iter_isolated(filename, content, options, timeout):
+                yield batch
+        except AssertionError:
+            # Daemonic pool workers may not spawn children; parse in a thread instead. A thread
+            # can't be killed, so on timeout the file is given up on and the thread left to finish.
+            yield await asyncio.wait_for(asyncio.to_thread(parse_file, filename, content, options), timeout)
+    except asyncio.TimeoutError:
+        print(f"!!! Parsing {filename} failed: parsing took longer than {timeout:.0f}s !!!")
+    except Exception as e:
+        print(f"!!! Parsing {filename} failed: {e} !!!")
+
+async def iter_parsed_files(files: Iterable[Dict], options: Dict | None = None,
+                            max_workers: int = PARSE_WORKERS, store=None) -> AsyncIterator[Tuple[str, List]]:
+    """
+    Parses files concurrently (at most max_workers at a time) and yields (filename, chunks)
+    as each file finishes, so callers can start on early files while others still parse.
+    files can be any iterable, e.g. a lazily extracted archive: it's only advanced when a
+    parse slot frees up, so at most max_workers files are held in memory at once. With a
+    ChunkStore (src/chunk_store.py), each batch of chunks goes into it as it arrives and the
+    yielded chunks are refs into it, so a large tabular file is never in memory whole.
+    """
+    semaphore = asyncio.Semaphore(max(1, max_workers))
+    results = asyncio.Queue()
+    iterator = iter(files)
+    tasks = set()
+
+    async def _parse(file_info):
+        try:
+            chunks = []
+            async for batch in iter_parse_file_async(file_info["filename"], file_info["content"], options):
+                chunks.extend(batch if store is None else store.extend(batch))
+            await results.put((file_info["filename"], chunks))
+        finally:
+            semaphore.release()
+
+    async def _feed():
+        try:
+            while True:
+                await semaphore.acquire()
+                # Pulling the next file may read or decompress it; keep that off the loop
+                file_info = await asyncio.to_thread(next, iterator, None)
+                if file_info is None:
+                    break
+                tasks.add(asyncio.create_task(_parse(file_info)))
+            await asyncio.gather(*tasks)
+        finally:
+            await results.put(None)
+
+    feeder = asyncio.create_task(_feed())
+    try:
+        while (result := await results.get()) is not None:
+            yield result
+        await feeder # Surfaces errors raised while reading the files
+    finally:
+        feeder.cancel()
+        for task in tasks:
+            task.cancel()
@@ -0,0 +1,142 @@
+#Live per-job counters (files parsed, chunks generated/failed/rejected, throughput, ETA).
+#Nodes bump plain in-memory counters; a background ticker writes a snapshot to Job.progress
+#every PROGRESS_FLUSH_INTERVAL_SECONDS, so the status endpoint stays cheap to serve, and
+#publishes it as a job event for streaming clients (see events.py). Shards of a sharded job
+#each keep their own counters; every flush sums them into the job's snapshot.
+
+import os
+import time
+import asyncio
+from sqlalchemy import select, update
+from .models import Job, JobShard
+from .generation import TIMING_STATS
+from .events import publish_job_event, progress_event
+
+PROGRESS_FLUSH_INTERVAL_SECONDS = float(os.environ.get("PROGRESS_FLUSH_INTERVAL_SECONDS", 2.0))
+
+# Set once by the job's coordinator (parsing happens there, before any shard runs)
+_JOB_LEVEL_COUNTERS = ("files_total", "files_parsed", "chunks_total")
+_SHARD_COUNTERS = ("chunks_skipped", "chunks_generated", "chunks_failed", "items_qc_rejected", "items_duplicates",
+                   "retries", "tokens")
+
+def merge_progress(job_snapshot: dict | None, shards: list) -> dict:
+    """
+    The job-wide snapshot of a sharded job. shards is [(status, snapshot or None), ...];
+    counters are summed over shards, the job-level ones come from the coordinator's snapshot.
+    """
+    job_snapshot = job_snapshot or {}
+    merged = {key: job_snapshot.get(key, 0) for key in _JOB_LEVEL_COUNTERS}
+    merged["qc_rejections"] = {}
+    merged["shards_total"] = len(shards)
+    merged["shards_completed"] = sum(1 for status, _ in shards if status == "COMPLETED")
+    for key in _SHARD_COUNTERS + ("chunks_per_second", "tokens_per_second"):
+        merged[key] = 0
+    merged["elapsed_seconds"] = job_snapshot.get("elapsed_seconds", 0)
+    for status, snapshot in shards:
+        if not snapshot:
+            continue
+        for key in _SHARD_COUNTERS:
+            merged[key] += snapshot.get(key, 0)
+        merged["elapsed_seconds"] = max(merged["elapsed_seconds"], snapshot.get("elapsed_seconds", 0))
+        if status == "PROCESSING": # Finished shards no longer contribute to throughput
+            merged["chunks_per_second"] += snapshot.get("chunks_per_second", 0)
+            merged["tokens_per_second"] += snapshot.get("tokens_per_second", 0)
+        for rule, count in (snapshot.get("qc_rejections") or {}).items():
+            merged["qc_rejections"][rule] = merged["qc_rejections"].get(rule, 0) + count
+    merged["chunks_per_second"] = round(merged["chunks_per_second"], 3)
+    merged["tokens_per_second"] = round(merged["tokens_per_second"], 1)
+    remaining = merged["chunks_total"] - merged["chunks_skipped"] - merged["chunks_generated"] - merged["chunks_failed"]
+    cps = merged["chunks_per_second"]
+    merged["eta_seconds"] = round(remaining / cps) if cps > 0 and remaining > 0 else None
+    merged["updated_at"] = time.time()
+    return merged
+
+class JobProgress:
+
+    def __init__(self, session_factory, job_id: int, files_total: int = 0, task_id: str | None = None,
+                 shard_id: int | None = None):
+        self.session_factory = session_factory
+        self.job_id = job_id
+        self.task_id = task_id # Events are published per task_id; None skips publishing
+        self.shard_id = shard_id # Set for a shard of a sharded job
+        self.counters = {
+            "files_total": files_total,
+            "files_parsed": 0,
+            "chunks_total": 0,
+            "chunks_skipped": 0, # Already done in an earlier attempt
+            "chunks_generated": 0,
+            "chunks_failed": 0,
+            "items_qc_rejected": 0,
+            "items_duplicates": 0,
+        }
+        self.qc_rejections = {} # Rejected items per QC rule
+        self.started_at = time.time()
+        self._generation_started = None
+        # LLM counters are process-wide; report this job's share as a delta
+        self._llm_baseline = {key: TIMING_STATS[key] for key in ("rate_limit_retries", "tokens")}
+        self._ticker = None
+
+    def add(self, counter: str, amount: int = 1):
+        self.counters[counter] += amount
+
+    def add_qc_rejection(self, rule: str):
+        self.counters["items_qc_rejected"] += 1
+        self.qc_rejections[rule] = self.qc_rejections.get(rule, 0) + 1
+
+    def generation_started(self):
+        if self._generation_started is None:
+            self._generation_started = time.time()
+
+    def snapshot(self) -> dict:
+        now = time.time()
+        snapshot = dict(self.counters)
+        snapshot["qc_rejections"] = dict(self.qc_rejections)
+        snapshot["retries"] = TIMING_STATS["rate_limit_retries"] - self._llm_baseline["rate_limit_retries"]
+        snapshot["tokens"] = TIMING_STATS["tokens"] - self._llm_baseline["tokens"]
+        snapshot["elapsed_seconds"] = round(now - self.started_at, 1)
+
+        processed = snapshot["chunks_generated"] + snapshot["chunks_failed"]
+        generation_seconds = now - self._generation_started if self._generation_started else 0
+        chunks_per_second = processed / generation_seconds if generation_seconds > 0 else 0.0
+        snapshot["chunks_per_second"] = round(chunks_per_second, 3)
+        snapshot["tokens_per_second"] = round(snapshot["tokens"] / generation_seconds, 1) if generation_seconds > 0 else 0.0
+        remaining = snapshot["chunks_total"] - snapshot["chunks_skipped"] - processed
+        snapshot["eta_seconds"] = round(remaining / chunks_per_second) if chunks_per_second > 0 and remaining > 0 else None
+        snapshot["updated_at"] = now
+        return snapshot
+
+    async def flush(self):
+        snapshot = self.snapshot()
+        try:
+            async with self.session_factory() as session:
+                if self.shard_id is not None:
+                    await session.execute(update(JobShard).where(JobShard.id == self.shard_id).values(progress=snapshot))
+                    shards = (await session.execute(
+                        select(JobShard.status, JobShard.progress).where(JobShard.job_id == self.job_id)
+                    )).all()
+                    job_snapshot = (await session.execute(select(Job.progress).where(Job.id == self.job_id))).scalar()
+                    snapshot = merge_progress(job_snapshot, [tuple(row) for row in shards])
+                await session.execute(update(Job).where(Job.id == self.job_id).values(progress=snapshot))
+                await session.commit()
+        except Exception as e:
+            # Progress is best-effort; never fail the job over it
+            print(f"!!! Progress update for job {self.job_id} failed: {e} !!!")
+        if self.task_id:
+            await publish_job_event(progress_event(self.task_id, snapshot))
+
+    async def _tick(self):
+        while True:
+            await asyncio.sleep(PROGRESS_FLUSH_INTERVAL_SECONDS)
+            await self.flush()
+
+    async def __aenter__(self):
+        self._ticker = asyncio.create_task(self._tick())
+        return self
+
+    async def __aexit__(self, *exc):
+        self._ticker.cancel()
+        try:
+            await self._ticker
+        except asyncio.CancelledError:
+            pass
+        await self.flush()
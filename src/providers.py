@@ -0,0 +1,209 @@
+#LLM provider layer. generation.py builds prompts and handles retries/caching; providers own the
+#transport: Gemini through google.generativeai, and any OpenAI-compatible server (vLLM, TGI,
+#llama.cpp, ...) over a pooled keep-alive httpx client. Models are named "provider:model";
+#a bare name uses LLM_PROVIDER.
+
+import os
+import weakref
+import asyncio
+import importlib.util
+from contextlib import asynccontextmanager
+
+LLM_PROVIDER = os.environ.get("LLM_PROVIDER", "gemini")
+GEMINI_MAX_CONCURRENCY = int(os.environ.get("GEMINI_MAX_CONCURRENCY", 64))
+
+OPENAI_BASE_URL = os.environ.get("OPENAI_BASE_URL", "http://localhost:8000/v1")
+OPENAI_API_KEY = os.environ.get("OPENAI_API_KEY", "")
+OPENAI_MAX_CONCURRENCY = int(os.environ.get("OPENAI_MAX_CONCURRENCY", 128))
+OPENAI_MAX_CONNECTIONS = int(os.environ.get("OPENAI_MAX_CONNECTIONS", 128))
+OPENAI_TIMEOUT_SECONDS = float(os.environ.get("OPENAI_TIMEOUT_SECONDS", 120))
+OPENAI_HTTP2 = os.environ.get("OPENAI_HTTP2", "1") == "1"
+# Self-hosted servers have no RPM/TPM quota; opt in to the shared AIMD limiter if yours does
+OPENAI_SHARED_QUOTA = os.environ.get("OPENAI_SHARED_QUOTA", "0") == "1"
+
+class RateLimitError(Exception):
+    """Raised by providers when the backend asks us to slow down (quota or overload)."""
+
+class LLMResponse:
+
+    def __init__(self, text: str, total_tokens: int | None = None):
+        self.text = text
+        self.total_tokens = total_tokens
+
+class LLMProvider:
+    """
+    Base provider. create_model() returns a handle bound to a model and system prompt (built
+    once per recipe/model); generate() sends one user prompt and returns an LLMResponse.
+    slot() caps in-flight calls to this provider within the process.
+    """
+    name = "base"
+    # Whether calls draw from the shared RPM/TPM limiter in rate_limiter.py
+    shared_quota = True
+
+    def __init__(self, max_concurrency: int):
+        self.max_concurrency = max_concurrency
+        # asyncio primitives are bound to the loop they first run on, so keep one per loop
+        self._semaphores = weakref.WeakKeyDictionary()
+
+    @asynccontextmanager
+    async def slot(self):
+        loop = asyncio.get_running_loop()
+        semaphore = self._semaphores.get(loop)
+        if semaphore is None:
+            semaphore = asyncio.Semaphore(self.max_concurrency)
+            self._semaphores[loop] = semaphore
+        async with semaphore:
+            yield
+
+    def create_model(self, model_name: str, system_prompt: str):
+        raise NotImplementedError
+
+    async def generate(self, model, user_prompt: str) -> LLMResponse:
+        raise NotImplementedError
+
+    async def warm(self):
+        """Sets up clients ahead of the first call, on the running loop."""
+        pass
+
+    async def aclose(self):
+        pass
+
+class GeminiProvider(LLMProvider):
+    name = "gemini"
+
+    def __init__(self, api_key: str | None = None, max_concurrency: int = GEMINI_MAX_CONCURRENCY):
+        super().__init__(max_concurrency)
+        self.api_key = api_key
+        self._configured = False
+        self._generation_config = None
+
+    def _configure(self):
+        # Configured once per process, on first use, so importing the pipeline doesn't need a key;
+        # every GenerativeModel shares the client/transport genai.configure creates
+        import google.generativeai as genai
+        if not self._configured:
+            genai.configure(api_key = self.api_key or os.environ["GEMINI_API_KEY"])
+            self._generation_config = genai.types.GenerationConfig(response_mime_type="application/json")
+            self._configured = True
+        return genai
+
+    async def warm(self):
+        if self.api_key or os.environ.get("GEMINI_API_KEY"):
+            self._configure()
+
+    def create_model(self, model_name: str, system_prompt: str):
+        genai = self._configure()
+        return genai.GenerativeModel(model_name=model_name, system_instruction=system_prompt)
+
+    async def generate(self, model, user_prompt: str) -> LLMResponse:
+        from google.api_core.exceptions import ResourceExhausted
+        try:
+            response = await model.generate_content_async(user_prompt, generation_config=self._generation_config)
+        except ResourceExhausted as e:
+            raise RateLimitError(str(e)) from e
+        usage = getattr(response, "usage_metadata", None)
+        return LLMResponse(response.text, getattr(usage, "total_token_count", None) or None)
+
+class OpenAIModel:
+    """Model name plus the system message, which is sent with every request."""
+
+    def __init__(self, model_name: str, system_prompt: str):
+        self.model_name = model_name
+        self.system_message = {"role": "system", "content": system_prompt}
+
+class OpenAICompatibleProvider(LLMProvider):
+    name = "openai"
+
+    def __init__(self, base_url: str = OPENAI_BASE_URL, api_key: str = OPENAI_API_KEY,
+                 max_concurrency: int = OPENAI_MAX_CONCURRENCY, max_connections: int = OPENAI_MAX_CONNECTIONS,
+                 timeout: float = OPENAI_TIMEOUT_SECONDS, http2: bool = OPENAI_HTTP2,
+                 shared_quota: bool = OPENAI_SHARED_QUOTA):
+        super().__init__(max_concurrency)
+        self.base_url = base_url.rstrip("/")
+        self.api_key = api_key
+        self.max_connections = max_connections
+        self.timeout = timeout
+        # HTTP/2 needs the optional h2 package (pip install httpx[http2]) and a TLS endpoint
+        self.http2 = http2 and importlib.util.find_spec("h2") is not None
+        self.shared_quota = shared_quota
+        self._clients = weakref.WeakKeyDictionary()
+
+    def _client(self):
+        # One pooled client per event loop: connections are reused across every call in the job
+        import httpx
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None:
+            headers = {"Authorization": f"Bearer {self.api_key}"} if self.api_key else {}
+            client = httpx.AsyncClient(
+                base_url=self.base_url,
+                headers=headers,
+                http2=self.http2,
+                timeout=self.timeout,
+                limits=httpx.Limits(max_connections=self.max_connections,
+                                    max_keepalive_connections=self.max_connections),
+            )
+            self._clients[loop] = client
+        return client
+
+    async def warm(self):
+        self._client()
+
+    def create_model(self, model_name: str, system_prompt: str):
+        return OpenAIModel(model_name, system_prompt)
+
+    async def generate(self, model: OpenAIModel, user_prompt: str) -> LLMResponse:
+        response = await self._client().post("/chat/completions", json={
+            "model": model.model_name,
+            "messages": [model.system_message, {"role": "user", "content": user_prompt}],
+            "response_format": {"type": "json_object"},
+        })
+        if response.status_code in (429, 503):
+            raise RateLimitError(f"HTTP {response.status_code}: {response.text[:200]}")
+        response.raise_for_status()
+        body = response.json()
+        usage = body.get("usage") or {}
+        return LLMResponse(body["choices"][0]["message"]["content"], usage.get("total_tokens"))
+
+    async def aclose(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+
+PROVIDER_FACTORIES = {
+    "gemini": GeminiProvider,
+    "openai": OpenAICompatibleProvider,
+}
+
+_providers: dict = {}
+
+def parse_model_spec(spec: str) -> tuple:
+    """"openai:llama-3-8b" -> ("openai", "llama-3-8b"); a bare name uses LLM_PROVIDER."""
+    provider_name, sep, model_name = spec.partition(":")
+    if not sep:
+        return LLM_PROVIDER, spec
+    if provider_name not in PROVIDER_FACTORIES and provider_name not in _providers:
+        raise ValueError(f"Unknown LLM provider: {provider_name}")
+    return provider_name, model_name
+
+def get_provider(name: str) -> LLMProvider:
+    provider = _providers.get(name)
+    if provider is None:
+        if name not in PROVIDER_FACTORIES:
+            raise ValueError(f"Unknown LLM provider: {name}")
+        provider = PROVIDER_FACTORIES[name]()
+        _providers[name] = provider
+    return provider
+
+def register_provider(name: str, provider: LLMProvider):
+    """Installs a provider instance under name, e.g. a fake backend for benchmarks. Call before the first LLM call."""
+    _providers[name] = provider
+
+async def close_providers():
+    """Closes the current event loop's connection pools. Call before the loop shuts down."""
+    for provider in list(_providers.values()):
+        try:
+            await provider.aclose()
+        except Exception as e:
+            print(f"!!! Closing LLM provider {provider.name} failed: {e} !!!")
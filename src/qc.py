@@ -0,0 +1,107 @@
+#Quality control for generated items. Each recipe declares its rules under "qc" in RECIPE_SCHEMAS;
+#they are compiled once per recipe, together with the recipe's JSON schema, into a flat list of
+#checks. Items are evaluated in batches and every rejection is attributed to the first rule it
+#failed, so jobs can report a per-rule breakdown.
+#
+#Per-field rules: min_length / max_length (strings), min_items / max_items (arrays),
+#pattern (regex that must match somewhere), banned_phrases (case-insensitive substrings).
+#min_length counts characters after stripping surrounding whitespace, so padding can't pass
+#it; max_length counts the string as generated.
+
+import re
+from typing import List
+from .schemas import RECIPE_SCHEMAS, get_schema_for_recipe
+
+_JSON_TYPES = {
+    "string": (str,),
+    "integer": (int,),
+    "number": (int, float),
+    "boolean": (bool,),
+    "array": (list,),
+    "object": (dict,),
+}
+
+def _type_check(json_type: str):
+    types = _JSON_TYPES[json_type]
+    if json_type in ("integer", "number"):
+        # bool is an int subclass but not a JSON number
+        return lambda value: isinstance(value, types) and not isinstance(value, bool)
+    return lambda value: isinstance(value, types)
+
+def _field_check(field: str, check, optional: bool = True):
+    """Wraps a value check into an item check; a missing optional field passes."""
+    def item_check(item: dict) -> bool:
+        value = item.get(field)
+        if value is None:
+            return optional
+        return check(value)
+    return item_check
+
+def _compile_schema(schema: dict) -> list:
+    checks = []
+    required = set(schema.get("required", []))
+    for field in schema.get("required", []):
+        checks.append((f"{field}:required", lambda item, field=field: item.get(field) is not None))
+    for field, spec in schema.get("properties", {}).items():
+        if "type" in spec:
+            checks.append((f"{field}:type", _field_check(field, _type_check(spec["type"]))))
+        item_type = spec.get("items", {}).get("type")
+        if spec.get("type") == "array" and item_type:
+            is_item_type = _type_check(item_type)
+            checks.append((f"{field}:items", _field_check(field, lambda value, t=is_item_type: all(t(v) for v in value))))
+    return checks
+
+def _compile_rules(rules: dict) -> list:
+    checks = []
+    for field, spec in rules.items():
+        if "min_length" in spec:
+            checks.append((f"{field}:min_length", _field_check(field, lambda v, n=spec["min_length"]: len(v.strip()) >= n)))
+        if "max_length" in spec:
+            checks.append((f"{field}:max_length", _field_check(field, lambda v, n=spec["max_length"]: len(v) <= n)))
+        if "min_items" in spec:
+            checks.append((f"{field}:min_items", _field_check(field, lambda v, n=spec["min_items"]: len(v) >= n)))
+        if "max_items" in spec:
+            checks.append((f"{field}:max_items", _field_check(field, lambda v, n=spec["max_items"]: len(v) <= n)))
+        if "pattern" in spec:
+            search = re.compile(spec["pattern"]).search
+            checks.append((f"{field}:pattern", _field_check(field, lambda v, s=search: s(v) is not None)))
+        if spec.get("banned_phrases"):
+            # One alternation instead of a scan per phrase
+            banned = re.compile("|".join(re.escape(p) for p in spec["banned_phrases"]), re.IGNORECASE).search
+            checks.append((f"{field}:banned_phrases", _field_check(field, lambda v, s=banned: s(v) is None)))
+    return checks
+
+class RecipeValidator:
+    """Compiled schema + rule checks for one recipe. Type checks run before the rules that rely on them."""
+
+    def __init__(self, recipe_name: str):
+        self.recipe_name = recipe_name
+        self.checks = _compile_schema(get_schema_for_recipe(recipe_name))
+        self.checks += _compile_rules(RECIPE_SCHEMAS[recipe_name].get("qc", {}))
+        self.rule_names = [name for name, _ in self.checks]
+
+    def check(self, item) -> str | None:
+        """Returns the name of the first rule the item fails, or None if it passes."""
+        if not isinstance(item, dict):
+            return "item:type"
+        for name, check in self.checks:
+            try:
+                if not check(item):
+                    return name
+            except Exception:
+                return name # e.g. a wrongly typed optional field
+        return None
+
+    def evaluate(self, items: List[dict]) -> List[str | None]:
+        """check() over a batch of items, in order."""
+        check = self.check
+        return [check(item) for item in items]
+
+_validators: dict = {}
+
+def get_validator(recipe_name: str) -> RecipeValidator:
+    validator = _validators.get(recipe_name)
+    if validator is None:
+        validator = RecipeValidator(recipe_name)
+        _validators[recipe_name] = validator
+    return validator
@@ -0,0 +1,294 @@
+#Shared requests-per-minute / tokens-per-minute limiter with AIMD concurrency control for LLM calls.
+#State lives in Redis so every Celery worker process draws from the same quota; if Redis is
+#unreachable the limiter falls back to in-process state.
+
+import os
+import time
+import uuid
+import random
+import asyncio
+import weakref
+from contextlib import asynccontextmanager
+
+LLM_RPM = int(os.environ.get("LLM_RPM", 1000))
+LLM_TPM = int(os.environ.get("LLM_TPM", 1_000_000))
+LLM_MIN_CONCURRENCY = int(os.environ.get("LLM_MIN_CONCURRENCY", 1))
+LLM_MAX_CONCURRENCY = int(os.environ.get("LLM_MAX_CONCURRENCY", 64))
+LLM_INITIAL_CONCURRENCY = int(os.environ.get("LLM_INITIAL_CONCURRENCY", 8))
+RATE_LIMIT_REDIS_URL = os.environ.get("RATE_LIMIT_REDIS_URL", os.environ.get("REDIS_URL", "redis://localhost:6379/0"))
+RATE_LIMIT_KEY_PREFIX = "foundry:ratelimit"
+# After a Redis error, use in-process limits for this long before trying Redis again
+RATE_LIMIT_REDIS_RETRY_SECONDS = float(os.environ.get("RATE_LIMIT_REDIS_RETRY_SECONDS", 30))
+
+# AIMD tuning: each success adds ~1 slot per "limit" successes, each 429 multiplies the limit by
+# DECREASE_FACTOR and pauses new calls for COOLDOWN_SECONDS.
+INCREASE_STEP = 1.0
+DECREASE_FACTOR = 0.5
+COOLDOWN_SECONDS = float(os.environ.get("LLM_RATE_LIMIT_COOLDOWN_SECONDS", 2.0))
+LEASE_TTL_SECONDS = 300 # In-flight slots held by a crashed process expire after this
+POLL_INTERVAL_SECONDS = 0.05
+WINDOW_SECONDS = 60
+
+def _now_ms() -> int:
+    return int(time.time() * 1000)
+
+class LocalBackend:
+    """
+    In-process limiter state. Only plain numbers are stored, so one instance can be shared by
+    every event loop in the process.
+    """
+
+    def __init__(self, rpm: int, tpm: int, min_limit: int, max_limit: int, initial_limit: int):
+        self.rpm = rpm
+        self.tpm = tpm
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.limit = float(initial_limit)
+        self.in_flight = set()
+        self.cooldown_until = 0
+        self.window = None
+        self.window_requests = 0
+        self.window_tokens = 0
+
+    def _roll_window(self, now: int):
+        window = now // (WINDOW_SECONDS * 1000)
+        if window != self.window:
+            self.window = window
+            self.window_requests = 0
+            self.window_tokens = 0
+
+    async def try_acquire(self, lease_id: str, tokens: int) -> int:
+        """Returns 0 if a slot was taken, -1 if concurrency is saturated, else ms to wait."""
+        now = _now_ms()
+        if self.cooldown_until > now:
+            return self.cooldown_until - now
+        if len(self.in_flight) >= int(self.limit):
+            return -1
+        self._roll_window(now)
+        over_tokens = self.window_tokens > 0 and self.window_tokens + tokens > self.tpm
+        if self.window_requests + 1 > self.rpm or over_tokens:
+            return WINDOW_SECONDS * 1000 - now % (WINDOW_SECONDS * 1000)
+        self.window_requests += 1
+        self.window_tokens += tokens
+        self.in_flight.add(lease_id)
+        return 0
+
+    async def release(self, lease_id: str):
+        self.in_flight.discard(lease_id)
+
+    async def adjust_tokens(self, delta: int):
+        self._roll_window(_now_ms())
+        self.window_tokens = max(0, self.window_tokens + delta)
+
+    async def on_success(self):
+        self.limit = min(self.max_limit, self.limit + INCREASE_STEP / self.limit)
+
+    async def on_rate_limited(self):
+        now = _now_ms()
+        # Only back off once per cooldown; a burst of 429s from the same overload is one signal
+        if self.cooldown_until > now:
+            return
+        self.limit = max(self.min_limit, self.limit * DECREASE_FACTOR)
+        self.cooldown_until = now + int(COOLDOWN_SECONDS * 1000)
+
+    async def current_limit(self) -> float:
+        return self.limit
+
+_ACQUIRE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local cooldown = tonumber(redis.call('GET', KEYS[3]) or '0')
+if cooldown > now then return cooldown - now end
+redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', now)
+local limit = tonumber(redis.call('GET', KEYS[2]) or ARGV[7])
+if redis.call('ZCARD', KEYS[1]) >= math.floor(limit) then return -1 end
+local reqs = tonumber(redis.call('GET', KEYS[4]) or '0')
+local toks = tonumber(redis.call('GET', KEYS[5]) or '0')
+local tokens = tonumber(ARGV[6])
+if reqs + 1 > tonumber(ARGV[4]) or (toks > 0 and toks + tokens > tonumber(ARGV[5])) then
+    return tonumber(ARGV[9]) - (now % tonumber(ARGV[9]))
+end
+redis.call('INCR', KEYS[4])
+redis.call('EXPIRE', KEYS[4], ARGV[8])
+redis.call('INCRBY', KEYS[5], tokens)
+redis.call('EXPIRE', KEYS[5], ARGV[8])
+redis.call('ZADD', KEYS[1], now + tonumber(ARGV[3]), ARGV[2])
+return 0
+"""
+
+_INCREASE_SCRIPT = """
+local limit = tonumber(redis.call('GET', KEYS[1]) or ARGV[3])
+limit = math.min(tonumber(ARGV[2]), limit + tonumber(ARGV[1]) / limit)
+redis.call('SET', KEYS[1], tostring(limit))
+return tostring(limit)
+"""
+
+_DECREASE_SCRIPT = """
+local now = tonumber(ARGV[1])
+local cooldown = tonumber(redis.call('GET', KEYS[2]) or '0')
+if cooldown > now then return 0 end
+local limit = tonumber(redis.call('GET', KEYS[1]) or ARGV[5])
+limit = math.max(tonumber(ARGV[3]), limit * tonumber(ARGV[2]))
+redis.call('SET', KEYS[1], tostring(limit))
+redis.call('SET', KEYS[2], now + tonumber(ARGV[4]), 'PX', tonumber(ARGV[4]))
+return 1
+"""
+
+_ADJUST_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then return 0 end
+local toks = redis.call('INCRBY', KEYS[1], ARGV[1])
+if toks < 0 then redis.call('INCRBY', KEYS[1], -toks) end
+return 1
+"""
+
+class RedisBackend:
+    """
+    Limiter state shared across worker processes. In-flight calls are leases in a sorted set
+    scored by expiry, so slots held by a crashed worker free themselves.
+    """
+
+    def __init__(self, client, rpm: int, tpm: int, min_limit: int, max_limit: int, initial_limit: int):
+        self.client = client
+        self.rpm = rpm
+        self.tpm = tpm
+        self.min_limit = min_limit
+        self.max_limit = max_limit
+        self.initial_limit = initial_limit
+        self.inflight_key = f"{RATE_LIMIT_KEY_PREFIX}:inflight"
+        self.limit_key = f"{RATE_LIMIT_KEY_PREFIX}:limit"
+        self.cooldown_key = f"{RATE_LIMIT_KEY_PREFIX}:cooldown"
+        self._acquire = client.register_script(_ACQUIRE_SCRIPT)
+        self._increase = client.register_script(_INCREASE_SCRIPT)
+        self._decrease = client.register_script(_DECREASE_SCRIPT)
+        self._adjust = client.register_script(_ADJUST_SCRIPT)
+
+    def _window_keys(self, now: int):
+        window = now // (WINDOW_SECONDS * 1000)
+        return f"{RATE_LIMIT_KEY_PREFIX}:req:{window}", f"{RATE_LIMIT_KEY_PREFIX}:tok:{window}"
+
+    async def try_acquire(self, lease_id: str, tokens: int) -> int:
+        now = _now_ms()
+        req_key, tok_key = self._window_keys(now)
+        return int(await self._acquire(
+            keys=[self.inflight_key, self.limit_key, self.cooldown_key, req_key, tok_key],
+            args=[now, lease_id, LEASE_TTL_SECONDS * 1000, self.rpm, self.tpm, tokens,
+                  self.initial_limit, WINDOW_SECONDS * 2, WINDOW_SECONDS * 1000],
+        ))
+
+    async def release(self, lease_id: str):
+        await self.client.zrem(self.inflight_key, lease_id)
+
+    async def adjust_tokens(self, delta: int):
+        # Only corrects a window that still exists (and so keeps its TTL); once it has rolled over
+        # there's nothing left to correct
+        _, tok_key = self._window_keys(_now_ms())
+        await self._adjust(keys=[tok_key], args=[delta])
+
+    async def on_success(self):
+        await self._increase(keys=[self.limit_key], args=[INCREASE_STEP, self.max_limit, self.initial_limit])
+
+    async def on_rate_limited(self):
+        await self._decrease(
+            keys=[self.limit_key, self.cooldown_key],
+            args=[_now_ms(), DECREASE_FACTOR, self.min_limit, int(COOLDOWN_SECONDS * 1000), self.initial_limit],
+        )
+
+    async def current_limit(self) -> float:
+        value = await self.client.get(self.limit_key)
+        return float(value) if value is not None else float(self.initial_limit)
+
+class AdaptiveRateLimiter:
+    """
+    Front for the limiter backends. Callers wrap each LLM call in `async with limiter.limit(tokens)`
+    and report the outcome with on_success() / on_rate_limited().
+    """
+
+    def __init__(self, redis_url: str | None = RATE_LIMIT_REDIS_URL, rpm: int = LLM_RPM, tpm: int = LLM_TPM,
+                 min_concurrency: int = LLM_MIN_CONCURRENCY, max_concurrency: int = LLM_MAX_CONCURRENCY,
+                 initial_concurrency: int = LLM_INITIAL_CONCURRENCY):
+        self.redis_url = redis_url
+        self._settings = (rpm, tpm, min_concurrency, max_concurrency, initial_concurrency)
+        self._local = LocalBackend(*self._settings)
+        # redis.asyncio clients are bound to the loop they first run on, so keep one per loop
+        self._redis_backends = weakref.WeakKeyDictionary()
+        self._redis_retry_at = 0.0 # monotonic time before which Redis isn't tried again
+
+    def _backend(self):
+        if not self.redis_url or time.monotonic() < self._redis_retry_at:
+            return self._local
+        loop = asyncio.get_running_loop()
+        backend = self._redis_backends.get(loop)
+        if backend is None:
+            try:
+                import redis.asyncio as aioredis
+                backend = RedisBackend(aioredis.from_url(self.redis_url), *self._settings)
+            except Exception as e:
+                print(f"--- Rate limiter: Redis unavailable ({e}), using in-process limits. ---")
+                self._redis_retry_at = time.monotonic() + RATE_LIMIT_REDIS_RETRY_SECONDS
+                return self._local
+            self._redis_backends[loop] = backend
+        return backend
+
+    async def _invoke(self, backend, method: str, *args):
+        """Calls method on backend, or on the local backend after a Redis error; returns (backend used, result)."""
+        if backend is not self._local:
+            try:
+                return backend, await getattr(backend, method)(*args)
+            except (ConnectionError, OSError, TimeoutError) as e:
+                self._fall_back(e)
+            except Exception as e:
+                if type(e).__module__.startswith("redis"):
+                    self._fall_back(e)
+                else:
+                    raise
+        return self._local, await getattr(self._local, method)(*args)
+
+    async def _call(self, method: str, *args):
+        _, result = await self._invoke(self._backend(), method, *args)
+        return result
+
+    def _fall_back(self, error: Exception):
+        if time.monotonic() >= self._redis_retry_at:
+            print(f"--- Rate limiter: Redis error ({error}), using in-process limits for "
+                  f"{RATE_LIMIT_REDIS_RETRY_SECONDS:g}s. ---")
+        self._redis_retry_at = time.monotonic() + RATE_LIMIT_REDIS_RETRY_SECONDS
+
+    @asynccontextmanager
+    async def limit(self, tokens: int):
+        lease_id = uuid.uuid4().hex
+        while True:
+            backend, wait_ms = await self._invoke(self._backend(), "try_acquire", lease_id, tokens)
+            if wait_ms == 0:
+                break
+            if wait_ms < 0:
+                # Concurrency saturated: poll with jitter so waiters don't wake in lockstep
+                await asyncio.sleep(POLL_INTERVAL_SECONDS * (1 + random.random()))
+            else:
+                await asyncio.sleep(wait_ms / 1000 + random.random() * POLL_INTERVAL_SECONDS)
+        try:
+            yield
+        finally:
+            # Where the lease was granted, even if Redis went down or came back since: the other
+            # backend never saw it (a Redis lease that can't be released expires on its own)
+            await self._invoke(backend, "release", lease_id)
+
+    async def adjust_tokens(self, delta: int):
+        """Corrects the token window once the actual usage of a call is known."""
+        if delta:
+            await self._call("adjust_tokens", delta)
+
+    async def on_success(self):
+        await self._call("on_success")
+
+    async def on_rate_limited(self):
+        await self._call("on_rate_limited")
+
+    async def current_limit(self) -> float:
+        return await self._call("current_limit")
+
+_rate_limiter = None
+
+def get_rate_limiter() -> AdaptiveRateLimiter:
+    global _rate_limiter
+    if _rate_limiter is None:
+        _rate_limiter = AdaptiveRateLimiter()
+    return _rate_limiter
@@ -0,0 +1,103 @@
+#Long-lived async runtime for worker processes. Celery tasks are synchronous; instead of each one
+#building and tearing down an event loop with asyncio.run(), every task's coroutine runs on one
+#event loop that lives as long as the worker process (on a background thread). The DB connection
+#pool, LLM connection pools and per-loop limiters are all bound to that loop, so they're created
+#once and reused by every task. Started from Celery's worker_process_init (or lazily by the first
+#task) and stopped from the shutdown signals, which close those pools cleanly.
+
+import os
+import asyncio
+import threading
+
+RUNTIME_SHUTDOWN_TIMEOUT_SECONDS = float(os.environ.get("RUNTIME_SHUTDOWN_TIMEOUT_SECONDS", 30))
+# Open a DB connection, LLM client and the parser process server at startup, not on the first job
+RUNTIME_WARM_UP = os.environ.get("RUNTIME_WARM_UP", "1") == "1"
+
+class WorkerRuntime:
+
+    def __init__(self):
+        self.loop = None
+        self._thread = None
+        self._lock = threading.Lock()
+
+    def start(self, warm_up: bool = RUNTIME_WARM_UP):
+        with self._lock:
+            if self.loop is not None:
+                return self
+            self.loop = asyncio.new_event_loop()
+            self._thread = threading.Thread(target=self._run_loop, name="worker-runtime", daemon=True)
+            self._thread.start()
+        if warm_up:
+            # Not waited for: Celery expects worker_process_init handlers to return within seconds,
+            # and the first task can run alongside the warm-up anyway
+            asyncio.run_coroutine_threadsafe(self._warm_up(), self.loop)
+        return self
+
+    def _run_loop(self):
+        asyncio.set_event_loop(self.loop)
+        self.loop.run_forever()
+
+    async def _warm_up(self):
+        from .database import engine
+        from .generation import DEFAULT_MODEL_NAME
+        from .providers import parse_model_spec, get_provider
+        from .parsing import warm_parsers
+        try:
+            async with engine.connect():
+                pass
+            await get_provider(parse_model_spec(DEFAULT_MODEL_NAME)[0]).warm()
+            await asyncio.to_thread(warm_parsers)
+            print(f"--- Worker runtime ready (pid {os.getpid()}) ---")
+        except Exception as e:
+            # Everything warmed here is also created on first use; a failure only costs latency
+            print(f"!!! Worker runtime warm-up failed: {e} !!!")
+
+    def run(self, coro):
+        """Runs coro on the runtime's loop and returns its result. Blocks the calling thread, which can't be the loop's own."""
+        if self.loop is None:
+            self.start()
+        if threading.current_thread() is self._thread:
+            coro.close()
+            raise RuntimeError("WorkerRuntime.run() called from the runtime's own event loop; await the coroutine instead")
+        future = asyncio.run_coroutine_threadsafe(coro, self.loop)
+        try:
+            return future.result()
+        except BaseException:
+            # e.g. Celery's time limits interrupting the task: don't leave the coroutine running
+            future.cancel()
+            raise
+
+    def stop(self, timeout: float = RUNTIME_SHUTDOWN_TIMEOUT_SECONDS):
+        with self._lock:
+            loop, thread = self.loop, self._thread
+            self.loop = self._thread = None
+        if loop is None:
+            return
+        try:
+            asyncio.run_coroutine_threadsafe(self._shutdown(), loop).result(timeout)
+        except Exception as e:
+            print(f"!!! Worker runtime shutdown: {e} !!!")
+        loop.call_soon_threadsafe(loop.stop)
+        thread.join(timeout)
+        loop.close()
+
+    async def _shutdown(self):
+        from .database import engine
+        from .providers import close_providers
+        current = asyncio.current_task()
+        leftovers = [task for task in asyncio.all_tasks() if task is not current]
+        for task in leftovers:
+            task.cancel()
+        await asyncio.gather(*leftovers, return_exceptions=True)
+        await close_providers()
+        await engine.dispose()
+        await asyncio.get_running_loop().shutdown_default_executor()
+
+_runtime = WorkerRuntime()
+
+def get_runtime() -> WorkerRuntime:
+    return _runtime
+
+def run_async(coro):
+    """Runs a task's coroutine on this process's runtime loop (starting it if needed)."""
+    return _runtime.run(coro)
@@ -122,35 +122,69 @@ RECIPE_SCHEMAS = {
     "qna": {
         "name": "Question & Answer Pairs",
         "schema": QNA_SCHEMA,
-        "description": "Generates question-answer pairs ideal for chatbots and assistants."
+        "description": "Generates question-answer pairs ideal for chatbots and assistants.",
+        "chunking": {"target_tokens": 600, "max_tokens": 1200, "overlap_tokens": 50},
+        "qc": {
+            "question": {"min_length": 10, "pattern": r"\?"},
+            "answer": {"min_length": 10, "banned_phrases": ["placeholder"]}
+        },
+        "dedup": {"fields": ["question"]}
     },
     "summarization": {
         "name": "Summarization",
         "schema": SUMMARIZATION_SCHEMA,
-        "description": "Creates a concise summary of the provided text chunk."
+        "description": "Creates a concise summary of the provided text chunk.",
+        "chunking": {"target_tokens": 1500, "max_tokens": 3000, "overlap_tokens": 0},
+        "qc": {
+            "summary": {"min_length": 20, "banned_phrases": ["placeholder"]}
+        },
+        "dedup": {"fields": ["summary"]}
     },
     "instruction_following": {
         "name": "Instruction Following",
         "schema": INSTRUCTION_FOLLOWING_SCHEMA,
-        "description": "Creates a versatile instruction-based dataset for general purpose models."
+        "description": "Creates a versatile instruction-based dataset for general purpose models.",
+        "qc": {
+            "instruction": {"min_length": 10},
+            "output": {"min_length": 10, "banned_phrases": ["placeholder"]}
+        },
+        "dedup": {"fields": ["instruction", "input"]}
     },
 
     "code_explainer": {
         "name": "Code Explainer",
         "schema": CODE_EXPLAINER_SCHEMA,
-        "description": "Generates explanations for source code chunks."
+        "description": "Generates explanations for source code chunks.",
+        # One explanation per function/class: never merge, only split what's too big
+        "chunking": {"target_tokens": 0, "max_tokens": 2000, "overlap_tokens": 0},
+        "qc": {
+            "explanation": {"min_length": 30} # Explanation must be substantial
+        },
+        "dedup": {"fields": ["code_chunk", "explanation"]}
     },
 
     "coding_agent": {
         "name": "Coding Agent",
         "schema": CODING_AGENT_SCHEMA,
-        "description": "Generates instruction-based datasets for training code generation models."
+        "description": "Generates instruction-based datasets for training code generation models.",
+        "chunking": {"target_tokens": 0, "max_tokens": 2000, "overlap_tokens": 0},
+        "qc": {
+            "instruction": {"min_length": 10},
+            "generated_code": {"min_length": 10}
+        },
+        "dedup": {"fields": ["instruction", "input_context"]}
     },
 
     "math_reasoning": {
         "name": "Math Reasoning",
         "schema": MATH_REASONING_SCHEMA,
-        "description": "Generates step-by-step reasoning for solving math problems."
+        "description": "Generates step-by-step reasoning for solving math problems.",
+        "qc": {
+            "problem": {"min_length": 10},
+            "chain_of_thought": {"min_items": 1},
+            "final_answer": {"min_length": 1}
+        },
+        "dedup": {"fields": ["problem"]}
     }
 }
 
@@ -159,3 +193,29 @@ def get_schema_for_recipe(recipe_name: str) -> dict:
     if not recipe:
         raise ValueError(f"Unknown recipe name: {recipe_name}")
     return recipe["schema"]
+
+def get_batch_schema_for_recipe(recipe_name: str) -> dict:
+    """
+    Array-wrapped recipe schema for batched generation: one result per input chunk,
+    tagged with the chunk's index so results can be matched back to their chunks.
+    """
+    return {
+        "type": "object",
+        "properties": {
+            "results": {
+                "type": "array",
+                "items": {
+                    "type": "object",
+                    "properties": {
+                        "chunk_index": {
+                            "type": "integer",
+                            "description": "The index of the text chunk this result was generated from."
+                        },
+                        "output": get_schema_for_recipe(recipe_name)
+                    },
+                    "required": ["chunk_index", "output"]
+                }
+            }
+        },
+        "required": ["results"]
+    }
@@ -0,0 +1,225 @@
+#Job sharding: a large job is parsed once, its chunks are split into shards written to disk,
+#and each shard runs as its own Celery task (see worker.py), so one job spreads across every
+#worker instead of holding a single process for hours. Shards run in at most
+#SHARD_MAX_CONCURRENCY lanes per job and on their own queue (SHARD_QUEUE in task_queue.py) at a lower priority, so small jobs
+#aren't stuck behind a big one. A merge task concatenates the shard results in shard order.
+#Shard files live under RESULT_DIR, which must be storage every worker can reach. Each shard
+#dedups against its own index (one SQLite file per writer, which is safe on shared storage),
+#and the merge dedups the shards' kept items against the job's index, in shard order. The
+#shards' chunk checkpoints are then pointed at the merged result file.
+
+import os
+import json
+import asyncio
+import shutil
+import itertools
+import numpy as np
+from typing import List, Dict, Iterator, Tuple
+from sqlalchemy import select
+from .models import JobShard, ChunkCheckpoint
+from .sink import rejected_path_for, line_index_path_for, build_line_index
+
+# Jobs with more chunks than this are sharded; 0 turns sharding off
+SHARD_MIN_CHUNKS = int(os.environ.get("SHARD_MIN_CHUNKS", 0))
+SHARD_SIZE_CHUNKS = int(os.environ.get("SHARD_SIZE_CHUNKS", 2000))
+# Shards of one job running at the same time, whatever the number of workers
+SHARD_MAX_CONCURRENCY = int(os.environ.get("SHARD_MAX_CONCURRENCY", 4))
+SHARD_MAX_RETRIES = int(os.environ.get("SHARD_MAX_RETRIES", 3))
+SHARD_RETRY_DELAY_SECONDS = int(os.environ.get("SHARD_RETRY_DELAY_SECONDS", 60))
+# Items per cross-shard dedup lookup while merging
+SHARD_MERGE_DEDUP_BATCH = int(os.environ.get("SHARD_MERGE_DEDUP_BATCH", 500))
+# Redis broker priorities: 0 is served first. Jobs (parsing, small jobs) and merges go ahead
+# of shards, and shards of bigger jobs go after those of smaller ones.
+MERGE_PRIORITY = 1
+SHARD_BASE_PRIORITY = 3
+
+def sharding_enabled(options: Dict | None = None) -> bool:
+    return bool((options or {}).get("sharding", SHARD_MIN_CHUNKS > 0))
+
+def shard_dir_for(result_dir: str, task_id: str) -> str:
+    return os.path.join(result_dir, f"{task_id}.shards")
+
+def shard_index_path_for(shard: JobShard) -> str:
+    """The shard's own dedup index, next to its result file."""
+    base, _ = os.path.splitext(shard.result_file_path)
+    return f"{base}.dedup.sqlite"
+
+def shard_priority(num_shards: int) -> int:
+    return min(9, SHARD_BASE_PRIORITY + num_shards // 10)
+
+def plan_lanes(shard_ids: List[int], max_concurrency: int = SHARD_MAX_CONCURRENCY) -> List[List[int]]:
+    """Deals shards round-robin into at most max_concurrency lanes; each lane runs its shards one after another."""
+    lanes = max(1, min(max_concurrency, len(shard_ids)))
+    return [shard_ids[i::lanes] for i in range(lanes)]
+
+async def load_shards(session, job_id: int) -> List[JobShard]:
+    rows = await session.execute(select(JobShard).where(JobShard.job_id == job_id).order_by(JobShard.shard_index))
+    return list(rows.scalars().all())
+
+async def create_shards(session, job, chunks: List[Dict], store, result_dir: str,
+                        shard_size: int = SHARD_SIZE_CHUNKS) -> List[JobShard]:
+    """
+    Writes each slice of chunks ({"id", "ref"}, text in the ChunkStore store) to its own file
+    and records a PENDING JobShard for it.
+    """
+    shard_dir = shard_dir_for(result_dir, job.task_id)
+    os.makedirs(shard_dir, exist_ok=True)
+    shards = []
+    for shard_index, start in enumerate(range(0, len(chunks), shard_size)):
+        chunks_path = os.path.join(shard_dir, f"{shard_index:05d}.chunks.jsonl")
+        _write_chunks(chunks_path, chunks[start:start + shard_size], store)
+        shards.append(JobShard(
+            job_id=job.id,
+            shard_index=shard_index,
+            status="PENDING",
+            chunk_count=len(chunks[start:start + shard_size]),
+            chunks_path=chunks_path,
+            result_file_path=os.path.join(shard_dir, f"{shard_index:05d}.jsonl"),
+        ))
+    session.add_all(shards)
+    await session.commit()
+    print(f"--- Job {job.id}: split {len(chunks)} chunks into {len(shards)} shards ---")
+    return shards
+
+def _write_chunks(path: str, chunks: List[Dict], store):
+    with open(path + ".tmp", "w", encoding="utf-8") as f:
+        for chunk in chunks:
+            f.write(json.dumps({"id": chunk["id"], "text": store.get(chunk["ref"])}) + "\n")
+    os.replace(path + ".tmp", path)
+
+def iter_shard_chunks(path: str) -> Iterator[Dict]:
+    """Yields a shard's {"id", "text"} chunks, one line at a time."""
+    with open(path, "r", encoding="utf-8") as f:
+        for line in f:
+            yield json.loads(line)
+
+def _concatenate(paths: List[str], out_path: str) -> List[int]:
+    """Concatenates files into out_path; returns each file's starting byte offset in it."""
+    starts = []
+    with open(out_path, "wb") as dst:
+        for path in paths:
+            starts.append(dst.tell())
+            if os.path.exists(path):
+                with open(path, "rb") as src:
+                    shutil.copyfileobj(src, dst, 1024 * 1024)
+    return starts
+
+def merge_shard_results(shards: List[JobShard], result_path: str, dedup=None) -> Tuple[Dict, int, List]:
+    """
+    Writes the job's result file, rejected sidecar and line index from its shards' (in shard
+    order). Shard files are cut to their committed offsets first, like a resumed sink would.
+    Each shard was only deduplicated against itself, so with dedup (the job's
+    NearDuplicateIndex) kept items are checked again in shard order, and those that
+    near-duplicate an item of an earlier shard move to the rejected file. Returns the merged
+    files' byte lengths, in the shape of Job.result_offsets, the number of such duplicates, and
+    per shard an (old, new) pair of arrays mapping its line offsets to the merged file's (-1 for
+    dropped lines), for relocate_checkpoints.
+    """
+    for shard in shards:
+        for kind, path in (("accepted", shard.result_file_path), ("rejected", rejected_path_for(shard.result_file_path))):
+            if shard.result_offsets and os.path.exists(path):
+                with open(path, "r+b") as f:
+                    f.truncate(shard.result_offsets.get(kind, 0))
+    if dedup is not None:
+        return _merge_deduplicated(shards, result_path, dedup)
+
+    tmp_path = result_path + ".merging"
+    starts = _concatenate([shard.result_file_path for shard in shards], tmp_path)
+    _concatenate([rejected_path_for(shard.result_file_path) for shard in shards], rejected_path_for(result_path))
+
+    # The line index is each shard's index shifted by where the shard starts; no rescan needed
+    relocations = []
+    with open(line_index_path_for(result_path) + ".tmp", "wb") as dst:
+        for shard, start in zip(shards, starts):
+            index_path = line_index_path_for(shard.result_file_path)
+            if not os.path.exists(index_path) and os.path.exists(shard.result_file_path):
+                build_line_index(shard.result_file_path)
+            offsets = np.zeros(0, dtype="<u8")
+            if os.path.exists(index_path):
+                offsets = np.fromfile(index_path, dtype="<u8")
+                offsets = offsets[offsets < os.path.getsize(shard.result_file_path)]
+                (offsets + np.uint64(start)).astype("<u8").tofile(dst)
+            old = offsets.astype(np.int64)
+            relocations.append((old, old + start))
+    os.replace(line_index_path_for(result_path) + ".tmp", line_index_path_for(result_path))
+    os.replace(tmp_path, result_path)
+    offsets = {"accepted": os.path.getsize(result_path), "rejected": os.path.getsize(rejected_path_for(result_path))}
+    return offsets, 0, relocations
+
+def _merge_deduplicated(shards: List[JobShard], result_path: str, dedup) -> Tuple[Dict, int]:
+    # Rewrites line by line, so the line index is written as we go instead of shifted
+    tmp_path = result_path + ".merging"
+    duplicates = 0
+    relocations = []
+    with open(tmp_path, "wb") as accepted, open(rejected_path_for(result_path), "wb") as rejected, \
+            open(line_index_path_for(result_path) + ".tmp", "wb") as index:
+        for shard in shards:
+            shard_rejected = rejected_path_for(shard.result_file_path)
+            if os.path.exists(shard_rejected):
+                with open(shard_rejected, "rb") as src:
+                    shutil.copyfileobj(src, rejected, 1024 * 1024)
+            old, new = [], []
+            relocations.append((old, new))
+            if not os.path.exists(shard.result_file_path):
+                continue
+            with open(shard.result_file_path, "rb") as src:
+                line_number = 0
+                src_offset = 0
+                while lines := list(itertools.islice(src, SHARD_MERGE_DEDUP_BATCH)):
+                    items = [json.loads(line) for line in lines]
+                    # Stable across merge attempts: "shard-00003:17" is shard 3's line 17
+                    sources = [f"shard-{shard.shard_index:05d}:{line_number + i}" for i in range(len(lines))]
+                    line_number += len(lines)
+                    offsets = []
+                    for line, item, duplicate in zip(lines, items, dedup.check_batch_sync(items, sources)):
+                        old.append(src_offset)
+                        src_offset += len(line)
+                        new.append(accepted.tell() if duplicate is None else -1)
+                        if duplicate is None:
+                            offsets.append(accepted.tell())
+                            accepted.write(line)
+                        else:
+                            record = {"reason": "duplicate", "duplicate_of": duplicate[0],
+                                      "similarity": round(duplicate[1], 3), "item": item}
+                            rejected.write((json.dumps(record) + "\n").encode("utf-8"))
+                            duplicates += 1
+                    np.array(offsets, dtype="<u8").tofile(index)
+    os.replace(line_index_path_for(result_path) + ".tmp", line_index_path_for(result_path))
+    os.replace(tmp_path, result_path)
+    offsets = {"accepted": os.path.getsize(result_path), "rejected": os.path.getsize(rejected_path_for(result_path))}
+    relocations = [(np.array(old, dtype=np.int64), np.array(new, dtype=np.int64)) for old, new in relocations]
+    return offsets, duplicates, relocations
+
+async def relocate_checkpoints(session, job_id: int, shards: List[JobShard], relocations: List):
+    """
+    Rewrites the result_offset of the shards' chunk checkpoints, which point into the shard
+    files, to the chunk's first line in the merged result file (None if the merge dropped that
+    line as a cross-shard duplicate). Changes are left for the caller's commit, so they land
+    with the merged job.
+    """
+    for shard, (old, new) in zip(shards, relocations):
+        chunk_ids = await asyncio.to_thread(lambda path=shard.chunks_path: [c["id"] for c in iter_shard_chunks(path)])
+        rows = await session.execute(select(ChunkCheckpoint).where(
+            ChunkCheckpoint.job_id == job_id,
+            ChunkCheckpoint.chunk_id.in_(chunk_ids),
+            ChunkCheckpoint.result_offset.is_not(None),
+        ))
+        for checkpoint in rows.scalars():
+            i = int(np.searchsorted(old, checkpoint.result_offset))
+            found = i < len(old) and old[i] == checkpoint.result_offset and new[i] >= 0
+            checkpoint.result_offset = int(new[i]) if found else None
+
+def merge_shard_stats(shards: List[JobShard]) -> Dict:
+    stats = {"generated": 0, "failed": 0, "accepted": 0, "rejected": 0, "duplicates": 0, "rate_limited": 0,
+             "qc_rejections": {}}
+    for shard in shards:
+        for key, value in (shard.stats or {}).items():
+            if key == "qc_rejections":
+                for rule, count in value.items():
+                    stats["qc_rejections"][rule] = stats["qc_rejections"].get(rule, 0) + count
+            elif key in stats:
+                stats[key] += value
+    return stats
+
+def remove_shard_files(result_dir: str, task_id: str):
+    shutil.rmtree(shard_dir_for(result_dir, task_id), ignore_errors=True)
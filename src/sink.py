@@ -0,0 +1,135 @@
+#Appends generated items to the job's JSONL result file as soon as they pass QC, with rejected
+#items going to a sidecar file. Writes are buffered; the buffer is flushed and fsynced
+#periodically so partial results are readable (and survive a crash) while the job runs.
+#A line-offset index (one little-endian uint64 byte offset per accepted line) is written
+#alongside, so any slice of the result can be served without scanning the file. It's buffered
+#and flushed with the results, but can still lag them on disk by up to a buffer's worth.
+
+import os
+import json
+import time
+import struct
+
+RESULT_WRITE_BUFFER_BYTES = int(os.environ.get("RESULT_WRITE_BUFFER_BYTES", 1024 * 1024))
+RESULT_FLUSH_INTERVAL_SECONDS = float(os.environ.get("RESULT_FLUSH_INTERVAL_SECONDS", 1.0))
+RESULT_FSYNC_INTERVAL_SECONDS = float(os.environ.get("RESULT_FSYNC_INTERVAL_SECONDS", 5.0))
+
+_OFFSET = struct.Struct("<Q")
+
+def rejected_path_for(result_path: str) -> str:
+    base, ext = os.path.splitext(result_path)
+    return f"{base}.rejected{ext}"
+
+def line_index_path_for(result_path: str) -> str:
+    base, _ = os.path.splitext(result_path)
+    return f"{base}.idx"
+
+def read_line_offset(index_file, line: int) -> int:
+    index_file.seek(line * _OFFSET.size)
+    return _OFFSET.unpack(index_file.read(_OFFSET.size))[0]
+
+def count_lines_before(index_file, byte_length: int) -> int:
+    """Number of indexed lines starting before byte_length (binary search, no full read)."""
+    index_file.seek(0, os.SEEK_END)
+    low, high = 0, index_file.tell() // _OFFSET.size
+    while low < high:
+        mid = (low + high) // 2
+        if read_line_offset(index_file, mid) < byte_length:
+            low = mid + 1
+        else:
+            high = mid
+    return low
+
+def build_line_index(result_path: str, byte_length: int | None = None) -> str:
+    """(Re)builds the line-offset index by scanning the result file, for results written without one."""
+    index_path = line_index_path_for(result_path)
+    offset = 0
+    with open(result_path, "rb") as src, open(index_path + ".tmp", "wb") as dst:
+        for line in src:
+            if byte_length is not None and offset + len(line) > byte_length:
+                break
+            dst.write(_OFFSET.pack(offset))
+            offset += len(line)
+    os.replace(index_path + ".tmp", index_path)
+    return index_path
+
+class JsonlResultSink:
+    """
+    Pass resume_offsets (byte lengths from a checkpoint) to continue an earlier run: both files
+    are truncated back to those lengths and appended to. Otherwise the files start empty.
+    """
+
+    def __init__(self, result_path: str, resume_offsets: dict | None = None):
+        self.result_path = result_path
+        self.rejected_path = rejected_path_for(result_path)
+        paths = {"accepted": result_path, "rejected": self.rejected_path}
+        self.offsets = {"accepted": 0, "rejected": 0}
+        self._files = {}
+        for kind, path in paths.items():
+            if resume_offsets and os.path.exists(path):
+                with open(path, "r+b") as f:
+                    f.truncate(resume_offsets.get(kind, 0))
+                self.offsets[kind] = os.path.getsize(path)
+                mode = "ab"
+            else:
+                mode = "wb"
+            self._files[kind] = open(path, mode, buffering=RESULT_WRITE_BUFFER_BYTES)
+        self.index_path = line_index_path_for(result_path)
+        if resume_offsets and not os.path.exists(self.index_path) and self.offsets["accepted"]:
+            build_line_index(result_path) # Result written before line indexes existed
+        if resume_offsets and os.path.exists(self.index_path):
+            # Keep the entries for lines that start before the truncated result file's end
+            with open(self.index_path, "r+b") as f:
+                f.truncate(count_lines_before(f, self.offsets["accepted"]) * _OFFSET.size)
+            self._index = open(self.index_path, "ab", buffering=RESULT_WRITE_BUFFER_BYTES)
+        else:
+            self._index = open(self.index_path, "wb", buffering=RESULT_WRITE_BUFFER_BYTES)
+        self.counts = {"accepted": 0, "rejected": 0}
+        self._last_flush = time.monotonic()
+        self._last_fsync = self._last_flush
+
+    def _append(self, kind: str, record: dict) -> int:
+        line = (json.dumps(record) + "\n").encode("utf-8")
+        offset = self.offsets[kind]
+        self._files[kind].write(line)
+        self.offsets[kind] += len(line)
+        self.counts[kind] += 1
+        self._maybe_flush()
+        return offset
+
+    def write(self, item: dict) -> int:
+        """Appends an accepted item and returns the byte offset of its line."""
+        self._index.write(_OFFSET.pack(self.offsets["accepted"]))
+        return self._append("accepted", item)
+
+    def write_rejected(self, item: dict, reason: str = "qc", **details) -> int:
+        return self._append("rejected", {"reason": reason, **details, "item": item})
+
+    def _maybe_flush(self):
+        now = time.monotonic()
+        if now - self._last_flush < RESULT_FLUSH_INTERVAL_SECONDS:
+            return
+        self.flush(fsync=now - self._last_fsync >= RESULT_FSYNC_INTERVAL_SECONDS)
+
+    def flush(self, fsync: bool = False):
+        now = time.monotonic()
+        for f in (*self._files.values(), self._index):
+            f.flush()
+            if fsync:
+                os.fsync(f.fileno())
+        self._last_flush = now
+        if fsync:
+            self._last_fsync = now
+
+    def close(self):
+        if self._files["accepted"].closed:
+            return
+        self.flush(fsync=True)
+        for f in (*self._files.values(), self._index):
+            f.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
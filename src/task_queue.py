@@ -0,0 +1,52 @@
+#Celery settings shared by the worker and the API, plus by-name dispatch for the API. Importing
+#this module doesn't import the pipeline (or Celery, until the first dispatch), so API
+#processes enqueue jobs without loading the parser and LLM stack the worker needs.
+
+import os
+
+CELERY_BROKER_URL = os.environ.get("CELERY_BROKER_URL", "redis://localhost:6379/0")
+# Only needed by sharded jobs, whose merge task runs as a chord callback
+CELERY_RESULT_BACKEND = os.environ.get("CELERY_RESULT_BACKEND", "redis://localhost:6379/1")
+
+# Workers must consume both queues (celery -Q celery,foundry.shards), or run dedicated shard workers
+JOB_QUEUE = os.environ.get("JOB_QUEUE", "celery")
+SHARD_QUEUE = os.environ.get("SHARD_QUEUE", "foundry.shards")
+
+# Task names are fixed here so the API can send tasks without importing worker.py
+PROCESS_DATASET_TASK = "worker.process_dataset_task"
+PROCESS_SHARD_TASK = "worker.process_shard_task"
+MERGE_SHARDS_TASK = "worker.merge_shards_task"
+
+# Result backend states of a task that is running or will run again
+LIVE_TASK_STATES = ("STARTED", "RETRY")
+
+def create_celery_app():
+    from celery import Celery
+    app = Celery('tasks', broker=CELERY_BROKER_URL, backend=CELERY_RESULT_BACKEND)
+    app.conf.broker_transport_options = {
+        "priority_steps": list(range(10)), "sep": ":", "queue_order_strategy": "priority",
+    }
+    # Long tasks: don't let one worker reserve a backlog of shards other workers could be running
+    app.conf.worker_prefetch_multiplier = 1
+    # Record STARTED, so task_is_live() sees running tasks and not just ones waiting to retry
+    app.conf.task_track_started = True
+    return app
+
+_client = None
+
+def get_celery_client():
+    """A Celery app with no tasks registered, for sending tasks by name."""
+    global _client
+    if _client is None:
+        _client = create_celery_app()
+    return _client
+
+def dispatch_dataset_job(job_id: int, celery_task_id: str | None = None) -> str:
+    """Sends the job to the worker; returns the Celery task id (celery_task_id if given)."""
+    result = get_celery_client().send_task(PROCESS_DATASET_TASK, kwargs={"job_id": job_id}, queue=JOB_QUEUE,
+                                           task_id=celery_task_id)
+    return result.id
+
+def task_is_live(celery_task_id: str) -> bool:
+    """Whether the task is running or waiting for a retry, per the result backend."""
+    return get_celery_client().AsyncResult(celery_task_id).state in LIVE_TASK_STATES
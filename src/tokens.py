@@ -0,0 +1,9 @@
+#Fast, dependency-free token estimates used for rate limiting and chunk sizing.
+
+# Roughly 4 characters per token for English text and code on Gemini/GPT-style tokenizers.
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    if not text:
+        return 0
+    return len(text) // CHARS_PER_TOKEN + 1
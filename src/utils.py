@@ -1,11 +1,18 @@
 # Divides raw files into chunks using parsers specific to file types.
 
 import io
-import ast  
+import time
+import numpy as np
 import pandas as pd
 from unstructured.partition.auto import partition
-from typing import List
+from typing import List, Iterator, Optional
+from .metrics import timed_parser, PARSER_SECONDS
+from .code_chunking import chunk_code, language_for
 
+# Rows per block for streaming tabular parsing; bounds memory regardless of file size
+TABULAR_BLOCK_ROWS = 10_000
+
+@timed_parser("unstructured")
 def parse_unstructured_file(file_content: bytes, filename: str) -> List[str]:
  
     try:
@@ -19,49 +26,139 @@ def parse_unstructured_file(file_content: bytes, filename: str) -> List[str]:
         print(f"!!! Error parsing [Unstructured] file {filename}: {e} !!!")
         return []
 
+@timed_parser("code")
 def parse_code_file(file_content: bytes, filename: str) -> List[str]:
 
+    content_str = None
     try:
         content_str = file_content.decode('utf-8')
-        tree = ast.parse(content_str)
-        chunks = []
-        
-        # Chunk by top-level functions and classes
-        for node in tree.body:
-            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
-                # ast.unparse converts the node back to source code
-                chunks.append(ast.unparse(node))
-            
-        # Fallback: If no functions/classes, treat the whole file as one chunk
-        if not chunks:
-            chunks.append(content_str)
-            
+        # Chunks are slices of the original source, so comments and formatting are kept
+        chunks = chunk_code(content_str, language_for(filename) or "python")
         print(f"--- Successfully created {len(chunks)} code chunks. ---")
         return chunks
         
     except Exception as e:
-        print(f"!!! Error parsing [Code/AST] file {filename}: {e} !!!")
-        # Fallback on pure text chunking if AST fails
+        print(f"!!! Error parsing [Code] file {filename}: {e} !!!")
+        # Fallback on pure text chunking if the parser fails
         if content_str:
             return [content_str]
         return []
 
-def parse_tabular_file(file_content: bytes, filename: str) -> List[str]:
+def _open_source(source):
+    # Parsers accept raw bytes or a path on disk
+    return io.BytesIO(source) if isinstance(source, (bytes, bytearray, memoryview)) else source
+
+def _iter_csv_blocks(source, columns, block_rows) -> Iterator[pd.DataFrame]:
+    # A callable usecols skips unknown columns (a list raises), matching _select_columns for XLSX
+    wanted = set(columns) if columns else None
+    usecols = (lambda name: name in wanted) if wanted else None
+    for block in pd.read_csv(_open_source(source), chunksize=block_rows, usecols=usecols):
+        yield _select_columns(block, columns)
+
+def _iter_xlsx_blocks(source, columns, block_rows) -> Iterator[pd.DataFrame]:
+    from openpyxl import load_workbook
+    workbook = load_workbook(_open_source(source), read_only=True, data_only=True)
     try:
-        if filename.endswith('.csv'):
-            df = pd.read_csv(io.BytesIO(file_content))
-        elif filename.endswith(('.xls', '.xlsx')):
-            df = pd.read_excel(io.BytesIO(file_content))
-        else:
-            print(f"!!! Unsupported tabular format for: {filename} !!!")
-            return []
-        
-        # Convert each row into a JSON string
-        chunks = [row.to_json() for index, row in df.iterrows()]
+        rows = workbook.active.iter_rows(values_only=True)
+        header = next(rows, None)
+        if header is None:
+            return
+        header = [str(name) if name is not None else f"column_{i}" for i, name in enumerate(header)]
+        block = []
+        for row in rows:
+            block.append(row)
+            if len(block) >= block_rows:
+                yield _select_columns(pd.DataFrame(block, columns=header), columns)
+                block = []
+        if block:
+            yield _select_columns(pd.DataFrame(block, columns=header), columns)
+    finally:
+        workbook.close()
+
+def _select_columns(df: pd.DataFrame, columns) -> pd.DataFrame:
+    return df[[c for c in columns if c in df.columns]] if columns else df
+
+def iter_tabular_chunks(
+    source,
+    filename: str,
+    columns: Optional[List[str]] = None,
+    sample_fraction: Optional[float] = None,
+    max_rows: Optional[int] = None,
+    block_rows: int = TABULAR_BLOCK_ROWS,
+    seed: int = 0,
+) -> Iterator[str]:
+    """
+    Streams a CSV/XLSX file block by block and yields one JSON object string per row.
+    Each block is serialized in a single vectorized to_json call. Optionally keeps only
+    `columns`, a random `sample_fraction` of rows, and at most `max_rows` rows.
+    """
+    for rows in _iter_tabular_row_blocks(source, filename, columns, sample_fraction, max_rows, block_rows, seed):
+        yield from rows
+
+def _iter_tabular_row_blocks(source, filename: str, columns, sample_fraction, max_rows, block_rows,
+                             seed) -> Iterator[List[str]]:
+    filename = filename.lower()
+    if filename.endswith('.csv'):
+        blocks = _iter_csv_blocks(source, columns, block_rows)
+    elif filename.endswith('.xlsx'):
+        blocks = _iter_xlsx_blocks(source, columns, block_rows)
+    elif filename.endswith('.xls'):
+        # Legacy .xls has no streaming reader; load it whole
+        blocks = iter([_select_columns(pd.read_excel(_open_source(source)), columns)])
+    else:
+        print(f"!!! Unsupported tabular format for: {filename} !!!")
+        return
+
+    rng = np.random.default_rng(seed)
+    emitted = 0
+    for block in blocks:
+        if sample_fraction is not None and sample_fraction < 1:
+            block = block[rng.random(len(block)) < sample_fraction]
+        if max_rows is not None:
+            block = block.iloc[:max_rows - emitted]
+        if block.empty:
+            if max_rows is not None and emitted >= max_rows:
+                break
+            continue
+        # orient="records", lines=True gives one JSON object per line; newlines inside
+        # values are escaped, so splitting on "\n" is safe
+        lines = block.to_json(orient="records", lines=True, force_ascii=False).split("\n")
+        yield [line for line in lines if line]
+        emitted += len(block)
+        if max_rows is not None and emitted >= max_rows:
+            break
+
+@timed_parser("tabular")
+def parse_tabular_file(file_content, filename: str, columns: Optional[List[str]] = None,
+                       sample_fraction: Optional[float] = None, max_rows: Optional[int] = None) -> List[str]:
+    try:
+        chunks = list(iter_tabular_chunks(
+            file_content, filename, columns=columns, sample_fraction=sample_fraction, max_rows=max_rows
+        ))
         
         print(f"--- Successfully created {len(chunks)} row-chunks. ---")
         return chunks
         
     except Exception as e:
         print(f"!!! Error parsing [Tabular/Pandas] file {filename}: {e} !!!")
-        return []
\ No newline at end of file
+        return []
+
+def iter_tabular_batches(file_content, filename: str, columns: Optional[List[str]] = None,
+                         sample_fraction: Optional[float] = None, max_rows: Optional[int] = None) -> Iterator[List[str]]:
+    """
+    parse_tabular_file one block of row-chunks (TABULAR_BLOCK_ROWS rows) at a time, so a large
+    file can be streamed out of the parser process. An error ends the file early; the blocks
+    already yielded are kept.
+    """
+    start = time.perf_counter()
+    rows = 0
+    try:
+        for batch in _iter_tabular_row_blocks(file_content, filename, columns, sample_fraction, max_rows,
+                                              TABULAR_BLOCK_ROWS, 0):
+            rows += len(batch)
+            yield batch
+        print(f"--- Successfully created {rows} row-chunks. ---")
+    except Exception as e:
+        print(f"!!! Error parsing [Tabular/Pandas] file {filename} after {rows} rows: {e} !!!")
+    finally:
+        PARSER_SECONDS.labels(parser="tabular").observe(time.perf_counter() - start)
@@ -0,0 +1,26 @@
+import asyncio
+
+from src.chunk_store import ChunkStore
+from src.chunking import ChunkPacker
+from src.graph import prepare_chunks
+
+
+def test_packer_finish_ends_the_chunk():
+    packer = ChunkPacker(target_tokens=1000, max_tokens=2000)
+    assert packer.add("first file") == []
+    assert packer.finish() == ["first file"]
+    assert packer.add("second file") == []
+    assert packer.finish() == ["second file"]
+
+
+def test_small_files_are_not_packed_together():
+    files = [
+        {"filename": "a.py", "content": b"def a():\n    return 1\n"},
+        {"filename": "b.py", "content": b"def b():\n    return 2\n"},
+    ]
+    with ChunkStore() as store:
+        chunks = asyncio.run(prepare_chunks(files, "summarization", store))
+        texts = [store.get(chunk["ref"]) for chunk in chunks]
+    assert len(chunks) == 2
+    assert "def a()" in texts[0] and "def b()" not in texts[0]
+    assert "def b()" in texts[1]
@@ -0,0 +1,143 @@
+import asyncio
+import json
+from types import SimpleNamespace
+
+from sqlalchemy import select
+from sqlalchemy.ext.asyncio import create_async_engine, async_sessionmaker
+
+from src.database import Base
+from src.dedup import NearDuplicateIndex
+from src.models import ChunkCheckpoint
+from src.sharding import merge_shard_results, relocate_checkpoints
+from src.sink import JsonlResultSink, rejected_path_for, line_index_path_for
+
+QUESTIONS = [
+    "What is the boiling point of water at sea level?",
+    "Which planet in the solar system has the most moons?",
+    "How many bones are there in the adult human body?",
+]
+
+
+def _item(question):
+    return {"question": question, "answer": "A long enough answer."}
+
+
+def test_check_batch_flags_near_duplicates_from_other_sources():
+    index = NearDuplicateIndex("qna", scope="job")
+    first = asyncio.run(index.check_batch([_item(QUESTIONS[0])], ["a"]))
+    again = asyncio.run(index.check_batch([_item(QUESTIONS[0] + " ")], ["b"]))
+    same_source = asyncio.run(index.check_batch([_item(QUESTIONS[0])], ["a"]))
+    index.close()
+    assert first == [None]
+    assert again[0][0] == "job:a" and again[0][1] >= index.threshold
+    assert same_source == [None] # A chunk's own earlier items never count against it
+
+
+def test_prune_drops_entries_of_chunks_that_did_not_complete():
+    index = NearDuplicateIndex("qna", scope="job")
+    asyncio.run(index.check_batch([_item(QUESTIONS[0]), _item(QUESTIONS[1])], ["done", "cut"]))
+    removed = asyncio.run(index.prune({"done"}))
+    results = asyncio.run(index.check_batch([_item(QUESTIONS[0]), _item(QUESTIONS[1])], ["x", "y"]))
+    index.close()
+    assert removed == 1
+    assert results[0] is not None and results[0][0] == "job:done"
+    assert results[1] is None # Its original was cut back by the resume, so it's new again
+
+
+def test_prune_keeps_other_scopes(tmp_path):
+    path = str(tmp_path / "shared.sqlite")
+    other = NearDuplicateIndex("qna", path, scope="other-job")
+    asyncio.run(other.check_batch([_item(QUESTIONS[0])], ["c"]))
+    other.close()
+    index = NearDuplicateIndex("qna", path, scope="job")
+    assert asyncio.run(index.prune(())) == 0
+    assert asyncio.run(index.check_batch([_item(QUESTIONS[0])], ["d"]))[0][0] == "other-job:c"
+    index.close()
+
+
+def _shard(tmp_path, shard_index, questions):
+    result = tmp_path / f"{shard_index:05d}.jsonl"
+    sink = JsonlResultSink(str(result))
+    offsets = [sink.write(_item(question)) for question in questions]
+    sink.close()
+    shard = SimpleNamespace(shard_index=shard_index, result_file_path=str(result), result_offsets=dict(sink.offsets))
+    return shard, offsets
+
+
+def _questions(path):
+    with open(path, "rb") as f:
+        return [json.loads(line)["question"] for line in f]
+
+
+def test_merge_without_dedup_concatenates_and_shifts(tmp_path):
+    first, _ = _shard(tmp_path, 0, QUESTIONS[:2])
+    second, second_offsets = _shard(tmp_path, 1, QUESTIONS[:1])
+    result = str(tmp_path / "merged.jsonl")
+    offsets, duplicates, relocations = merge_shard_results([first, second], result)
+    assert duplicates == 0
+    assert _questions(result) == QUESTIONS[:2] + QUESTIONS[:1]
+    start = (tmp_path / "00000.jsonl").stat().st_size
+    assert list(relocations[1][1]) == [offset + start for offset in second_offsets]
+    with open(line_index_path_for(result), "rb") as index:
+        assert len(index.read()) == 3 * 8
+
+
+def test_merge_drops_cross_shard_duplicates(tmp_path):
+    first, _ = _shard(tmp_path, 0, QUESTIONS[:2])
+    second, _ = _shard(tmp_path, 1, [QUESTIONS[1], QUESTIONS[2]])
+    result = str(tmp_path / "merged.jsonl")
+    dedup = NearDuplicateIndex("qna", scope="job")
+    offsets, duplicates, relocations = merge_shard_results([first, second], result, dedup)
+    dedup.close()
+    assert duplicates == 1
+    assert _questions(result) == QUESTIONS
+    with open(rejected_path_for(result), "rb") as f:
+        rejected = [json.loads(line) for line in f]
+    assert rejected[0]["reason"] == "duplicate" and rejected[0]["duplicate_of"] == "job:shard-00000:1"
+    assert offsets["accepted"] == (tmp_path / "merged.jsonl").stat().st_size
+    assert list(relocations[1][1])[0] == -1 # The duplicate line has no place in the merged file
+
+
+def test_merge_cuts_shards_to_their_committed_offsets(tmp_path):
+    shard, offsets = _shard(tmp_path, 0, QUESTIONS)
+    shard.result_offsets = {"accepted": offsets[2], "rejected": 0} # Third line written after the last commit
+    result = str(tmp_path / "merged.jsonl")
+    merge_shard_results([shard], result, NearDuplicateIndex("qna", scope="job"))
+    assert _questions(result) == QUESTIONS[:2]
+
+
+def test_relocate_checkpoints_points_into_the_merged_file(tmp_path):
+    first, first_offsets = _shard(tmp_path, 0, QUESTIONS[:2])
+    second, second_offsets = _shard(tmp_path, 1, [QUESTIONS[1], QUESTIONS[2]])
+    for shard, ids in ((first, ["a", "b"]), (second, ["c", "d"])):
+        shard.chunks_path = str(tmp_path / f"{shard.shard_index:05d}.chunks.jsonl")
+        with open(shard.chunks_path, "w") as f:
+            f.writelines(json.dumps({"id": chunk_id, "text": ""}) + "\n" for chunk_id in ids)
+    result = str(tmp_path / "merged.jsonl")
+    _, _, relocations = merge_shard_results([first, second], result, NearDuplicateIndex("qna", scope="job"))
+
+    async def run():
+        engine = create_async_engine(f"sqlite+aiosqlite:///{tmp_path / 'db.sqlite'}")
+        async with engine.begin() as conn:
+            await conn.run_sync(Base.metadata.create_all)
+        sessions = async_sessionmaker(engine, expire_on_commit=False)
+        async with sessions() as session:
+            session.add_all(
+                ChunkCheckpoint(job_id=1, chunk_id=chunk_id, status="DONE", accepted=1, result_offset=offset)
+                for chunk_id, offset in zip("abcd", first_offsets + second_offsets)
+            )
+            await session.commit()
+            await relocate_checkpoints(session, 1, [first, second], relocations)
+            await session.commit()
+            rows = await session.execute(select(ChunkCheckpoint.chunk_id, ChunkCheckpoint.result_offset))
+            offsets = dict(rows.all())
+        await engine.dispose()
+        return offsets
+
+    offsets = asyncio.run(run())
+    with open(result, "rb") as f:
+        merged = f.read()
+    assert offsets["a"] == 0
+    assert offsets["c"] is None # Dropped as a duplicate of shard 0's line
+    for chunk_id, question in (("b", QUESTIONS[1]), ("d", QUESTIONS[2])):
+        assert json.loads(merged[offsets[chunk_id]:].split(b"\n", 1)[0])["question"] == question
@@ -0,0 +1,98 @@
+import asyncio
+import hashlib
+import io
+import json
+
+import pytest
+from fastapi import HTTPException, UploadFile
+
+from main import _parse_range, _line_slice, save_upload_file
+from src.sink import JsonlResultSink, line_index_path_for
+
+
+def test_parse_range_forms():
+    assert _parse_range(None, 100) is None
+    assert _parse_range("bytes=0-9", 100) == (0, 10)
+    assert _parse_range("bytes=90-", 100) == (90, 100)
+    assert _parse_range("bytes=-10", 100) == (90, 100)
+    assert _parse_range("bytes=50-500", 100) == (50, 100) # Clamped to the resource
+    assert _parse_range("bytes=0-1,5-6", 100) is None # Multi-range: full body
+    assert _parse_range("items=0-1", 100) is None
+
+
+def test_parse_range_last_before_first_serves_full_body():
+    assert _parse_range("bytes=10-5", 100) is None
+    assert _parse_range("bytes=500-5", 100) is None
+
+
+def test_parse_range_past_the_end_is_unsatisfiable():
+    for header in ("bytes=100-", "bytes=100-200", "bytes=150-"):
+        with pytest.raises(HTTPException) as excinfo:
+            _parse_range(header, 100)
+        assert excinfo.value.status_code == 416
+        assert excinfo.value.headers["Content-Range"] == "bytes */100"
+
+
+def _write_results(path, count):
+    sink = JsonlResultSink(str(path))
+    for i in range(count):
+        sink.write({"i": i})
+    sink.close()
+    return path.read_bytes()
+
+
+def _lines(data, start, end):
+    return [json.loads(line)["i"] for line in data[start:end].splitlines()]
+
+
+def test_line_slice_offset_and_limit(tmp_path):
+    data = _write_results(tmp_path / "result.jsonl", 10)
+    start, end, total = _line_slice(str(tmp_path / "result.jsonl"), len(data), 3, 4)
+    assert total == 10
+    assert _lines(data, start, end) == [3, 4, 5, 6]
+    start, end, _ = _line_slice(str(tmp_path / "result.jsonl"), len(data), 8, None)
+    assert _lines(data, start, end) == [8, 9]
+    start, end, _ = _line_slice(str(tmp_path / "result.jsonl"), len(data), 20, 5)
+    assert start == end == len(data)
+
+
+def test_line_slice_stops_at_the_snapshot_length(tmp_path):
+    data = _write_results(tmp_path / "result.jsonl", 10)
+    snapshot = data.index(b'{"i": 6}') # A running job's file, as of the status read
+    start, end, total = _line_slice(str(tmp_path / "result.jsonl"), snapshot, 4, 10)
+    assert total == 6
+    assert _lines(data, start, end) == [4, 5]
+
+
+def test_line_slice_with_a_lagging_index(tmp_path):
+    result = tmp_path / "result.jsonl"
+    data = _write_results(result, 10)
+    index_path = line_index_path_for(str(result))
+    with open(index_path, "r+b") as index:
+        index.truncate(6 * 8) # Only the first 6 lines indexed so far
+    start, end, total = _line_slice(str(result), len(data), 4, 5)
+    assert total == 6
+    assert _lines(data, start, end) == [4, 5] # Never past the limit into unindexed lines
+
+
+def test_line_slice_builds_a_missing_index(tmp_path):
+    result = tmp_path / "result.jsonl"
+    result.write_bytes(b"".join(json.dumps({"i": i}).encode() + b"\n" for i in range(5)))
+    start, end, total = _line_slice(str(result), result.stat().st_size, 1, 2)
+    assert total == 5
+    assert _lines(result.read_bytes(), start, end) == [1, 2]
+
+
+def test_save_upload_file_streams_and_hashes(tmp_path):
+    content = b"x" * 10_000
+    upload = UploadFile(io.BytesIO(content), filename="a.txt")
+    info = asyncio.run(save_upload_file(upload, str(tmp_path / "a.txt"), max_bytes=len(content)))
+    assert info == {"filename": "a.txt", "size": len(content), "sha256": hashlib.sha256(content).hexdigest()}
+    assert (tmp_path / "a.txt").read_bytes() == content
+
+
+def test_save_upload_file_rejects_oversized_uploads(tmp_path):
+    upload = UploadFile(io.BytesIO(b"x" * 10_000), filename="a.txt")
+    with pytest.raises(HTTPException) as excinfo:
+        asyncio.run(save_upload_file(upload, str(tmp_path / "a.txt"), max_bytes=9_999))
+    assert excinfo.value.status_code == 413
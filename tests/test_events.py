@@ -0,0 +1,102 @@
+import asyncio
+
+import pytest
+
+from src import events
+
+
+class FakePubSub:
+    def __init__(self, messages):
+        self.messages = list(messages)
+
+    async def subscribe(self, channel):
+        pass
+
+    async def get_message(self, ignore_subscribe_messages=True, timeout=None):
+        message = self.messages.pop(0) if self.messages else None
+        if isinstance(message, Exception):
+            raise message
+        return message
+
+    async def unsubscribe(self):
+        pass
+
+    async def aclose(self):
+        pass
+
+
+class FakeClient:
+    def __init__(self, pubsub):
+        self._pubsub = pubsub
+
+    def pubsub(self):
+        return self._pubsub
+
+
+def _collect(task_id, load_status):
+    async def run():
+        return [event async for event in events.job_event_stream(task_id, load_status)]
+    return asyncio.run(run())
+
+
+@pytest.fixture
+def subscribe(monkeypatch):
+    monkeypatch.setattr(events, "JOB_EVENTS_REDIS_URL", "redis://fake")
+
+    def install(messages):
+        monkeypatch.setattr(events, "_subscriber_client", lambda: FakeClient(FakePubSub(messages)))
+    return install
+
+
+def test_quiet_channel_ends_on_terminal_job_row(subscribe):
+    # The worker's COMPLETED event never arrived; the stream finds it in the job row instead
+    subscribe([None, None])
+    statuses = iter(["PROCESSING", "PROCESSING", "COMPLETED"])
+
+    async def load_status():
+        return events.status_event("t", next(statuses))
+
+    received = _collect("t", load_status)
+    assert [e["type"] for e in received] == ["status", "heartbeat", "status"]
+    assert received[-1]["status"] == "COMPLETED"
+
+
+def test_retrying_is_not_terminal(subscribe):
+    subscribe([{"data": '{"type": "status", "task_id": "t", "status": "RETRYING"}'},
+               {"data": '{"type": "status", "task_id": "t", "status": "FAILED"}'}])
+
+    async def load_status():
+        return events.status_event("t", "PROCESSING")
+
+    assert [e.get("status") for e in _collect("t", load_status)] == ["PROCESSING", "RETRYING", "FAILED"]
+
+
+def test_read_error_ends_stream_with_error_event(subscribe):
+    subscribe([ConnectionError("reset")])
+
+    async def load_status():
+        return events.status_event("t", "PROCESSING")
+
+    received = _collect("t", load_status)
+    assert received[-1]["type"] == "error"
+    assert "reset" in received[-1]["error"]
+
+
+def test_publisher_retries_after_a_failed_publish(monkeypatch):
+    publisher = events.JobEventPublisher("redis://fake")
+    calls = []
+
+    def publish(channel, payload):
+        calls.append(channel)
+        if len(calls) == 1:
+            raise ConnectionError("down")
+    monkeypatch.setattr(publisher, "_publish", publish)
+    clock = [100.0]
+    monkeypatch.setattr(events.time, "monotonic", lambda: clock[0])
+
+    event = events.status_event("t", "PROCESSING")
+    asyncio.run(publisher.publish(event)) # Fails
+    asyncio.run(publisher.publish(event)) # Skipped while backing off
+    clock[0] += events.JOB_EVENTS_REDIS_RETRY_SECONDS
+    asyncio.run(publisher.publish(event)) # Redis is tried again
+    assert len(calls) == 2
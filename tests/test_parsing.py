@@ -0,0 +1,29 @@
+import asyncio
+
+from src.chunk_store import ChunkStore
+from src.parsing import iter_parse_file_async, iter_parsed_files
+from src.utils import TABULAR_BLOCK_ROWS
+
+
+def _csv(rows: int) -> bytes:
+    return ("id,name\n" + "".join(f"{i},row{i}\n" for i in range(rows))).encode()
+
+
+def test_tabular_files_stream_in_blocks():
+    rows = TABULAR_BLOCK_ROWS * 2 + 5
+
+    async def run():
+        return [len(batch) async for batch in iter_parse_file_async("big.csv", _csv(rows))]
+    assert asyncio.run(run()) == [TABULAR_BLOCK_ROWS, TABULAR_BLOCK_ROWS, 5]
+
+
+def test_parsed_files_go_into_the_store():
+    files = [{"filename": "t.csv", "content": _csv(3)}, {"filename": "m.py", "content": b"def f():\n    return 1\n"}]
+
+    async def run(store):
+        return {filename: refs async for filename, refs in iter_parsed_files(files, store=store)}
+    with ChunkStore() as store:
+        parsed = asyncio.run(run(store))
+        assert [store.get(ref) for ref in parsed["t.csv"]] == ['{"id":0,"name":"row0"}', '{"id":1,"name":"row1"}',
+                                                               '{"id":2,"name":"row2"}']
+        assert "def f()" in store.get(parsed["m.py"][0])
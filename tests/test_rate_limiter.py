@@ -0,0 +1,92 @@
+import asyncio
+
+from src import rate_limiter
+from src.rate_limiter import AdaptiveRateLimiter, LocalBackend
+
+
+class FlakyRedisBackend:
+    """Stands in for RedisBackend; raises ConnectionError while down."""
+
+    def __init__(self):
+        self.down = False
+        self.in_flight = set()
+
+    def _check(self):
+        if self.down:
+            raise ConnectionError("redis down")
+
+    async def try_acquire(self, lease_id, tokens):
+        self._check()
+        self.in_flight.add(lease_id)
+        return 0
+
+    async def release(self, lease_id):
+        self._check()
+        self.in_flight.discard(lease_id)
+
+
+def _limiter(redis):
+    limiter = AdaptiveRateLimiter(redis_url="redis://fake", rpm=1000, tpm=1_000_000, min_concurrency=1,
+                                  max_concurrency=4, initial_concurrency=4)
+    # Same selection rule as the real _backend(): Redis unless it's in its retry back-off
+    limiter._backend = lambda: limiter._local if rate_limiter.time.monotonic() < limiter._redis_retry_at else redis
+    return limiter
+
+
+def test_local_lease_is_released_locally_after_redis_recovers():
+    redis = FlakyRedisBackend()
+    limiter = _limiter(redis)
+
+    async def run():
+        redis.down = True
+        async with limiter.limit(10):
+            assert len(limiter._local.in_flight) == 1
+            redis.down = False
+            limiter._redis_retry_at = 0 # Redis is back before the call ends
+    asyncio.run(run())
+    assert limiter._local.in_flight == set()
+    assert redis.in_flight == set()
+
+
+def test_redis_lease_is_released_on_redis():
+    redis = FlakyRedisBackend()
+    limiter = _limiter(redis)
+
+    async def run():
+        async with limiter.limit(10):
+            assert len(redis.in_flight) == 1
+            limiter._redis_retry_at = rate_limiter.time.monotonic() + 60 # e.g. another call failed over
+    asyncio.run(run())
+    assert redis.in_flight == set()
+    assert limiter._local.in_flight == set()
+
+
+def test_redis_errors_fall_back_to_local_until_retry_time(monkeypatch):
+    redis = FlakyRedisBackend()
+    limiter = _limiter(redis)
+    clock = [1000.0]
+    monkeypatch.setattr(rate_limiter.time, "monotonic", lambda: clock[0])
+
+    async def acquire_release():
+        async with limiter.limit(1):
+            return set(limiter._local.in_flight), set(redis.in_flight)
+
+    redis.down = True
+    local, _ = asyncio.run(acquire_release())
+    assert len(local) == 1
+    redis.down = False
+    local, _ = asyncio.run(acquire_release()) # Still backing off
+    assert len(local) == 1
+    clock[0] += rate_limiter.RATE_LIMIT_REDIS_RETRY_SECONDS
+    local, remote = asyncio.run(acquire_release())
+    assert local == set() and len(remote) == 1
+
+
+def test_local_token_corrections_never_go_negative():
+    backend = LocalBackend(rpm=10, tpm=100, min_limit=1, max_limit=4, initial_limit=2)
+
+    async def run():
+        assert await backend.try_acquire("a", 30) == 0
+        await backend.adjust_tokens(-50)
+    asyncio.run(run())
+    assert backend.window_tokens == 0
@@ -1,74 +1,368 @@
 #Sets up Celeray background worker that runs the entire LangGraph pipeline asynchronously
 
-from celery import Celery
+from celery import chain, chord, group
+from celery.signals import worker_init, worker_process_init, worker_process_shutdown, worker_shutdown
 import asyncio
 import os 
-from src.graph import run_graph
+from src.graph import run_graph, prepare_chunks
+from src.chunk_store import ChunkStore, chunk_store_dir_for
+from src.generation import get_timing_stats
+from src.cache import get_result_cache
+from src.sink import JsonlResultSink
+from src.checkpoint import CheckpointRecorder
+from src.progress import JobProgress
+from src.dedup import open_job_index
+from src.events import publish_job_event, status_event
+from src.exports import write_exports, parse_exports, RESULT_EXPORTS
+from src.archives import is_archive
+from src.task_queue import (
+    create_celery_app, JOB_QUEUE, SHARD_QUEUE, PROCESS_DATASET_TASK, PROCESS_SHARD_TASK, MERGE_SHARDS_TASK,
+)
+from src.sharding import (
+    SHARD_MIN_CHUNKS, SHARD_MAX_RETRIES, SHARD_RETRY_DELAY_SECONDS, MERGE_PRIORITY,
+    sharding_enabled, shard_priority, plan_lanes, load_shards, create_shards, iter_shard_chunks,
+    merge_shard_results, merge_shard_stats, relocate_checkpoints, remove_shard_files, shard_index_path_for,
+)
+from src.runtime import get_runtime, run_async
+from src.metrics import job_profiler, get_registry, mark_process_dead
+from prometheus_client import start_http_server
 from sqlalchemy.ext.asyncio import async_sessionmaker
 from sqlalchemy import select
 from src.database import engine
-from src.models import Job
-import json
+from src.models import Job, JobShard
+from src.progress import merge_progress
 
-# Configure Celery. The broker is Redis, which acts as the message queue.
-celery_app = Celery('tasks', broker='redis://localhost:6379/0')
+# Configure Celery. The broker is Redis, which acts as the message queue (settings in src/task_queue.py,
+# shared with the API, which sends tasks by name).
+celery_app = create_celery_app()
 
 # Create a session maker for the worker
 AsyncSessionLocal = async_sessionmaker(engine, expire_on_commit=False)
 
+JOB_MAX_RETRIES = 3
+JOB_RETRY_DELAY_SECONDS = 300
+
 # Define storage paths
 UPLOAD_DIR = "/tmp/uploads"
 RESULT_DIR = "/tmp/results"
 os.makedirs(UPLOAD_DIR, exist_ok=True)
 os.makedirs(RESULT_DIR, exist_ok=True)
 
-@celery_app.task(bind = True)
+# Prometheus metrics for the worker pool. Set PROMETHEUS_MULTIPROC_DIR so the pool processes'
+# metrics are aggregated (and visible from the API's /metrics if the directory is shared).
+WORKER_METRICS_PORT = os.environ.get("WORKER_METRICS_PORT")
+
+@worker_init.connect
+def start_metrics_server(**kwargs):
+    if WORKER_METRICS_PORT:
+        start_http_server(int(WORKER_METRICS_PORT), registry=get_registry())
+
+@worker_process_init.connect
+def start_runtime(**kwargs):
+    # Each pool process gets its own loop, DB pool and LLM clients, started after the fork
+    get_runtime().start()
+
+@worker_process_shutdown.connect
+def cleanup_process_metrics(pid=None, **kwargs):
+    get_runtime().stop()
+    mark_process_dead(pid or os.getpid())
+
+@worker_shutdown.connect
+def stop_runtime(**kwargs):
+    # Solo and thread pools run tasks in the main process, which gets no worker_process_* signals
+    get_runtime().stop()
+
+@celery_app.task(bind = True, name=PROCESS_DATASET_TASK)
 def process_dataset_task(self, job_id: int):
     """
     This is the Celery task that will run our async graph in the background.
     """
+    # Thread-local: read here, not on the runtime's thread
+    celery_task_id, retries = self.request.id, self.request.retries
+
     async def _process():
         async with AsyncSessionLocal() as session:
+            store = None
             try:
                 job_query = await session.execute(select(Job).where(Job.id == job_id))
                 job = job_query.scalar_one()
                 job.status = "PROCESSING"
+                job.error_message = None # From an earlier attempt
+                job.celery_task_id = celery_task_id
                 await session.commit()
+                await publish_job_event(status_event(job.task_id, "PROCESSING"))
 
                 # 2. Reconstruct the 'files_to_process' from stored files
-                # (This is simplified; in production, you'd store file paths in the DB)
-                files_to_process = []
-                # Assuming task_id is used as a folder for simplicity
+                # The upload manifest on the Job lists the files; fall back to the folder listing
+                # for jobs created before the manifest existed. Files are only read (and archives
+                # only extracted) when the parsing stage gets to them.
                 job_upload_dir = os.path.join(UPLOAD_DIR, job.task_id)
-                for filename in os.listdir(job_upload_dir):
-                    with open(os.path.join(job_upload_dir, filename), "rb") as f:
-                        files_to_process.append({"filename": filename, "content": f.read()})
-                
-                # 3. Run the LangGraph pipeline
-                final_state = await run_graph(files_to_process, job.recipe)         
+                filenames = [f["filename"] for f in job.files] if job.files else os.listdir(job_upload_dir)
+                files_to_process = [
+                    {"filename": filename, "path": os.path.join(job_upload_dir, filename)} for filename in filenames
+                ]
+                # Archive members are added to files_total as they're extracted
+                files_total = sum(1 for filename in filenames if not is_archive(filename))
+                # Chunk text is spilled to disk under the job's directory; the graph only passes refs around
+                store = ChunkStore(chunk_store_dir_for(RESULT_DIR, job.task_id))
+
+                # Sharding: parse once here; a large job is handed to shard tasks from this point
+                chunks, parse_counters = None, None
+                if sharding_enabled(job.options):
+                    chunks, parse_counters, dispatched = await _shard_job(session, job, files_to_process,
+                                                                          files_total, store)
+                    if dispatched:
+                        return {"status": "SHARDED", "shards": dispatched}
                 
+                # 3. Run the LangGraph pipeline, streaming results to disk as they pass QC.
+                # The path is recorded up front so partial results can be downloaded.
                 result_filename = f"{job.task_id}.jsonl"
                 result_file_path = os.path.join(RESULT_DIR, result_filename)
-                with open(result_file_path, "w") as f:
-                    for item in final_state.get("generated_data", []):
-                        f.write(json.dumps(item) + "\n")
+                job.result_file_path = result_file_path
+                await session.commit()
+
+                # A retry or resume continues from the last checkpoint: the result files are cut
+                # back to the committed offsets and completed chunks are skipped
+                # The per-job dedup index also survives retries, so resumed chunks are checked
+                # against everything kept before the failure (and only that: entries of chunks
+                # that weren't checkpointed are pruned, like their results)
+                dedup = open_job_index(job.recipe, job.task_id, RESULT_DIR, job.options)
+                finished = False
+                with JsonlResultSink(result_file_path, resume_offsets=job.result_offsets) as sink:
+                    checkpoints = CheckpointRecorder(AsyncSessionLocal, job.id, sink)
+                    await checkpoints.load()
+                    if dedup is not None:
+                        pruned = await dedup.prune(checkpoints.completed)
+                        if pruned:
+                            print(f"--- Job {job_id}: pruned {pruned} dedup entries of unfinished chunks ---")
+                    try:
+                        profile_path = os.path.join(RESULT_DIR, f"{job.task_id}.prof")
+                        with job_profiler((job.options or {}).get("profile", False), profile_path):
+                            async with JobProgress(AsyncSessionLocal, job.id, files_total=files_total,
+                                                   task_id=job.task_id) as progress:
+                                if parse_counters:
+                                    progress.counters.update(parse_counters)
+                                # Already parsed when sharding was considered
+                                final_state = await run_graph(files_to_process if chunks is None else [], job.recipe,
+                                                job.options, sink=sink, checkpoints=checkpoints, progress=progress,
+                                                dedup=dedup, chunks=chunks, store=store)
+                        _raise_if_rate_limited(final_state)
+                        finished = True
+                    finally:
+                        try:
+                            await checkpoints.flush()
+                        except Exception as flush_e:
+                            finished = False
+                            print(f"!!! Job {job_id}: final checkpoint flush failed: {flush_e} !!!")
+                        if dedup is not None:
+                            dedup.close(remove=finished)
+                print(f"--- Job {job_id}: {sink.counts['accepted']} items written, {sink.counts['rejected']} rejected ---")
+                print(f"--- Job {job_id} QC rejections by rule: {final_state.get('qc_rejections') or {}}, "
+                      f"near-duplicates dropped: {final_state.get('stats', {}).get('duplicates', 0)} ---")
+                print(f"--- Job {job_id} LLM timing (process totals): {get_timing_stats()} ---")
+                if get_result_cache():
+                    print(f"--- Job {job_id} result cache (process totals): {get_result_cache().get_stats()} ---")
+
+                # 4. Compressed / columnar copies of the finished result, if requested
+                await _write_job_exports(job, result_file_path)
 
                 # 5. Update job status to COMPLETED
                 job.status = "COMPLETED"
-                job.result_file_path = result_file_path
                 await session.commit()
+                await publish_job_event(status_event(job.task_id, "COMPLETED", progress=progress.snapshot()))
                 print(f"--- Job {job_id} ({job.task_id}) COMPLETED ---")
                 return {"status": "COMPLETED", "result_path": result_file_path}
             
             except Exception as e:
+                # Until the last retry has failed the job is RETRYING, not FAILED: a FAILED job
+                # can be resumed, which would start a second task on the same result files.
+                retrying = retries < JOB_MAX_RETRIES
+                print(f"!!! Job {job_id} {'failed, retrying' if retrying else 'FAILED'}: {e} !!!")
+                job.status = "RETRYING" if retrying else "FAILED"
+                job.error_message = str(e)
+                await session.commit()
+                await publish_job_event(status_event(job.task_id, job.status, error=job.error_message))
+                raise
+            finally:
+                if store is not None:
+                    store.close() # Re-parsed by a retry or resume
+    
+    try:
+        return run_async(_process())
+    except Exception as e:
+        # Retry the task up to JOB_MAX_RETRIES times, with a 5-minute delay. Retries resume from
+        # the job's chunk checkpoints instead of starting over. Retried from here, not from
+        # _process: the task's request is thread-local, and _process runs on the runtime's thread.
+        raise self.retry(exc=e, countdown=JOB_RETRY_DELAY_SECONDS, max_retries=JOB_MAX_RETRIES)
+
+def _raise_if_rate_limited(final_state: dict):
+    # Chunks still rate limited after their retries were recorded as failed; failing the attempt
+    # (rather than completing without them) gets them redone by the task's retry or a resume
+    rate_limited = final_state.get("stats", {}).get("rate_limited", 0)
+    if rate_limited:
+        raise RuntimeError(f"{rate_limited} chunks were still rate limited after retries")
+
+async def _write_job_exports(job, result_file_path: str):
+    export_formats = (job.options or {}).get("exports")
+    if export_formats is None:
+        try:
+            export_formats = parse_exports(RESULT_EXPORTS)
+        except ValueError as export_e:
+            print(f"!!! RESULT_EXPORTS ignored: {export_e} !!!")
+            export_formats = []
+    if export_formats:
+        exported = await asyncio.to_thread(write_exports, result_file_path, job.recipe, export_formats)
+        print(f"--- Job {job.id} exports written: {sorted(exported)} ---")
+
+async def _shard_job(session, job, files_to_process, files_total, store):
+    """
+    Parses the job and, if it's large, splits it into shards and dispatches them. Returns
+    (chunks, parse_counters, shards_dispatched); a small job comes back with its chunks (text in
+    store) for the caller to run in-process. A resumed job reuses its shards and re-dispatches the unfinished ones.
+    """
+    shards = await load_shards(session, job.id)
+    if not shards:
+        async with JobProgress(AsyncSessionLocal, job.id, files_total=files_total, task_id=job.task_id) as progress:
+            chunks = await prepare_chunks(files_to_process, job.recipe, store, job.options, progress=progress)
+            progress.add("chunks_total", len(chunks))
+        parse_counters = {key: progress.counters[key] for key in ("files_total", "files_parsed")}
+        if len(chunks) <= SHARD_MIN_CHUNKS:
+            return chunks, parse_counters, 0
+        shards = await create_shards(session, job, chunks, store, RESULT_DIR)
+
+    pending = [shard.id for shard in shards if shard.status != "COMPLETED"]
+    # Broker I/O; also lets eager mode (tests, benchmarks) run the shard tasks' own event loops
+    await asyncio.to_thread(dispatch_shards, job.id, pending, len(shards))
+    print(f"--- Job {job.id} ({job.task_id}): dispatched {len(pending)} of {len(shards)} shards ---")
+    return None, None, len(pending)
+
+def dispatch_shards(job_id: int, shard_ids: list, total_shards: int):
+    # A chord over per-lane chains: at most SHARD_MAX_CONCURRENCY shards of this job run at once,
+    # and the merge runs once every lane is done
+    priority = shard_priority(total_shards)
+    lanes = [
+        chain(*(process_shard_task.si(shard_id).set(queue=SHARD_QUEUE, priority=priority) for shard_id in lane))
+        for lane in plan_lanes(shard_ids)
+    ]
+    merge = merge_shards_task.si(job_id).set(queue=JOB_QUEUE, priority=MERGE_PRIORITY)
+    if lanes:
+        chord(group(lanes))(merge)
+    else:
+        merge.apply_async()
+
+@celery_app.task(bind = True, name=PROCESS_SHARD_TASK)
+def process_shard_task(self, shard_id: int):
+    """
+    Runs generation, QC and dedup over one shard's chunks, into the shard's own result files.
+    Retries resume from the job's chunk checkpoints. Once retries are exhausted the shard is
+    marked FAILED but the task still returns, so its lane carries on and the merge runs.
+    """
+    retries = self.request.retries # Thread-local: read here, not on the runtime's thread
+
+    async def _process():
+        async with AsyncSessionLocal() as session:
+            shard = (await session.execute(select(JobShard).where(JobShard.id == shard_id))).scalar_one()
+            job = (await session.execute(select(Job).where(Job.id == shard.job_id))).scalar_one()
+            try:
+                shard.status = "PROCESSING"
+                shard.error_message = None
+                await session.commit()
+
+                # Each shard dedups against its own index; the merge dedups across shards
+                dedup = open_job_index(job.recipe, job.task_id, RESULT_DIR, job.options,
+                                       path=shard_index_path_for(shard))
+                with JsonlResultSink(shard.result_file_path, resume_offsets=shard.result_offsets) as sink:
+                    checkpoints = CheckpointRecorder(AsyncSessionLocal, job.id, sink, shard_id=shard.id)
+                    await checkpoints.load()
+                    if dedup is not None:
+                        await dedup.prune(checkpoints.completed)
+                    try:
+                        async with JobProgress(AsyncSessionLocal, job.id, task_id=job.task_id,
+                                               shard_id=shard.id) as progress:
+                            final_state = await run_graph([], job.recipe, job.options, sink=sink, checkpoints=checkpoints,
+                                                          progress=progress, dedup=dedup,
+                                                          chunks=iter_shard_chunks(shard.chunks_path))
+                        _raise_if_rate_limited(final_state)
+                    finally:
+                        await checkpoints.flush()
+                        if dedup is not None:
+                            dedup.close() # Kept for retries; removed with the shard files
+
+                shard.status = "COMPLETED"
+                shard.stats = {**final_state.get("stats", {}), "qc_rejections": final_state.get("qc_rejections") or {}}
+                await session.commit()
+                print(f"--- Job {job.id} shard {shard.shard_index}: {sink.counts['accepted']} items written ---")
+                return {"status": "COMPLETED", "shard_id": shard_id}
+
+            except Exception as e:
+                print(f"!!! Job {job.id} shard {shard.shard_index} FAILED: {e} !!!")
+                shard.status = "FAILED"
+                shard.error_message = str(e)
+                await session.commit()
+                if retries >= SHARD_MAX_RETRIES:
+                    return {"status": "FAILED", "shard_id": shard_id}
+                raise
+
+    try:
+        return run_async(_process())
+    except Exception as e:
+        raise self.retry(exc=e, countdown=SHARD_RETRY_DELAY_SECONDS, max_retries=SHARD_MAX_RETRIES)
+
+@celery_app.task(bind = True, name=MERGE_SHARDS_TASK)
+def merge_shards_task(self, job_id: int):
+    """Chord callback of a sharded job: concatenates the shard results and finishes the Job row."""
+    async def _process():
+        async with AsyncSessionLocal() as session:
+            job = (await session.execute(select(Job).where(Job.id == job_id))).scalar_one()
+            shards = await load_shards(session, job_id)
+            try:
+                failed = [shard for shard in shards if shard.status != "COMPLETED"]
+                if failed:
+                    raise RuntimeError(f"{len(failed)} of {len(shards)} shards failed, e.g. shard "
+                                       f"{failed[0].shard_index}: {failed[0].error_message}")
+
+                result_file_path = os.path.join(RESULT_DIR, f"{job.task_id}.jsonl")
+                dedup = open_job_index(job.recipe, job.task_id, RESULT_DIR, job.options)
+                try:
+                    if dedup is not None:
+                        await dedup.prune(()) # Entries of an earlier, interrupted merge
+                    job.result_offsets, duplicates, relocations = await asyncio.to_thread(
+                        merge_shard_results, shards, result_file_path, dedup)
+                finally:
+                    if dedup is not None:
+                        dedup.close()
+                await relocate_checkpoints(session, job_id, shards, relocations)
+                job.result_file_path = result_file_path
+                stats = merge_shard_stats(shards)
+                stats["accepted"] -= duplicates
+                stats["duplicates"] += duplicates
+                print(f"--- Job {job_id}: merged {len(shards)} shards, {stats['accepted']} items written, "
+                      f"{stats['rejected']} rejected by QC {stats['qc_rejections']}, "
+                      f"{stats['duplicates']} near-duplicates dropped ---")
+                await _write_job_exports(job, result_file_path)
+
+                job.progress = merge_progress(job.progress, [(shard.status, shard.progress) for shard in shards])
+                job.status = "COMPLETED"
+                job.error_message = None # From an earlier attempt
+                await session.commit()
+                await publish_job_event(status_event(job.task_id, "COMPLETED", progress=job.progress))
+                dedup = open_job_index(job.recipe, job.task_id, RESULT_DIR, job.options)
+                if dedup is not None:
+                    dedup.close(remove=True)
+                remove_shard_files(RESULT_DIR, job.task_id)
+                print(f"--- Job {job_id} ({job.task_id}) COMPLETED ---")
+                return {"status": "COMPLETED", "result_path": result_file_path}
+
+            except Exception as e:
+                # Resuming the job re-dispatches only the shards that didn't complete
                 print(f"!!! Job {job_id} FAILED: {e} !!!")
                 job.status = "FAILED"
                 job.error_message = str(e)
                 await session.commit()
-                # Retry the task up to 3 times, with a 5-minute delay
-                raise self.retry(exc=e, countdown=300, max_retries=3)
-    
-    return asyncio.run(_process())
+                await publish_job_event(status_event(job.task_id, "FAILED", error=job.error_message))
+                return {"status": "FAILED", "error": str(e)}
+
+    return run_async(_process())
 
 
             